@@ -0,0 +1,374 @@
+'''
+Program: benchmarks.py
+Benchmarks for the simulation back end.
+Run `python benchmarks.py` for every benchmark or
+`python benchmarks.py <name> [<name> ...]` for a subset.
+'''
+import sys
+import time
+import statistics
+import subprocess
+
+
+def bench_worker_startup(repeat=5, num_workers=4):
+    """Process start-to-ready latency of the worker pool"""
+    from pool import WorkerPool
+
+    latencies = []
+    for i in range(0, repeat):
+        pool = WorkerPool(num_workers=num_workers)
+        latencies.append(pool.start())
+        pool.stop()
+
+    # the first start also boots the forkserver so report it separately
+    return {
+        'workers': num_workers,
+        'first_start_s': latencies[0],
+        'warm_start_median_s': statistics.median(latencies[1:] or latencies),
+    }
+
+
+def bench_import_time(repeat=5):
+    """Import time of the physics modules and of graphics, each in a fresh
+    interpreter. Neither should need a display."""
+    code = ("import time; t = time.perf_counter(); import {0}; "
+            "print(time.perf_counter() - t)")
+    result = {}
+    for label, modules in [('physics', 'collision, particles, walls, worker'),
+                           ('graphics', 'graphics')]:
+        times = []
+        for i in range(0, repeat):
+            out = subprocess.run([sys.executable, '-c', code.format(modules)],
+                                 check=True, stdout=subprocess.PIPE, universal_newlines=True)
+            times.append(float(out.stdout))
+        result[label + '_import_median_s'] = statistics.median(times)
+    return result
+
+
+def bench_placement(n=100000):
+    """Non-overlapping placement of n particles, equal and mixed sizes"""
+    import placement
+
+    box = (0.0, 0.0, 10000.0, 10000.0)
+    result = {}
+    for label, extents in [('equal', [5.0] * n),
+                           ('mixed', [3.0] * (3*n//10) + [5.0] * (n//2) + [10.0] * (n//5))]:
+        start = time.perf_counter()
+        placement.place(extents, box)
+        result[label + '_s'] = time.perf_counter() - start
+    return result
+
+
+def bench_scenario_load(repeat=200, path='scenarios/wallsaplenty.yml'):
+    """Loading a scenario from YAML versus from the compiled cache"""
+    import tempfile
+    import file_utils
+    import scenario_cache
+
+    cache_dir = tempfile.mkdtemp()
+    scenario_cache.load(path, cache_dir)  # compile once
+    result = {}
+    for label, load in [('yaml', lambda: file_utils.load_config(path)),
+                        ('cached', lambda: scenario_cache.load(path, cache_dir))]:
+        start = time.perf_counter()
+        for i in range(0, repeat):
+            load()
+        result[label + '_load_s'] = (time.perf_counter() - start) / repeat
+    return result
+
+
+def bench_prediction(n=200, seed=1):
+    """Average cost of one pairwise timeToHit call for circle and square particles"""
+    import random
+    from particles import Particle, RectParticle
+    from simulation import Bounds
+
+    random.seed(seed)
+    window = Bounds(1024, 768)
+    result = {}
+    for label, cls in [('circle', Particle), ('square', RectParticle)]:
+        particles = [cls(i, window, radius=5.0) for i in range(0, n)]
+        start = time.perf_counter()
+        for a in particles:
+            for b in particles:
+                a.timeToHit(b)
+        result[label + '_pair_us'] = (time.perf_counter() - start) / (n * n) * 1e6
+
+    from walls import LineSegment
+    from math_utils import Point
+    line = LineSegment(Point(100.0, 100.0), Point(900.0, 600.0))
+    particles = [Particle(i, window, radius=5.0) for i in range(0, n)]
+    start = time.perf_counter()
+    for i in range(0, 10):
+        for a in particles:
+            a.timeToHitLineSegment(line)
+    result['circle_segment_us'] = (time.perf_counter() - start) / (10 * n) * 1e6
+    return result
+
+
+def bench_neighbor_lists(scale=50, duration=1.0, sample=50, seed=1):
+    """200hundred and crazy with scale times the particles in scale times the
+    area. Compares one prediction scanning every particle with one scanning
+    the neighbor list, then runs the scenario with neighbor lists"""
+    import math
+    import queue
+    import random
+    import scenario_cache
+    from collision import CollisionSystem
+    from simulation import Simulation, Bounds, PREDICTION_LIMIT
+
+    result = {}
+    for name in ['200hundred', 'crazy']:
+        config_data = scenario_cache.load('scenarios/{0}.yml'.format(name))
+        for key in config_data['particles']:
+            config_data['particles'][key]['n'] *= scale
+        side = math.sqrt(scale)
+        random.seed(seed)
+        start = time.perf_counter()
+        sim = Simulation(config_data, Bounds(int(1024 * side), int(768 * side)))
+        result[name + '_particles'] = len(sim.particles)
+        result[name + '_setup_s'] = time.perf_counter() - start
+        result[name + '_mean_neighbors'] = (sum([len(p.neighbors) for p in sim.particles]) /
+                                            float(len(sim.particles)))
+
+        discard = queue.SimpleQueue()
+        picked = random.sample(sim.particles, sample)
+        for label in ['all', 'list']:
+            start = time.perf_counter()
+            for p in picked:
+                neighbors = p.neighbors
+                if label == 'all':
+                    p.neighbors = None
+                CollisionSystem.predict(p, 0.0, PREDICTION_LIMIT, sim.particles, sim.walls, discard)
+                p.neighbors = neighbors
+            result['{0}_predict_{1}_us'.format(name, label)] = \
+                (time.perf_counter() - start) / sample * 1e6
+
+        start = time.perf_counter()
+        sim.run(duration)
+        result[name + '_run_s_per_sim_s'] = (time.perf_counter() - start) / duration
+        result[name + '_list_rebuilds'] = sim.neighbors.rebuilds
+    return result
+
+
+def bench_obstacles(repeat=5, duration=3.0, seed=1):
+    """Porous with and without its obstacles, with the neighbor lists the
+    obstacles turn on in both: the cost of predicting every particle once,
+    and of running the scenario"""
+    import queue
+    import random
+    import warnings
+    import file_utils
+    from collision import CollisionSystem
+    from simulation import Simulation, Bounds, PREDICTION_LIMIT
+
+    config_data = file_utils.load_config('scenarios/porous.yml')
+    result = {}
+    skin = None
+    for label, obstacles in [('obstacles', config_data['obstacles']), ('none', {})]:
+        random.seed(seed)
+        sim = Simulation(dict(config_data, obstacles=obstacles), Bounds(1024, 768),
+                         neighbor_skin=skin)
+        skin = sim.neighbors.skin
+        discard = queue.SimpleQueue()
+        start = time.perf_counter()
+        for i in range(0, repeat):
+            for p in sim.particles:
+                CollisionSystem.predict(p, 0.0, PREDICTION_LIMIT, sim.particles, sim.walls, discard)
+        result[label + '_predict_us'] = \
+            (time.perf_counter() - start) / (repeat * len(sim.particles)) * 1e6
+        result[label + '_walls'] = len(sim.walls)
+        start = time.perf_counter()
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            sim.run(duration)
+        result[label + '_run_s_per_sim_s'] = (time.perf_counter() - start) / duration
+        result[label + '_events'] = sim.events_processed
+    return result
+
+
+def bench_engines(fractions=(0.05, 0.3, 0.6), duration=0.25, seed=1):
+    """Simulated seconds per wall second of the event driven and time stepped
+    engines on equal discs filling more and more of the window"""
+    import math
+    import random
+    from simulation import Simulation, Bounds
+
+    width, height, radius = 1024, 768, 5.0
+    result = {}
+    for fraction in fractions:
+        n = int(fraction * width * height / (math.pi * radius * radius))
+        config_data = {'particles': {'1': {'n': n, 'radius': radius, 'mass': 1.0,
+                                           'color': 'red', 'shape': 'Circle'}}}
+        for engine in ['event', 'stepped']:
+            random.seed(seed)
+            sim = Simulation(config_data, Bounds(width, height), engine=engine)
+            sim.run(duration)
+            result['{0}_{1}_sim_s_per_s'.format(engine, fraction)] = duration / sim.wall_time
+    return result
+
+
+def bench_watchdog(scenarios=('standard', 'crazy', 'porous'), duration=10.0, seed=1):
+    """Share of the wall time the watchdog takes, and the problems it finds"""
+    import random
+    import warnings
+    import file_utils
+    from simulation import Simulation, Bounds
+
+    result = {}
+    for name in scenarios:
+        for engine in ['event', 'stepped']:
+            random.seed(seed)
+            sim = Simulation(file_utils.load_config('scenarios/{0}.yml'.format(name)),
+                             Bounds(1024, 768), engine=engine)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                sim.run(duration)
+            key = '{0}_{1}'.format(name, engine)
+            result[key + '_overhead'] = sim.watchdog.overhead()
+            result[key + '_checks'] = sim.watchdog.checks
+            result[key + '_violations'] = len(sim.watchdog.violations)
+    return result
+
+
+def bench_memory(n=20000, frames=10, seed=1):
+    """Bytes per particle of the particle objects, the stepped engine's state
+    and one recorded frame, in each precision"""
+    import random
+    import tracemalloc
+    from simulation import Simulation, Bounds
+    from stepped import SteppedEngine
+    from recorder import TrajectoryRecorder
+
+    config_data = {'particles': {'1': {'n': n, 'radius': 1.0, 'mass': 1.0,
+                                       'color': 'red', 'shape': 'Circle'}}}
+    random.seed(seed)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sim = Simulation(config_data, Bounds(4096, 4096), engine='stepped', watchdog=False)
+    result = {'simulation_bytes_per_particle': (tracemalloc.get_traced_memory()[0] - before) / n}
+    for precision in ['float64', 'float32']:
+        before = tracemalloc.get_traced_memory()[0]
+        engine = SteppedEngine(sim.particles, sim.walls, precision=precision)
+        result['stepped_{0}_bytes_per_particle'.format(precision)] = \
+            (tracemalloc.get_traced_memory()[0] - before) / n
+        recorder = TrajectoryRecorder(sim.particles, 0.1, precision)
+        for i in range(0, frames):
+            recorder.sample(i * 0.1, (engine.x, engine.y))
+        result['frame_{0}_bytes_per_particle'.format(precision)] = recorder.nbytes() / frames / n
+        del engine, recorder
+    tracemalloc.stop()
+    return result
+
+
+def bench_transport(scenario='200hundred', ticks=120, num_workers=2, seed=1):
+    """Wall time of a simulation whose predictions go through the worker
+    pool by shared memory rings and by multiprocessing queues. The 'block'
+    late policy makes both runs do the same work."""
+    import random
+    import warnings
+    import file_utils
+    import ring
+    from pool import WorkerPool
+    from simulation import Simulation, Bounds
+
+    result = {}
+    transports = ['ring', 'queue'] if ring.available() else ['queue']
+    for transport in transports:
+        pool = WorkerPool(num_workers=num_workers, transport=transport)
+        pool.start()
+        random.seed(seed)
+        sim = Simulation(file_utils.load_config('scenarios/{0}.yml'.format(scenario)),
+                         Bounds(1024, 768), pool.work_requested_q, pool.work_completed_q,
+                         late_policy='block')
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            for i in range(0, ticks):
+                sim.tick()
+        pool.stop()
+        result[transport + '_wall_s'] = sim.wall_time
+        result[transport + '_predictions'] = sim.tracker.requested
+    return result
+
+
+def bench_domains(n=200000, worker_counts=(2, 4, 8, 16), ticks=20, fraction=0.05, seed=1):
+    """Wall time per tick of a box of n equal discs filling fraction of it,
+    its predictions computed by 2 to 16 workers that each own a slab of the
+    box, and in the main process alone. The 'block' late policy makes every
+    run do the same work."""
+    import math
+    import random
+    import warnings
+    from pool import WorkerPool
+    from simulation import Simulation, Bounds
+
+    radius = 5.0
+    side = int(math.sqrt(n * math.pi * radius * radius / fraction))
+    config_data = {'particles': {'1': {'n': n, 'radius': radius, 'mass': 1.0,
+                                       'color': 'red', 'shape': 'Circle'}}}
+    result = {'particles': n}
+    for workers in (0,) + tuple(worker_counts):
+        pool = None
+        queues = (None, None)
+        if workers:
+            pool = WorkerPool(num_workers=workers, transport='domains', max_workers=workers)
+            pool.start()
+            queues = (pool.work_requested_q, pool.work_completed_q)
+        random.seed(seed)
+        sim = Simulation(config_data, Bounds(side, side), queues[0], queues[1],
+                         watchdog=False, late_policy='block')
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            sim.tick()  # the workers are sent their slabs
+            sent = pool.summary()['domain_particles_sent'] if pool else 0
+            start = time.perf_counter()
+            for i in range(0, ticks):
+                sim.tick()
+            elapsed = time.perf_counter() - start
+        label = '{0}_workers'.format(workers) if workers else 'serial'
+        result[label + '_s_per_tick'] = elapsed / ticks
+        if pool is not None:
+            summary = pool.summary()
+            pool.stop()
+            result[label + '_copies_per_particle'] = summary['domain_copies']
+            result[label + '_particles_sent_per_tick'] = \
+                (summary['domain_particles_sent'] - sent) / ticks
+            result[label + '_utilization'] = statistics.mean(summary['worker_utilization'].values())
+    return result
+
+
+BENCHMARKS = {
+    'worker_startup': bench_worker_startup,
+    'import_time': bench_import_time,
+    'placement': bench_placement,
+    'scenario_load': bench_scenario_load,
+    'prediction': bench_prediction,
+    'neighbor_lists': bench_neighbor_lists,
+    'obstacles': bench_obstacles,
+    'engines': bench_engines,
+    'watchdog': bench_watchdog,
+    'memory': bench_memory,
+    'transport': bench_transport,
+    'domains': bench_domains,
+}
+
+
+def run(names):
+    for name in names:
+        start = time.perf_counter()
+        result = BENCHMARKS[name]()
+        elapsed = time.perf_counter() - start
+        print("{0} ({1:.2f}s)".format(name, elapsed))
+        for key, value in result.items():
+            if isinstance(value, float):
+                print("    {0}: {1:.6f}".format(key, value))
+            else:
+                print("    {0}: {1}".format(key, value))
+
+
+if __name__ == '__main__':
+    unknown = [name for name in sys.argv[1:] if name not in BENCHMARKS]
+    if unknown:
+        sys.exit("unknown benchmark(s): {0}. choose from {1}"
+                 .format(', '.join(unknown), ', '.join(BENCHMARKS)))
+    run(sys.argv[1:] or list(BENCHMARKS))
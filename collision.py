@@ -4,16 +4,20 @@ Defines CollisionSystem which handles
 collision events between two particles.
 '''
 
-from worker import WorkRequest
-import multiprocessing as mp
+from worker import (WorkDone, WorkLost, WorkTracker, STATUS_BUSY, STATUS_BEAT, STATUS_INDEX,
+                    STATUS_COUNT)
+import math
+import queue
 import time
-import heapq
 
 # Defines an Event that will occur at time t between particles a and b
-# if neither a & b are None -> collision with another particle
-# if one of a or b is None -> collision with wall
-# if both a & b are None -> do nothing
+# if b is a particle index -> collision with another particle (always a < b,
+#   so the same collision predicted from either particle is the same event)
+# if b is a wall -> collision with wall
+# if b is None -> neighbor list of a expires and needs a refresh
 class Event:
+    __slots__ = ['time', 'a', 'b', 'countA', 'countB']  # far smaller than a __dict__ each
+
     def __init__(self, t, a, b, cntA, cntB):
         self.time = t  # time from start of simulation
         self.a = a
@@ -38,21 +42,43 @@ class Event:
 # Collision System is used to predict when and how particles will collide
 class CollisionSystem:
     # Inserts all predicted collisions with a given particle as Events into the queue.
-    def predict(a, next_logic_tick, limit, particles, walls, result_q):
+    # If candidates (particle indices) is given only those are checked: used after a
+    # neighbor list refresh when every other prediction for a is still queued.
+    # batch is the set of indices being re-predicted together with a: the pair with
+    # a lower index in it is left to that particle's prediction.
+    def predict(a, next_logic_tick, limit, particles, walls, result_q, candidates=None,
+                batch=None):
         if a is None:
             return
         
         # insert predicted collision with every other 
         # particle as an event into the priority queue 
         # if collision time is between next_logic_tick and limit
-        for b in particles:
-            if a == b:
+        # (only the neighbors and nearby obstacles can be hit before the
+        # neighbor list expires)
+        if a.neighbors is not None and a.neighbors_expiry <= limit:
+            result_q.put_nowait(Event(a.neighbors_expiry, a.index, None, a.collisionCnt, None))
+        if candidates is not None:
+            candidates = [particles[i] for i in candidates]
+            walls = []
+        elif a.neighbors is not None:
+            candidates = [particles[i] for i in a.neighbors]
+            if a.near_walls is not None:
+                walls = [walls[i] for i in a.near_walls]
+        else:
+            candidates = particles
+
+        for b in candidates:
+            if a == b or (batch is not None and b.index < a.index and b.index in batch):
                 continue
             dt = a.timeToHit(b)
-            evt = Event(next_logic_tick + dt, a.index, b.index, a.collisionCnt, b.collisionCnt)
-
-            if next_logic_tick + dt <= limit: 
-                result_q.put_nowait(evt)
+            if next_logic_tick + dt > limit:
+                continue
+            if a.index < b.index:
+                evt = Event(next_logic_tick + dt, a.index, b.index, a.collisionCnt, b.collisionCnt)
+            else:
+                evt = Event(next_logic_tick + dt, b.index, a.index, b.collisionCnt, a.collisionCnt)
+            result_q.put_nowait(evt)
         
         # insert collision time with every wall into the queue
         for wall in walls:
@@ -61,22 +87,146 @@ class CollisionSystem:
             if next_logic_tick + dt <= limit:
                 result_q.put_nowait(evt)
 
-    def processCompletedWork(result_q, pq):
+    # pq is an EventStore (see eventstore.py), now the current simulation time.
+    # With a tracker (a WorkTracker) events already stale are counted and dropped.
+    def processCompletedWork(result_q, pq, now=0.0, tracker=None):
         while not result_q.empty():
-            evt = result_q.get()
-            heapq.heappush(pq, evt)
+            CollisionSystem.processResult(result_q.get(), pq, now, tracker)
 
-    def processWorkRequests(work_q, result_q): 
+    def processResult(evt, pq, now, tracker):
+        if isinstance(evt, WorkDone):
+            if tracker is not None:
+                tracker.done(evt)
+            return
+        if isinstance(evt, WorkLost):
+            if tracker is not None:
+                tracker.lostWork(evt, now)
+            return
+        if tracker is not None:
+            if not evt.isValid(tracker.particles):
+                tracker.stale_results += 1
+                return
+            tracker.arrived(evt, now)
+        pq.push(evt, now)
+
+    # The 'block' policy of WorkTracker: waits for the results of every
+    # request still outstanding, for at most timeout seconds.
+    # Returns False if it timed out.
+    def awaitOutstandingWork(work_q, result_q, pq, now, tracker, timeout):
+        if tracker.in_flight == 0 and not tracker.pending:
+            return True
+        tracker.fallbacks += 1
+        end = time.perf_counter() + timeout
+        while tracker.in_flight > 0 or tracker.pending:
+            tracker.dispatch(work_q, now)
+            if tracker.in_flight == 0:
+                break  # the rest went stale while pending
+            try:
+                evt = result_q.get(timeout=max(end - time.perf_counter(), 0.0))
+            except queue.Empty:
+                tracker.block_timeouts += 1
+                return False
+            CollisionSystem.processResult(evt, pq, now, tracker)
+        return True
+
+    # status, a shared multiprocessing array of doubles, is kept up to date
+    # with the STATUS_ fields of worker.py. Returns when handed None instead
+    # of a request.
+    def processWorkRequests(work_q, result_q, ready_q=None, status=None):
         # print("{0} started".format(mp.current_process().name))
+        import multiprocessing as mp  # only needed in worker processes
+
+        if ready_q is not None:
+            ready_q.put(mp.current_process().name)  # handshake: imports are done
+
         while True:
             work = work_q.get() # blocks automatically when q is empty
+            if work is None:
+                return
             # print("{0} is working. {1} requests remaining.".format(mp.current_process().name, work_q.qsize()))
-            CollisionSystem.predict(work.particles[work.particle_index], work.time, work.limit, work.particles, work.walls, result_q)
+            start = time.time()
+            if status is not None:
+                status[STATUS_INDEX] = work.particle_index
+                status[STATUS_COUNT] = -1 if work.count is None else work.count
+                status[STATUS_BEAT] = start
+            CollisionSystem.processWorkRequest(work, result_q)
+            if status is not None:
+                status[STATUS_BUSY] += time.time() - start
+                status[STATUS_BEAT] = 0.0
 
-    def processCollisionEvents(particles, walls, pq, nextLogicTick, work_q, result_q):  
+    def processWorkRequest(work, result_q):
+        if work.isStale():
+            result_q.put_nowait(WorkDone(work.particle_index, dropped=True))
+            return
+        particles = work.world()
+        CollisionSystem.predict(particles[work.particle_index], work.time, work.limit,
+                                particles, work.walls, result_q, work.candidates,
+                                work.batch)
+        result_q.put_nowait(WorkDone(work.particle_index))
+
+    # Computes every queued work request in the calling process
+    # (used when a simulation runs without workers)
+    def processPendingWork(work_q, result_q):
+        while not work_q.empty():
+            CollisionSystem.processWorkRequest(work_q.get(), result_q)
+
+    # A bounce is handled up to a tick after it happened and the new predictions
+    # start from the end of the tick, so a wall p reaches in between would be missed
+    # (a fast particle could leave the box). Those hits are queued here, from p at
+    # the moment t of the bounce, to be handled within the same tick. except_wall is the
+    # wall p just bounced off.
+    def predictWallsInTick(p, t, nextLogicTick, walls, pq, except_wall=None):
+        if p.neighbors is not None and p.near_walls is not None:
+            walls = [walls[i] for i in p.near_walls]
+        for wall in walls:
+            if wall is except_wall:
+                continue
+            dt = p.timeToHitWall(wall)
+            if t + dt < nextLogicTick:
+                pq.push(Event(t + dt, p.index, wall, p.collisionCnt, None), nextLogicTick)
+
+    # The same for the particles p runs into. The others are at nextLogicTick, so each
+    # is put back where it was at t while timed against p (every particle moved in a
+    # straight line since: events are handled in time order). partner is the particle
+    # p just bounced off, at t too and moving away from it.
+    def predictPairsInTick(p, t, nextLogicTick, particles, pq, partner=None):
+        candidates = particles if p.neighbors is None else [particles[i] for i in p.neighbors]
+        rewind = nextLogicTick - t
+        px, py, pvx, pvy = p.x, p.y, p.vx, p.vy
+        size = p.width + p.height  # more than the extent of either shape
+        for q in candidates:
+            dx = q.x - q.vx * rewind - px
+            dy = q.y - q.vy * rewind - py
+            reach = size + q.width + q.height + (abs(q.vx - pvx) + abs(q.vy - pvy)) * rewind
+            if dx*dx + dy*dy >= reach*reach or q is p or q is partner:
+                continue
+            x, y = q.x, q.y
+            q.x = x - q.vx * rewind
+            q.y = y - q.vy * rewind
+            dt = p.timeToHit(q)
+            q.x, q.y = x, y
+            if t + dt < nextLogicTick:
+                a, b = (p, q) if p.index < q.index else (q, p)
+                pq.push(Event(t + max(dt, 0.0), a.index, b.index, a.collisionCnt,
+                              b.collisionCnt), nextLogicTick)
+
+    # Processes every event due before nextLogicTick. Returns the number processed
+    # neighbors (a NeighborList), observables (an Observables) and tracker (the
+    # WorkTracker making the requests) are optional.
+    # Particles are re-predicted once at the end, however often they bounced, and
+    # each pair of them is only checked by one (see predict).
+    def processCollisionEvents(particles, walls, pq, nextLogicTick, work_q, result_q,
+                               neighbors=None, observables=None, tracker=None):
+        if tracker is None:
+            tracker = WorkTracker(particles)
+        processed = 0
+        bounces = 0
         lastEvt = None
-        while len(pq) > 0 and pq[0].time < nextLogicTick:
-            evt = heapq.heappop(pq)
+        repredict = {}  # particle indices in the order they bounced
+        refreshed = {}  # particle index -> neighbors added by a list refresh
+        everyone = False
+        while len(pq) > 0 and pq.peek().time < nextLogicTick:
+            evt = pq.pop()
             
             if evt.isValid(particles) and (lastEvt is None or evt != lastEvt):
                 lastEvt = evt # prevents infinite collision errors
@@ -85,16 +235,74 @@ class CollisionSystem:
 
             a = evt.a
             b = evt.b
+            if b is None:
+                # neighbor list refresh, not a collision
+                if evt.time == particles[a].neighbors_expiry:  # else already rebuilt
+                    refreshed[a] = neighbors.refresh(particles[a], nextLogicTick)
+                continue
+
+            processed += 1
+            tracker.handled(evt, nextLogicTick)
+            # positions are already at nextLogicTick: step the particles back to
+            # the moment of impact, bounce, then forward again at the new velocity
+            rewind = nextLogicTick - evt.time
+            old_vx, old_vy = particles[a].vx, particles[a].vy
             if isinstance(b, int):
+                old_bvx, old_bvy = particles[b].vx, particles[b].vy
+                particles[a].move(-rewind)
+                particles[b].move(-rewind)
                 particles[a].bounceOff(particles[b])
-                work_q.put_nowait(WorkRequest(a, nextLogicTick, 10000, particles, walls))
-                work_q.put_nowait(WorkRequest(b, nextLogicTick, 10000, particles, walls))    
-            elif b.wall_type == "VWall":
+                CollisionSystem.predictWallsInTick(particles[a], evt.time, nextLogicTick, walls, pq)
+                CollisionSystem.predictWallsInTick(particles[b], evt.time, nextLogicTick, walls, pq)
+                CollisionSystem.predictPairsInTick(particles[a], evt.time, nextLogicTick,
+                                                   particles, pq, particles[b])
+                CollisionSystem.predictPairsInTick(particles[b], evt.time, nextLogicTick,
+                                                   particles, pq, particles[a])
+                particles[a].move(rewind)
+                particles[b].move(rewind)
+                if observables is not None:
+                    observables.bounced(particles[a], old_vx, old_vy)
+                    observables.bounced(particles[b], old_bvx, old_bvy)
+                if neighbors is not None and sum([neighbors.exceeded(particles[a]),
+                                                  neighbors.exceeded(particles[b])]):
+                    # every list was built for a lower top speed
+                    neighbors.refreshAll(nextLogicTick)
+                    everyone = True
+                repredict[a] = True
+                repredict[b] = True
+                bounces += 2
+                continue
+
+            particles[a].move(-rewind)
+            if b.wall_type == "VWall":
                 particles[a].bounceOffVWall()
-                work_q.put_nowait(WorkRequest(a, nextLogicTick, 10000, particles, walls))
             elif b.wall_type == "HWall":
                 particles[a].bounceOffHWall()
-                work_q.put_nowait(WorkRequest(a, nextLogicTick, 10000, particles, walls))
             elif b.wall_type == "LineSegment":
                 particles[a].bounceOffLineSegment(b)
-                work_q.put_nowait(WorkRequest(a, nextLogicTick, 10000, particles, walls))
+            elif b.wall_type == "Disk" or b.wall_type == "Box":
+                particles[a].bounceOffObstacle(b)
+            CollisionSystem.predictWallsInTick(particles[a], evt.time, nextLogicTick, walls, pq, b)
+            CollisionSystem.predictPairsInTick(particles[a], evt.time, nextLogicTick, particles, pq)
+            particles[a].move(rewind)
+            if observables is not None:
+                observables.bounced(particles[a], old_vx, old_vy, b)
+            repredict[a] = True
+            bounces += 1
+
+        tracker.coalesced += bounces - len(repredict)
+        bounced = frozenset(repredict)
+        if everyone:
+            repredict = dict.fromkeys(range(0, len(particles)), True)
+        batch = frozenset(repredict)
+        for a in repredict:
+            tracker.submit(a, nextLogicTick, 10000, walls, batch=batch, bounced=a in bounced)
+        for a, added in refreshed.items():
+            if a not in batch:
+                tracker.submit(a, nextLogicTick, 10000, walls, added)
+        urgent = queue.SimpleQueue()
+        # the 'inline' policy has the most urgent requests computed here
+        for work in tracker.dispatch(work_q, nextLogicTick):
+            CollisionSystem.processWorkRequest(work, urgent)
+        CollisionSystem.processCompletedWork(urgent, pq, nextLogicTick, tracker)
+        return processed
@@ -73,4 +73,10 @@ available_colors = ['black', 'green', 'snow', 'ghost white', 'white smoke', 'gai
 'gray66', 'gray67', 'gray68', 'gray69', 'gray70', 'gray71', 'gray72', 'gray73', 'gray74',
 'gray75', 'gray76', 'gray77', 'gray78', 'gray79', 'gray80', 'gray81', 'gray82', 'gray83',
 'gray84', 'gray85', 'gray86', 'gray87', 'gray88', 'gray89', 'gray90', 'gray91', 'gray92',
-'gray93', 'gray94', 'gray95', 'gray97', 'gray98', 'gray99', 'random']
\ No newline at end of file
+'gray93', 'gray94', 'gray95', 'gray97', 'gray98', 'gray99', 'random']
+
+
+def color_rgb(r, g, b):
+    """r,g,b are intensities of red, green, and blue in range(256)
+    Returns color specifier string for the resulting color"""
+    return "#%02x%02x%02x" % (r, g, b)
@@ -0,0 +1,180 @@
+'''
+Module: domains.py
+Spatial domain decomposition of the prediction work, a transport for
+WorkerPool built on the rings of ring.py.
+
+Each worker owns a slab of the box along x, holding an equal share of
+the particles, and keeps its own copy of them from one request to the
+next instead of being sent a snapshot of the world. The requests of a
+particle go to the worker that owns it. A prediction only looks at the
+particle's neighbor list (see neighbors.py), so besides its own
+particles a worker holds the neighbors of those that lie in the next
+slabs: the boundary particles. Every dispatch only the particles that
+bounced or had their neighbor list rebuilt are sent, to the workers
+holding them, along with the boundary particles that newly became
+someone's neighbor. Particles drift out of their slabs as they move, so
+every EXCHANGE_INTERVAL simulated seconds the slabs are drawn again and
+each worker is sent the particles it gained and told the ones it lost.
+
+Workers move their copies forward to the time of each request
+themselves. The main process only merges the workers' result rings.
+'''
+
+import ring
+from ring import WorkerEnd, RequestSender, RingTransport
+
+EXCHANGE_INTERVAL = 1.0  # simulated seconds between redrawing the slabs
+UPDATE_CHUNK = 4096  # particles per update frame, so they fit in the request ring
+UPDATE = ring.STOP + 1  # kind of frame: particles to take in and drop
+
+
+class DomainEnd(WorkerEnd):
+    """A worker's side of its rings, keeping the particles it was sent"""
+    def __init__(self, requests, results, ready, spill):
+        super().__init__(requests, results, ready, spill)
+        self.particles = {}  # index -> Particle, of the ones this worker holds
+        self.time = 0.0  # the particles are at
+
+    def get(self):
+        request = super().get()
+        if request is not None:
+            self.advance(request.time)
+        return request
+
+    def load(self, kind, body):
+        now, particles, removed, walls = body
+        self.advance(now)
+        if removed is None:
+            self.particles = {}
+        else:
+            for i in removed:
+                self.particles.pop(i, None)
+        for p in particles:
+            self.particles[p.index] = p
+        self.setWalls(walls)
+
+    def advance(self, t):
+        if t != self.time:
+            for p in self.particles.values():
+                p.move(t - self.time)
+            self.time = t
+
+
+class DomainSender(RequestSender):
+    """Main process side of the request rings. Requests go to the worker
+    owning the particle, and must follow a publish() of the same time."""
+    resident = True  # the workers keep their own copy of the particles
+
+    def __init__(self, transport, exchange_interval=EXCHANGE_INTERVAL):
+        super().__init__(transport)
+        self.exchange_interval = exchange_interval
+        self.particles = None  # of the simulation being served
+        self.owner = []  # particle index -> worker it belongs to
+        self.held = {}  # worker -> indices of the particles it has a copy of
+        self.layout = []  # active workers when the slabs were drawn, slabs in that order
+        self.next_exchange = 0.0
+        self.exchanges = 0
+        self.particles_sent = 0
+
+    def put_nowait(self, request):
+        a = request.particle_index
+        neighbors = self.particles[a].neighbors
+        batch = request.batch
+        if batch is not None and neighbors is not None:
+            # only the pairs the worker will look at are of interest
+            batch = frozenset([i for i in neighbors if i in batch])
+        self.send(self.owner[a], request, batch)
+
+    def forget(self, n):
+        super().forget(n)
+        self.held.pop(n, None)
+
+    def publish(self, particles, walls, changed, now):
+        """Sends each worker the particles in changed (indices) that it holds,
+        and the neighbors of its own ones it does not hold yet. Redraws the
+        slabs when they are due, or the workers or the simulation changed."""
+        layout = self.transport.active
+        if (particles is not self.particles or now >= self.next_exchange
+                or layout != self.layout or len(self.held) != len(layout)):  # one was forgotten
+            self.exchange(particles, walls, changed, now)
+            return
+        if not changed:
+            return
+        updates = {n: [] for n in layout}
+        for a in changed:
+            p = particles[a]
+            held = self.held[self.owner[a]]
+            for i in p.neighbors:
+                if i not in held:
+                    held.add(i)
+                    updates[self.owner[a]].append(particles[i])
+            for n in layout:
+                if a in self.held[n]:
+                    updates[n].append(p)
+        for n in layout:
+            self.update(n, now, updates[n], [], None)
+
+    def exchange(self, particles, walls, changed, now):
+        """Redraws the slabs: each active worker owns an equal share of the
+        particles ordered by x. A worker that keeps serving this simulation
+        is only sent the particles it gained or that changed, and told the
+        ones it lost."""
+        layout = list(self.transport.active)
+        order = sorted(range(0, len(particles)), key=lambda i: particles[i].x)
+        share = len(order) / float(len(layout))
+        self.owner = [0] * len(particles)
+        held = {n: set() for n in layout}
+        for rank, i in enumerate(order):
+            n = layout[min(int(rank / share), len(layout) - 1)]
+            self.owner[i] = n
+            held[n].add(i)
+            held[n].update(particles[i].neighbors)
+
+        same = particles is self.particles
+        changed = set(changed)
+        for n in layout:
+            old = self.held.get(n) if same else None
+            if old is None:
+                self.update(n, now, [particles[i] for i in held[n]], None, walls)
+            else:
+                sent = (held[n] - old) | (held[n] & changed)
+                self.update(n, now, [particles[i] for i in sent], list(old - held[n]), None)
+        self.particles = particles
+        self.held = held
+        self.layout = layout
+        self.next_exchange = now + self.exchange_interval
+        self.exchanges += 1
+
+    def update(self, n, now, particles, removed, walls):
+        """Writes worker n the particles to take in, in chunks, after the
+        indices to drop (None for every particle it holds) and the walls"""
+        if not particles and removed == []:
+            return
+        self.write(n, (UPDATE, (now, particles[:UPDATE_CHUNK], removed, walls)))
+        for start in range(UPDATE_CHUNK, len(particles), UPDATE_CHUNK):
+            self.write(n, (UPDATE, (now, particles[start:start + UPDATE_CHUNK], [], None)))
+        self.particles_sent += len(particles)
+
+    def summary(self):
+        held = sum([len(self.held[n]) for n in self.layout])
+        return {
+            'domain_exchanges': self.exchanges,
+            'domain_particles_sent': self.particles_sent,
+            # copies held per particle, 1.0 if no worker held a boundary particle
+            'domain_copies': held / float(len(self.owner)) if self.owner else 0.0,
+        }
+
+
+class DomainTransport(RingTransport):
+    """Rings whose workers each own a slab of the particles"""
+    def __init__(self, ctx, request_bytes=ring.REQUEST_RING_BYTES,
+                 result_records=ring.RESULT_RING_RECORDS, exchange_interval=EXCHANGE_INTERVAL):
+        super().__init__(ctx, request_bytes, result_records)
+        self.work_requested_q = DomainSender(self, exchange_interval)
+
+    def add(self, n):
+        end = super().add(n)
+        return DomainEnd(end.requests, end.results, end.ready, end.spill)
+
+    def summary(self):
+        return self.work_requested_q.summary()
@@ -0,0 +1,189 @@
+'''
+Module: engine_select.py
+Picks between the event driven and the time stepped engine.
+
+At load the packing fraction and mean free time of the scenario give an
+expected collision rate, and a simple cost model turns that into the wall
+time per simulated second of each engine. While running, EngineSelector
+measures the engine actually in use and rescales the model by what it
+sees, so a scenario that turns out denser or sparser than estimated (or a
+faster or slower machine) still ends up on the quicker engine.
+'''
+
+import logging
+import math
+import placement
+import neighbors
+
+log = logging.getLogger(__name__)
+
+# cost model, in seconds (measured with benchmarks.py engines)
+MOVE_COST = 0.4e-6  # moving one particle one tick (event engine)
+EVENT_COST = 200e-6  # handling one collision, excluding the predictions it causes
+PAIR_COST = 1.0e-6  # one timeToHit check and the Event it makes
+STEP_COST = 300e-6  # fixed cost of one substep (stepped engine)
+STEP_PARTICLE_COST = 0.7e-6  # one particle for one substep
+STEP_STATIC_COST = 25e-6  # one wall or obstacle for one substep
+
+WINDOW_TICKS = 60  # ticks measured before each decision
+MARGIN = 1.5  # how much faster the other engine must look before switching
+
+
+def have_numpy():
+    try:
+        import numpy
+    except ImportError:
+        return False
+    return True
+
+
+def contact_value(fraction):
+    """How much more often discs collide at this packing fraction than in a
+    dilute gas (Henderson's equation of state for hard discs)"""
+    fraction = min(fraction, 0.85)
+    return (1.0 - 7.0 * fraction / 16.0) / (1.0 - fraction) ** 2
+
+
+class Estimate:
+    """Packing fraction, mean free time and expected collision rate of a scenario"""
+    def __init__(self, particles, walls, width, height, time_per_tick, neighbor_lists):
+        self.particles = len(particles)
+        self.time_per_tick = time_per_tick
+        self.neighbor_lists = neighbor_lists
+        self.statics = len(walls)
+        xmin, ymin, xmax, ymax = placement.box_from_walls(walls, width, height)
+        area = max((xmax - xmin) * (ymax - ymin) - placement.obstacle_area(walls), 1.0)
+
+        if not particles:
+            self.fraction = 0.0
+            self.mean_free_time = math.inf
+            self.collision_rate = 0.0
+            return
+
+        radii = [placement.extent(p.shape_type, p.radius, p.width, p.height) for p in particles]
+        speeds = [math.hypot(p.vx, p.vy) for p in particles]
+        self.mean_radius = sum(radii) / len(radii)
+        self.min_radius = min(radii)
+        self.top_speed = max(speeds)
+        mean_speed = sum(speeds) / len(speeds)
+
+        density = len(particles) / area
+        self.density = density
+        self.fraction = sum([math.pi * r * r for r in radii]) / area
+        # collisions per particle per second: a disc sweeps 2 diameters of area
+        # per unit of relative speed, which averages sqrt(2) times the speed
+        rate = math.sqrt(2.0) * density * 2.0 * self.mean_radius * mean_speed
+        rate *= contact_value(self.fraction)
+        self.mean_free_time = 1.0 / rate if rate > 0 else math.inf
+        self.collision_rate = len(particles) * rate / 2.0  # two particles per collision
+        # plus wall hits: the mean chord of a convex region is pi * area / perimeter
+        perimeter = 2.0 * ((xmax - xmin) + (ymax - ymin))
+        self.collision_rate += len(particles) * mean_speed * perimeter / (math.pi * area)
+
+    def update(self, particles):
+        """Collisions spread the speeds out over a run, which changes how many
+        substeps the stepped engine needs"""
+        if particles:
+            self.top_speed = max([math.hypot(p.vx, p.vy) for p in particles])
+
+    def candidates(self):
+        """Particles each prediction checks in the event engine"""
+        if not self.neighbor_lists:
+            return self.particles
+        skin = 2.0 * neighbors.SPEED_HEADROOM * self.top_speed * \
+            neighbors.REFRESH_TICKS * self.time_per_tick
+        reach = 2.0 * self.mean_radius + skin
+        return min(self.particles, self.density * math.pi * reach * reach)
+
+    def eventCost(self, collision_rate=None):
+        """Wall seconds per simulated second of the event engine"""
+        if collision_rate is None:
+            collision_rate = self.collision_rate
+        ticks = 1.0 / self.time_per_tick
+        per_collision = EVENT_COST + 2.0 * (self.candidates() + self.statics) * PAIR_COST
+        return ticks * self.particles * MOVE_COST + collision_rate * per_collision
+
+    def steppedCost(self):
+        """Wall seconds per simulated second of the stepped engine"""
+        if not self.particles:
+            return 0.0
+        import stepped
+        travel = self.top_speed * self.time_per_tick / (stepped.MAX_TRAVEL * self.min_radius)
+        substeps = max(1, math.ceil(travel)) / self.time_per_tick
+        return substeps * (STEP_COST + self.particles * STEP_PARTICLE_COST +
+                           self.statics * STEP_STATIC_COST)
+
+
+class EngineSelector:
+    """Chooses the engine at load and re-checks the choice every WINDOW_TICKS.
+    With switching off it only logs a recommendation."""
+    def __init__(self, estimate, switching=True):
+        self.estimate = estimate
+        self.switching = switching
+        self.scale = {}  # measured / modelled cost of each engine seen so far
+        self.recommended = None
+        self.reason = ''
+        self.window_start = None
+
+    def modelled(self, engine, collision_rate=None):
+        if engine == 'event':
+            return self.estimate.eventCost(collision_rate)
+        return self.estimate.steppedCost()
+
+    def initial(self):
+        """Returns the engine expected to be fastest and records why"""
+        est = self.estimate
+        if not have_numpy():
+            return self.decide('event', "NumPy is not installed, using the event engine")
+        event = self.modelled('event')
+        stepped = self.modelled('stepped')
+        engine = 'event' if event <= stepped else 'stepped'
+        return self.decide(engine, (
+            "{0} particles fill {1:.0%} of the box, mean free time {2:.3g}s, about {3:.0f} "
+            "collisions per simulated second: expect {4:.3g}s (event) vs {5:.3g}s (stepped) "
+            "of wall time per simulated second, using the {6} engine").format(
+                est.particles, est.fraction, est.mean_free_time, est.collision_rate,
+                event, stepped, engine))
+
+    def decide(self, engine, reason):
+        if engine != self.recommended:
+            log.info(reason)
+        self.recommended = engine
+        self.reason = reason
+        return engine
+
+    def startWindow(self, sim):
+        self.window_start = (sim.ticks, sim.wall_time, sim.events_processed)
+
+    def observe(self, sim):
+        """Called after each tick. Returns the engine to switch to, if any"""
+        if self.window_start is None:
+            self.startWindow(sim)
+            return None
+        ticks, wall_time, events = self.window_start
+        if sim.ticks - ticks < WINDOW_TICKS:
+            return None
+        self.startWindow(sim)
+        if not have_numpy():
+            return None
+
+        self.estimate.update(sim.particles)
+        sim_seconds = (sim.ticks - ticks) * sim.time_per_tick
+        measured = (sim.wall_time - wall_time) / sim_seconds
+        rate = (sim.events_processed - events) / sim_seconds
+        current = sim.engine
+        other = 'stepped' if current == 'event' else 'event'
+
+        self.scale[current] = measured / max(self.modelled(current, rate), 1e-12)
+        # an engine not yet measured is taken at the model's word
+        expected = self.modelled(other, rate) * self.scale.get(other, 1.0)
+        if expected * MARGIN >= measured:
+            self.decide(current, "{0} engine measured at {1:.3g}s per simulated second with "
+                        "{2:.0f} collisions per second, {3} engine expected {4:.3g}s: "
+                        "staying".format(current, measured, rate, other, expected))
+            return None
+        self.decide(other, "{0} engine measured at {1:.3g}s per simulated second with "
+                    "{2:.0f} collisions per second, {3} engine expected {4:.3g}s: "
+                    "{5}".format(current, measured, rate, other, expected,
+                                 "switching" if self.switching else "recommended"))
+        return other if self.switching else None
@@ -0,0 +1,107 @@
+'''
+Module: eventstore.py
+Defines EventStore, the priority queue of predicted events, with an
+optional memory budget.
+
+Predictions reach far into the future, so a long run with many particles
+can pile up events it will not need for a long time. Once the store
+outgrows its budget every event past a time horizon is evicted and the
+particles that predicted them are remembered. Events past the horizon
+are turned away from then on, and shortly before the simulation reaches
+the horizon those particles are handed back for re-prediction.
+'''
+
+import heapq
+import math
+import sys
+from collision import Event
+
+EVENT_BYTES = sys.getsizeof(Event(0.0, 0, 0, 0, 0)) + sys.getsizeof(0.0) + 8  # + list slot
+KEEP_FRACTION = 0.5  # share of the budget left filled after an eviction
+MIN_HORIZON = 1.0  # seconds ahead of now an eviction never cuts below
+REFILL_LEAD = 0.5  # seconds before the horizon that evicted particles are handed back
+
+
+class EventStore:
+    def __init__(self, budget=None):
+        """budget is the most memory, in bytes, events may take (None for no limit)"""
+        self.budget = budget
+        self.clear()
+        self.evictions = 0
+        self.events_evicted = 0
+        self.peak = 0
+
+    def clear(self):
+        """Drops every event, keeping the statistics"""
+        self.heap = []
+        self.horizon = math.inf
+        self.evicted = {}  # particle index -> collisionCnt when its events were evicted
+        self.limit = math.inf if self.budget is None else self.budget // EVENT_BYTES  # events
+
+    def __len__(self):
+        return len(self.heap)
+
+    def peek(self):
+        return self.heap[0]
+
+    def pop(self):
+        return heapq.heappop(self.heap)
+
+    def push(self, evt, now=0.0):
+        """Adds evt unless it lies past the horizon. now is the current
+        simulation time, the earliest an eviction would cut to."""
+        if evt.time > self.horizon:
+            self.turnAway(evt)
+            return
+        heapq.heappush(self.heap, evt)
+        if len(self.heap) > self.peak:
+            self.peak = len(self.heap)
+        if len(self.heap) > self.limit:
+            self.evict(now)
+
+    def turnAway(self, evt):
+        # a stale event carries an older count than the particle's valid ones
+        if evt.countA > self.evicted.get(evt.a, -1):
+            self.evicted[evt.a] = evt.countA
+        self.events_evicted += 1
+
+    def evict(self, now):
+        """Drops every event past the time that leaves KEEP_FRACTION of the
+        budget filled, but keeps at least MIN_HORIZON seconds of events. If
+        that is still over budget the next eviction waits for the store to
+        double, so a budget too small to keep up is not re-sorted every push."""
+        budget = self.budget // EVENT_BYTES
+        times = sorted([evt.time for evt in self.heap])
+        horizon = max(times[min(int(KEEP_FRACTION * budget), len(times) - 1)], now + MIN_HORIZON)
+        self.limit = max(budget, 2 * len(times))
+        if horizon >= times[-1]:
+            return  # nothing far enough ahead to drop
+        kept = []
+        for evt in self.heap:
+            if evt.time > horizon:
+                self.turnAway(evt)
+            else:
+                kept.append(evt)
+        heapq.heapify(kept)
+        self.heap = kept
+        self.horizon = min(self.horizon, horizon)
+        self.limit = max(budget, int(len(kept) / KEEP_FRACTION))
+        self.evictions += 1
+
+    def due(self, now, particles):
+        """Returns the indices of particles to re-predict once now is within
+        REFILL_LEAD of the horizon, and lifts the horizon. Particles that
+        collided since their eviction have already been re-predicted."""
+        if not self.evicted or now + REFILL_LEAD < self.horizon:
+            return []
+        due = [i for i, count in self.evicted.items() if particles[i].collisionCnt == count]
+        self.evicted = {}
+        self.horizon = math.inf
+        return due
+
+    def nbytes(self):
+        """Estimated memory taken by the events currently stored"""
+        return len(self.heap) * EVENT_BYTES
+
+    def peakBytes(self):
+        return self.peak * EVENT_BYTES
@@ -6,15 +6,9 @@ with one another
 '''
 import time
 import sys
-import multiprocessing as mp
-import copy
 
-from graphics import GraphWin, Point, Line
-from collision import CollisionSystem
-from particles import Particle, ParticleShape, ParticleFactory
-from walls import *
-from menu import MainMenu
-import file_utils
+from simulation import Simulation
+from pool import WorkerPool
 
 
 def main():
@@ -22,59 +16,43 @@ def main():
     window.clear()
 
     # clear work queues
-    while not work_requested_q.empty():
-        work_requested_q.get_nowait()
-    while not work_completed_q.empty():
-        work_completed_q.get_nowait()
-
-    # globals
-    pq = []
-    particles = []
-    particle_shapes = []
-    pf = ParticleFactory(window, particles, particle_shapes)
-    walls = []
-
-    menu_height = 20.0
-    walls.append(VWall(0.0))
-    walls.append(VWall(window.width - 1))
-    walls.append(HWall(0.0))
-    walls.append(HWall(window.height - menu_height - 1))
+    pool.clear()
 
     # create particles and walls from config file
-    dataMap = copy.deepcopy(main_menu.config_data)
-    for key in dataMap['particles']:
-        curr = dataMap['particles'][key]
-        n = curr.pop('n')
-        for i in range(0, n):
-            pf.create(**curr)
-
-    for key in dataMap.get('walls', {}):
-        curr = dataMap['walls'][key]
-        line = LineSegment(Point(curr['p0x'], curr['p0y']), Point(curr['p1x'], curr['p1y']))
-        walls.append(line)
-
-    # draw particles and walls
+    particle_shapes = []
+    sim = Simulation(main_menu.config_data, window, pool.work_requested_q,
+                     pool.work_completed_q, particle_shapes, engine=args.engine, pool=pool)
+
+    # draw particles, walls and obstacles
     for particle_shape in particle_shapes:
         particle_shape.draw()
 
-    for wall in walls:
+    for wall in sim.walls:
         if wall.wall_type == "VWall":
             ln = Line(Point(wall.x, 0), Point(wall.x, window.height))
         elif wall.wall_type == "HWall":
             ln = Line(Point(0, wall.y), Point(window.width, wall.y))
+        elif wall.wall_type == "Disk":
+            ln = Circle(Point(wall.x, wall.y), wall.radius)
+            ln.setFill(wall.color or 'gray')
+        elif wall.wall_type == "Box":
+            ln = Rectangle(Point(wall.x - wall.width/2.0, wall.y - wall.height/2.0),
+                           Point(wall.x + wall.width/2.0, wall.y + wall.height/2.0))
+            ln.setFill(wall.color or 'gray')
         else:
-            ln = Line(wall.p0, wall.p1)
+            ln = Line(Point(wall.p0.x, wall.p0.y), Point(wall.p1.x, wall.p1.y))
         ln.draw(window)
 
-    for particle in particles:
-        CollisionSystem.predict(particle, 0.0, 10000, particles, walls, work_completed_q)
+    hud = HUD(window, Point(window.width / 2.0, 12))
+    hud.update(sim)
+    hud.draw()
+    chart = SpeedChart(window, Point(window.width - 170, 10))
+    chart.draw()
+    chart.update(sim)
 
     # initialize simulation variables
     simTime = 0.0
     limit = 10000
-    TICKS_PER_SECOND = 60  # how often collisions are checked
-    TIME_PER_TICK = 1.0/TICKS_PER_SECOND  # in seconds
-    nextLogicTick = TIME_PER_TICK
     lastFrameTime = time.time()
     lag = 0.0
 
@@ -90,56 +68,61 @@ def main():
             main_menu.pause()
             lastFrameTime = time.time()
 
-        while lag > TIME_PER_TICK:
-            CollisionSystem.processCompletedWork(work_completed_q, pq)
-            CollisionSystem.processCollisionEvents(particles, walls, pq, nextLogicTick,
-                                                   work_requested_q, work_completed_q)
-
-            for particle in particles:
-                particle.move(TIME_PER_TICK)  # moves each particle in linear line
-
-            for particle_shape in particle_shapes:
-                particle_shape.x = particles[particle_shape.index].x
-                particle_shape.y = particles[particle_shape.index].y
-
-            nextLogicTick += TIME_PER_TICK
-            lag -= TIME_PER_TICK
+        while lag > sim.time_per_tick:
+            sim.tick()
+            lag -= sim.time_per_tick
+        pool.supervise()
+        pool.autoscale()
 
         # render updates to window
         for particle_shape in particle_shapes:
+            particle_shape.x = sim.particles[particle_shape.index].x
+            particle_shape.y = sim.particles[particle_shape.index].y
             particle_shape.render()
+        hud.update(sim)
+        chart.update(sim)
 
     window.close
 
 
 def cleanup():
     window.close()
-    while not work_requested_q.empty():
-        work_requested_q.get_nowait()
-    while not work_completed_q.empty():
-        work_completed_q.get_nowait()
+    pool.clear()
     sys.exit()
 
 if __name__ == '__main__':
+    # GUI modules are imported here rather than at the top because worker
+    # processes re-import this module on start-up and must not load Tk or YAML
+    from graphics import GraphWin, Point, Line, Circle, Rectangle
+    from menu import MainMenu
+    from ui import HUD, SpeedChart
+    import argparse
+    import logging
+    from simulation import ENGINES
+    from pool import TRANSPORTS
+
+    parser = argparse.ArgumentParser(description='Run the particle simulation.')
+    parser.add_argument('--engine', choices=ENGINES, default='auto',
+                        help='event driven, time stepped (for very dense scenarios) or '
+                             'auto (default) to pick whichever runs faster')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='prediction workers to start with (default: one per CPU but one)')
+    parser.add_argument('--pin', action='store_true',
+                        help='pin every worker to a CPU of its own')
+    parser.add_argument('--transport', choices=TRANSPORTS, default='auto',
+                        help='how requests reach the workers: shared memory rings, '
+                             'multiprocessing queues, rings to workers that each own a '
+                             'slab of the box (domains) or auto (default)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')  # engine choices
+
     window = GraphWin('Particle Simulation', 1024, 768, autoflush=False)
-    file_utils.set_config(file_utils.load_config('scenarios/standard.yml'))
-    main_menu = MainMenu(window, main)
+    main_menu = MainMenu(window, main, 'scenarios/standard.yml')
     menu_options = {"New": main_menu.run, "Restart": main, "Exit": cleanup}
     window.addMenu(menu_options)
 
-    # initialize multi-threading variables
-    work_completed_q = mp.Queue()
-    work_requested_q = mp.Queue()
-
-    # initialize workers
-    num_workers = 4
-    workers = []
-    for n in range(0, num_workers):
-        workers.append(mp.Process(target=CollisionSystem.processWorkRequests,
-                                  args=(work_requested_q, work_completed_q)))
-        workers[n].daemon = True
-        workers[n].start()
-
-    time.sleep(0.5)  # delay startup to give workers time to initialize
+    # initialize workers and wait until every one of them is ready
+    pool = WorkerPool(num_workers=args.workers, transport=args.transport, pin=args.pin)
+    pool.start()
 
     main()
@@ -1,5 +1,22 @@
 import math
 
+
+class Point:
+    """Plain x/y pair used by the physics modules so they never need to
+    import graphics (and Tk) just to describe a position"""
+    __slots__ = ('x', 'y')
+
+    def __init__(self, x, y):
+        self.x = float(x)
+        self.y = float(y)
+
+    def __repr__(self):
+        return "Point({}, {})".format(self.x, self.y)
+
+    def getX(self): return self.x
+    def getY(self): return self.y
+
+
 def degrees_clockwise(dy, dx):
     ''' returns rotation degrees assuming 0 is 12 o'clock '''
     radians = math.atan2(dy, dx) # between -pi and pi
@@ -1,13 +1,13 @@
 from abc import ABCMeta, abstractmethod
-import file_utils
+import scenario_cache
 from ui import *
 
 
 class MainMenu:
-    def __init__(self, window, callback):
+    def __init__(self, window, callback, config_file='config.yml'):
         self.window = window
         self.callback = callback
-        self.config_data = file_utils.load_config('config.yml')
+        self.config_data = scenario_cache.load(config_file)
 
         self.particle_table = ParticleTable(Table(self.window, Point(275, 350)), self.config_data)
         self.wall_table = WallTable(Table(self.window, Point(710, 175), 20, 110), self.config_data)
@@ -55,22 +55,20 @@ class MainMenu:
         ln_2.draw(self.window)
 
         scenario_header = HeaderText(self.window, Point(850, 525), 'Scenarios')
-        scenario_1_btn = Button(self.window, Point(780, 575), 120, 30, 'Standard')
-        self.scenarios.append({'btn': scenario_1_btn, 'file': 'scenarios/standard.yml'})
-        scenario_2_btn = Button(self.window, Point(780, 625), 120, 30, '200 Hundred')
-        self.scenarios.append({'btn': scenario_2_btn, 'file': 'scenarios/200hundred.yml'})
-        scenario_3_btn = Button(self.window, Point(780, 675), 120, 30, 'Big + Small')
-        self.scenarios.append({'btn': scenario_3_btn, 'file': 'scenarios/bigsmall.yml'})
-        scenario_4_btn = Button(self.window, Point(780, 725), 120, 30, 'Crazy')
-        self.scenarios.append({'btn': scenario_4_btn, 'file': 'scenarios/crazy.yml'})
-        scenario_5_btn = Button(self.window, Point(940, 575), 120, 30, 'Walls a plenty')
-        self.scenarios.append({'btn': scenario_5_btn, 'file': 'scenarios/wallsaplenty.yml'})
-        scenario_6_btn = Button(self.window, Point(940, 625), 120, 30, 'Diffusion')
-        self.scenarios.append({'btn': scenario_6_btn, 'file': 'scenarios/diffusion.yml'})
-        scenario_7_btn = Button(self.window, Point(940, 675), 120, 30, 'Picasso')
-        self.scenarios.append({'btn': scenario_7_btn, 'file': 'scenarios/picasso.yml'})
-        scenario_8_btn = Button(self.window, Point(940, 725), 120, 30, 'Triangle Split')
-        self.scenarios.append({'btn': scenario_8_btn, 'file': 'scenarios/trianglesplit.yml'})
+        scenarios = [('Standard', 'scenarios/standard.yml'),
+                     ('200 Hundred', 'scenarios/200hundred.yml'),
+                     ('Big + Small', 'scenarios/bigsmall.yml'),
+                     ('Crazy', 'scenarios/crazy.yml'),
+                     ('Pinball', 'scenarios/pinball.yml'),
+                     ('Walls a plenty', 'scenarios/wallsaplenty.yml'),
+                     ('Diffusion', 'scenarios/diffusion.yml'),
+                     ('Picasso', 'scenarios/picasso.yml'),
+                     ('Triangle Split', 'scenarios/trianglesplit.yml'),
+                     ('Porous', 'scenarios/porous.yml')]
+        for i, (label, file) in enumerate(scenarios):
+            column, row = divmod(i, 5)
+            btn = Button(self.window, Point(780 + column * 160, 565 + row * 40), 120, 30, label)
+            self.scenarios.append({'btn': btn, 'file': file})
 
     def run(self):
         self.drawMenu()
@@ -103,16 +101,16 @@ class MainMenu:
 
                     for scen in self.scenarios:
                         if scen['btn'].clicked(last_clicked_pt):
-                            self.config_data = file_utils.load_config(scen['file'])
+                            self.config_data = scenario_cache.load(scen['file'])
                             self.particle_table.setData(self.config_data)
                             self.wall_table.setData(self.config_data)
 
     def setConfigData(self):
-        self.config_data = {
-            'particles': self.particle_table.data_dict,
-            'walls': self.wall_table.data_dict
-        }
-        file_utils.set_config(self.config_data)
+        # kept in memory only so starting a run never writes to disk
+        # and keeps what the tables do not show, such as obstacles and placement
+        self.config_data = dict(self.config_data,
+                                particles=self.particle_table.data_dict,
+                                walls=self.wall_table.data_dict)
 
     def pause(self):
         message = Text(Point(self.window.width/2.0, self.window.height/2.0 - 50.0), 'Paused')
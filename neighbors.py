@@ -0,0 +1,160 @@
+'''
+Module: neighbors.py
+Verlet style neighbor lists for the event driven simulation.
+
+Each particle keeps the indices of every particle that is within the
+sum of their extents plus a skin distance. No two particles can close
+the skin before the list expires, so predictions only need to look at
+the list. The expiry is scheduled as a refresh event and any bounce that
+pushes a particle past the speed the lists were built for rebuilds them all.
+
+Obstacles never move, so they are bucketed in the same grid and each
+particle also keeps the indices of the walls it could reach before its
+list expires: every plain wall and the obstacles within its reach.
+'''
+
+import math
+import statistics
+import placement
+
+REFRESH_TICKS = 6  # ticks an automatically sized skin lasts for
+SPEED_HEADROOM = 1.25  # how far above the fastest particle the speed cap is set
+
+
+class NeighborList:
+    def __init__(self, particles, time_per_tick, skin=None, walls=()):
+        self.particles = particles
+        self.walls = walls
+        self.obstacles = [i for i, w in enumerate(walls) if w.wall_type in ["Disk", "Box"]]
+        self.plain_walls = [i for i, w in enumerate(walls) if w.wall_type not in ["Disk", "Box"]]
+        self.wall_extents = {i: self.obstacleExtent(walls[i]) for i in self.obstacles}
+        self.time_per_tick = time_per_tick
+        self.extents = [placement.extent(p.shape_type, p.radius, p.width, p.height)
+                        for p in particles]
+        self.speed_cap = max(SPEED_HEADROOM * max([self.speed(p) for p in particles] or [1.0]),
+                             self.thermalSpeed())
+        self.typical_extent = statistics.median(self.extents or [1.0])
+        self.auto_skin = skin is None
+        self.setSkin(skin)
+        if self.horizon() < time_per_tick:
+            self.setSkin()  # a skin too thin to last a tick is no use
+        self.cells = {}
+        self.wall_cells = {}
+        self.rebuilds = 0
+
+    def setSkin(self, skin=None):
+        if skin is None:
+            skin = 2.0 * self.speed_cap * REFRESH_TICKS * self.time_per_tick
+        self.skin = skin
+        self.cell_size = 2.0 * self.typical_extent + skin
+        self.grid_time = None
+
+    def thermalSpeed(self):
+        """Expected top speed once collisions have shared the energy out: in 2D
+        kinetic energies settle to an exponential distribution whose largest
+        of n samples is about mean * (ln n + 1), and the lightest particle
+        turns that into the most speed. Starting the cap here saves the
+        rebuilds a cold start would otherwise trigger."""
+        if not self.particles:
+            return 0.0
+        energy = sum([0.5 * p.mass * (p.vx*p.vx + p.vy*p.vy) for p in self.particles])
+        mean = energy / len(self.particles)
+        top = mean * (math.log(len(self.particles)) + 1.0)
+        return math.sqrt(2.0 * top / min([p.mass for p in self.particles]))
+
+    def obstacleExtent(self, wall):
+        if wall.wall_type == "Box":
+            return math.hypot(wall.width/2.0, wall.height/2.0)
+        return wall.radius
+
+    def speed(self, p):
+        return math.hypot(p.vx, p.vy)
+
+    def horizon(self):
+        """Time until two particles could have closed the skin, less a tick
+        because the refresh event is only handled at the end of its tick"""
+        return self.skin / (2.0 * self.speed_cap) - self.time_per_tick
+
+    def cellRange(self, x, y, r):
+        size = self.cell_size
+        return (range(int(math.floor((x - r) / size)), int(math.floor((x + r) / size)) + 1),
+                range(int(math.floor((y - r) / size)), int(math.floor((y + r) / size)) + 1))
+
+    def buildGrid(self, t):
+        """Buckets every particle and obstacle by position. Positions only
+        change between ticks so one grid serves every refresh within a tick"""
+        if self.grid_time == t:
+            return
+        self.cells = {}
+        self.wall_cells = {}
+        for i in self.obstacles:
+            xs, ys = self.cellRange(self.walls[i].x, self.walls[i].y, self.wall_extents[i])
+            for cx in xs:
+                for cy in ys:
+                    self.wall_cells.setdefault((cx, cy), []).append(i)
+        half_skin = self.skin / 2.0
+        for p in self.particles:
+            xs, ys = self.cellRange(p.x, p.y, self.extents[p.index] + half_skin)
+            for cx in xs:
+                for cy in ys:
+                    self.cells.setdefault((cx, cy), []).append(p.index)
+        self.grid_time = t
+
+    def refresh(self, p, t):
+        """Rebuilds the neighbor list of particle p at logic time t and returns
+        the indices that were not on the old list, or None if an obstacle came
+        within reach and p needs predicting again in full"""
+        self.buildGrid(t)
+        reach = self.extents[p.index] + self.skin
+        xs, ys = self.cellRange(p.x, p.y, self.extents[p.index] + self.skin / 2.0)
+        found = set()
+        near = set()
+        for cx in xs:
+            for cy in ys:
+                found.update(self.cells.get((cx, cy), ()))
+                near.update(self.wall_cells.get((cx, cy), ()))
+        found.discard(p.index)
+        if self.obstacles:
+            near = self.plain_walls + sorted([i for i in near if self.reaches(p, reach, i)])
+        else:
+            near = None  # every wall
+        new_walls = near is not None and (p.near_walls is None or
+                                          not set(near) <= set(p.near_walls))
+        p.near_walls = near
+
+        neighbors = []
+        for i in found:
+            b = self.particles[i]
+            r = reach + self.extents[i]
+            dx = b.x - p.x
+            dy = b.y - p.y
+            if dx*dx + dy*dy < r*r:
+                neighbors.append(i)
+        neighbors.sort()
+        added = neighbors if p.neighbors is None else sorted(set(neighbors) - set(p.neighbors))
+        p.neighbors = neighbors
+        p.neighbors_expiry = t + self.horizon()
+        return None if new_walls else added
+
+    def reaches(self, p, reach, i):
+        wall = self.walls[i]
+        r = reach + self.wall_extents[i]
+        dx = wall.x - p.x
+        dy = wall.y - p.y
+        return dx*dx + dy*dy < r*r
+
+    def refreshAll(self, t):
+        for p in self.particles:
+            self.refresh(p, t)
+        self.rebuilds += 1
+
+    def exceeded(self, p):
+        """True (and the speed cap raised) if p now moves faster than the
+        lists were built for"""
+        speed = self.speed(p)
+        if speed <= self.speed_cap:
+            return False
+        self.speed_cap = SPEED_HEADROOM * speed
+        if self.auto_skin or self.horizon() < self.time_per_tick:
+            self.setSkin()  # keep the lists lasting as long at the new speed
+        return True
@@ -0,0 +1,210 @@
+'''
+Module: observables.py
+Defines Observables which keeps running totals of the thermodynamic
+state of a simulation (energy, temperature, momentum and wall pressure),
+SpeedHistogram, a live histogram of particle speeds, and MixingTracker
+which follows how well two sets of particles mix.
+
+The totals are summed once at load and then only adjusted by the velocity
+change of each bounce, so reading them never scans the particles.
+'''
+
+import collections
+import math
+import placement
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # mixing is then counted in plain Python
+
+PRESSURE_WINDOW = 1.0  # seconds of wall impulse averaged into the pressure
+SPEED_BINS = 24
+SPEED_RANGE = 1.2  # histogram range in multiples of the expected top speed
+MIXING_GRID = (8, 6)  # columns and rows of the grid mixing is measured on
+MIXING_INTERVAL = 0.25  # simulated seconds between mixing samples
+
+
+class Observables:
+    def __init__(self, particles, walls, width, height):
+        self.count = len(particles)
+        self.energy = sum([0.5 * p.mass * (p.vx*p.vx + p.vy*p.vy) for p in particles])
+        self.px = sum([p.mass * p.vx for p in particles])
+        self.py = sum([p.mass * p.vy for p in particles])
+
+        xmin, ymin, xmax, ymax = placement.box_from_walls(walls, width, height)
+        self.perimeter = 2.0 * ((xmax - xmin) + (ymax - ymin))
+        self.wall_impulse = 0.0  # total impulse the boundary walls have taken
+        # momentum handed to walls and obstacles, px + static_px stays constant
+        self.static_px = 0.0
+        self.static_py = 0.0
+        self.samples = collections.deque([(0.0, 0.0)])  # (time, wall_impulse)
+        self.speeds = SpeedHistogram(particles, self.energy)
+
+    def bounced(self, p, old_vx, old_vy, wall=None):
+        """Records the velocity change of a particle that bounced off another
+        particle or, if given, a wall"""
+        dvx = p.vx - old_vx
+        dvy = p.vy - old_vy
+        self.energy += 0.5 * p.mass * (p.vx*p.vx + p.vy*p.vy - old_vx*old_vx - old_vy*old_vy)
+        self.px += p.mass * dvx
+        self.py += p.mass * dvy
+        self.speeds.moved(math.hypot(old_vx, old_vy), math.hypot(p.vx, p.vy))
+        if wall is None:
+            return
+        self.static_px -= p.mass * dvx
+        self.static_py -= p.mass * dvy
+        if wall.wall_type == "VWall" or wall.wall_type == "HWall":
+            self.wall_impulse += p.mass * math.hypot(dvx, dvy)
+
+    def sample(self, now):
+        """Called once per tick so pressure can be averaged over a recent window"""
+        self.samples.append((now, self.wall_impulse))
+        while len(self.samples) > 2 and now - self.samples[1][0] >= PRESSURE_WINDOW:
+            self.samples.popleft()
+
+    def temperature(self):
+        """Mean kinetic energy per particle, which in 2D is kT"""
+        return self.energy / self.count if self.count else 0.0
+
+    def momentum(self):
+        return self.px, self.py
+
+    def pressure(self):
+        """Impulse on the boundary walls per unit length per second over the
+        last PRESSURE_WINDOW seconds"""
+        then, impulse = self.samples[0]
+        now, latest = self.samples[-1]
+        if now <= then or self.perimeter <= 0:
+            return 0.0
+        return (latest - impulse) / (self.perimeter * (now - then))
+
+    def summary(self):
+        return {
+            'energy': self.energy,
+            'temperature': self.temperature(),
+            'momentum': self.momentum(),
+            'pressure': self.pressure(),
+        }
+
+
+class SpeedHistogram:
+    """Counts of particles by speed. A bounce moves a particle from the bin
+    of its old speed to the bin of its new one, so the counts stay current
+    without a pass over the particles. The last bin also holds every speed
+    past the range."""
+    def __init__(self, particles, energy, bins=SPEED_BINS):
+        # the range covers the fastest particle once collisions have shared
+        # the energy out (see NeighborList.thermalSpeed)
+        top = max([math.hypot(p.vx, p.vy) for p in particles] or [1.0])
+        if particles:
+            mean = energy / len(particles)
+            top = max(top, math.sqrt(2.0 * mean * (math.log(len(particles)) + 1.0) /
+                                     min([p.mass for p in particles])))
+        self.bin_width = SPEED_RANGE * top / bins if top > 0 else 1.0
+        self.counts = [0] * bins
+        self.masses = collections.Counter([p.mass for p in particles])
+        for p in particles:
+            self.counts[self.bin(math.hypot(p.vx, p.vy))] += 1
+
+    def bin(self, speed):
+        return min(int(speed / self.bin_width), len(self.counts) - 1)
+
+    def moved(self, old_speed, new_speed):
+        old = self.bin(old_speed)
+        new = self.bin(new_speed)
+        if old != new:
+            self.counts[old] -= 1
+            self.counts[new] += 1
+
+    def edges(self):
+        return [i * self.bin_width for i in range(0, len(self.counts) + 1)]
+
+    def expected(self, temperature):
+        """Counts of each bin under the Maxwell-Boltzmann distribution at
+        temperature (as kT). In 2D a particle of mass m is faster than v with
+        probability exp(-m v^2 / 2kT), summed here over each mass present."""
+        if temperature <= 0:
+            return [0.0] * len(self.counts)
+        edges = self.edges()
+        edges[-1] = math.inf
+        expected = []
+        for lo, hi in zip(edges, edges[1:]):
+            count = 0.0
+            for mass, n in self.masses.items():
+                above_lo = math.exp(-mass * lo * lo / (2.0 * temperature))
+                above_hi = math.exp(-mass * hi * hi / (2.0 * temperature)) if hi < math.inf else 0.0
+                count += n * (above_lo - above_hi)
+            expected.append(count)
+        return expected
+
+
+def entropy(counts, total):
+    return -sum([n / total * math.log(n / total) for n in counts if n])
+
+
+class MixingTracker:
+    """Mixing entropy of the particles that started in the left half of the
+    box against those that started in the right half (the two sides of the
+    partition in scenarios/diffusion.yml).
+
+    The box is cut into a coarse grid and the entropy is the species entropy
+    of each cell weighted by its share of the particles. It starts near 0
+    and tends to the entropy of the overall species fractions (ln 2 for an
+    even split) once both sides are spread evenly. Positions are only read
+    every MIXING_INTERVAL seconds, vectorized when NumPy is installed."""
+    def __init__(self, particles, walls, width, height, grid=MIXING_GRID):
+        self.particles = particles
+        self.xmin, self.ymin, xmax, ymax = placement.box_from_walls(walls, width, height)
+        self.cols, self.rows = grid
+        self.cell_width = (xmax - self.xmin) / self.cols
+        self.cell_height = (ymax - self.ymin) / self.rows
+        middle = (self.xmin + xmax) / 2.0
+        self.species = [0 if p.x < middle else 1 for p in particles]
+        left = self.species.count(0)
+        self.limit = entropy([left, len(particles) - left], len(particles)) if particles else 0.0
+        if np is not None:
+            self.species_array = np.array(self.species, dtype=np.int64)
+        self.history = []  # (time, entropy)
+        self.last_sample = None
+
+    def cell(self, x, y):
+        col = min(max(int((x - self.xmin) / self.cell_width), 0), self.cols - 1)
+        row = min(max(int((y - self.ymin) / self.cell_height), 0), self.rows - 1)
+        return col * self.rows + row
+
+    def counts(self, positions):
+        """Particles of each species in each cell, as (left, right) pairs"""
+        if np is not None:
+            x, y = positions
+            col = np.clip(((x - self.xmin) / self.cell_width).astype(np.int64), 0, self.cols - 1)
+            row = np.clip(((y - self.ymin) / self.cell_height).astype(np.int64), 0, self.rows - 1)
+            key = (col * self.rows + row) * 2 + self.species_array
+            found = np.bincount(key, minlength=2 * self.cols * self.rows)
+            return found.reshape(-1, 2).tolist()
+        found = [[0, 0] for i in range(0, self.cols * self.rows)]
+        for p, s in zip(self.particles, self.species):
+            found[self.cell(p.x, p.y)][s] += 1
+        return found
+
+    def entropy(self, positions=None):
+        """Current mixing entropy. positions may hand over (x, y) arrays the
+        caller already has"""
+        if not self.particles:
+            return 0.0
+        if positions is None and np is not None:
+            positions = (np.array([p.x for p in self.particles]),
+                         np.array([p.y for p in self.particles]))
+        total = len(self.particles)
+        return sum([sum(cell) / total * entropy(cell, sum(cell))
+                    for cell in self.counts(positions) if sum(cell)])
+
+    def sample(self, now, positions=None):
+        """Called once per tick, records a sample every MIXING_INTERVAL seconds"""
+        if self.last_sample is not None and now - self.last_sample < MIXING_INTERVAL - 1e-9:
+            return
+        self.last_sample = now
+        self.history.append((now, self.entropy(positions)))
+
+    def latest(self):
+        return self.history[-1][1] if self.history else 0.0
@@ -5,13 +5,22 @@ Defines particles for use in particle simulation
 
 import math
 import random
-from graphics import Point, Circle, Rectangle, color_rgb
+from colors import color_rgb
 from walls import LineSegment
 import math_utils
+import placement
+import toi
+from math_utils import Point
 
 
 class Particle:
     """Defines a Particle object which can be used in the Collision Simulator"""
+    # far smaller than a __dict__ each, which counts with millions of particles
+    __slots__ = ['index', 'window_width', 'window_height', 'x', 'y', 'vx', 'vy', 'mass',
+                 'radius', 'width', 'height', 'shape_type', 'color', 'collisionCnt',
+                 'last_collided_line', 'neighbors', 'neighbors_expiry', 'near_walls',
+                 '_heading_cnt', '_heading', '_extents', '_path_offsets']
+
     def __init__(self, index, window, radius=None, x=None, y=None,
                  vx=None, vy=None, mass=None, color=None, shape=None,
                  width=None, height=None):
@@ -33,6 +42,19 @@ class Particle:
         self.collisionCnt = 0  # used to whether event has become invalidated
         self.last_collided_line = None
 
+        # indices of the particles close enough to matter until neighbors_expiry
+        # (see neighbors.py). None means every particle is a candidate
+        self.neighbors = None
+        self.neighbors_expiry = math.inf
+        self.near_walls = None  # indices of the walls that matter, None for every one
+
+        # heading and the shape measurements derived from it only change when the
+        # velocity does, and every velocity change bumps collisionCnt
+        self._heading_cnt = None
+        self._heading = None
+        self._extents = None
+        self._path_offsets = None
+
         # set default values
         if radius is None:
             self.radius = 5.0
@@ -67,13 +89,30 @@ class Particle:
         self.y = self.y + (self.vy * dt)
 
     def direction(self):
-        return math_utils.degrees_clockwise(self.vy, self.vx)
+        """Heading in degrees clockwise from 12 o'clock, cached per collisionCnt"""
+        if self._heading_cnt != self.collisionCnt:
+            self._heading = math_utils.degrees_clockwise(self.vy, self.vx)
+            self._heading_cnt = self.collisionCnt
+            self._extents = None
+            self._path_offsets = None
+        return self._heading
+
+    def extents(self):
+        """Distance from the center to the edge in the direction of travel and in
+        the opposite direction (as used by timeToHit), cached with the heading"""
+        heading = self.direction()
+        if self._extents is None:
+            self._extents = (self.distFromCenter(heading),
+                             self.distFromCenter(180.0 - heading))
+        return self._extents
 
     def distFromCenter(self, deg):
         return self.radius
 
     def timeToHit(self, that):
         """Calculates time until collision with another Particle"""
+        if isinstance(that, RectParticle):
+            return that.timeToHit(self)  # exact rectangle vs circle test
 
         # distance
         dx = that.x - self.x  # switch to distance between nearest points?
@@ -90,9 +129,7 @@ class Particle:
         dvdv = dvx*dvx + dvy*dvy
         drdr = dx*dx + dy*dy
 
-        dist_from_center1 = self.distFromCenter(self.direction())
-        dist_from_center2 = that.distFromCenter(180.0 - that.direction())
-        sigma = dist_from_center1 + dist_from_center2
+        sigma = self.extents()[0] + that.extents()[1]
 
         d = (dvdr*dvdr) - (dvdv * (drdr - sigma*sigma))
         if d <= 0:
@@ -109,9 +146,32 @@ class Particle:
             return self.timeToHitHWall(wall)
         elif wall.wall_type == "VWall":
             return self.timeToHitVWall(wall)
+        elif wall.wall_type == "Disk":
+            return self.timeToHitDisk(wall)
+        elif wall.wall_type == "Box":
+            return self.timeToHitBox(wall)
         else:
             return self.timeToHitLineSegment(wall)
 
+    def timeToHitDisk(self, disk):
+        """calculates time until collision with a DiskObstacle"""
+        return toi.circle_circle(disk.x - self.x, disk.y - self.y, -self.vx, -self.vy,
+                                 self.radius + disk.radius)
+
+    def timeToHitBox(self, box):
+        """calculates time until collision with a BoxObstacle"""
+        return toi.rect_circle(self.x - box.x, self.y - box.y, self.vx, self.vy,
+                               box.width/2.0, box.height/2.0, self.radius)
+
+    def obstacleNormal(self, obstacle):
+        """unit vector pointing from an obstacle towards self at their point of contact"""
+        dx = self.x - obstacle.x
+        dy = self.y - obstacle.y
+        if obstacle.wall_type == "Box":
+            return toi.rect_circle_normal(dx, dy, obstacle.width/2.0, obstacle.height/2.0)
+        dist = math_utils.pythag(dx, dy)
+        return dx / dist, dy / dist
+
     def timeToHitHWall(self, wall):
         """calculates time (in ms) until collision with horizontal wall"""
         if self.y < wall.y and self.vy > 0:
@@ -151,6 +211,26 @@ class Particle:
 
         return Point(line.p0.x + x_dist, line.p0.y + y_dist)
 
+    def pathOffsets(self):
+        """Offsets from the center of the evenly spaced points along the leading
+        half of the particle used by timeToHitLineSegment, cached with the heading"""
+        heading = self.direction()
+        if self._path_offsets is None:
+            num_times_to_compute = min(int(self.radius) + 5, 31)
+
+            # always odd number so point on direction vector is represented
+            if num_times_to_compute % 2 == 0:
+                num_times_to_compute += 1
+
+            degree_interval = 180/(num_times_to_compute - 1)
+            start_deg = heading - 90.0
+            self._path_offsets = []
+            for i in range(0, num_times_to_compute):
+                new_deg = start_deg + (i * degree_interval)
+                self._path_offsets.append(Point(self.radius * math.sin(math.radians(new_deg)),
+                                                self.radius * math.cos(math.radians(new_deg))))
+        return self._path_offsets
+
     def timeToHitLineSegment(self, line):
         """calculates time to hit any line segment
 
@@ -160,19 +240,8 @@ class Particle:
         more precision
         """
         collision_times = []
-        num_times_to_compute = min(int(self.radius) + 5, 31)
-
-        # always odd number so point on direction vector is represented
-        if num_times_to_compute % 2 == 0:
-            num_times_to_compute += 1
-
-        degree_interval = 180/(num_times_to_compute - 1)
-        start_deg = self.direction() - 90.0
         scalar_factor = 1000.0
-        for i in range(0, num_times_to_compute):
-            new_deg = start_deg + (i * degree_interval)
-            adj = Point(self.radius * math.sin(math.radians(new_deg)),
-                        self.radius * math.cos(math.radians(new_deg)))
+        for adj in self.pathOffsets():
             p = Point(self.x + adj.x, self.y + adj.y)
             q = Point(p.x + (scalar_factor * self.vx),
                       p.y + (scalar_factor * self.vy))
@@ -196,23 +265,30 @@ class Particle:
         self.vy = self.vy + (fy / self.mass)
         self.collisionCnt = self.collisionCnt + 1
 
-    def bounceOff(self, that):
-        """adjusts velocity vectors of two objects after a collision"""
+    def contactNormal(self, that):
+        """unit vector pointing from self towards that at their point of contact"""
+        if isinstance(that, RectParticle):
+            nx, ny = that.contactNormal(self)
+            return -nx, -ny
+
         dx = that.x - self.x
         dy = that.y - self.y
+        dist = math_utils.pythag(dx, dy)
+        return dx / dist, dy / dist
+
+    def bounceOff(self, that):
+        """adjusts velocity vectors of two objects after a collision"""
+        nx, ny = self.contactNormal(that)
         dvx = that.vx - self.vx
         dvy = that.vy - self.vy
 
-        # dot product
-        dvdr = dx*dvx + dy*dvy
-
-        # calculate distance between centers
-        dist = math_utils.pythag(dx, dy)
+        # relative speed along the contact normal
+        dvdn = nx*dvx + ny*dvy
 
         # calculate magnitude of force
-        J = 2 * self.mass * that.mass * dvdr / ((self.mass + that.mass) * dist)
-        fx = J * dx / dist
-        fy = J * dy / dist
+        J = 2 * self.mass * that.mass * dvdn / (self.mass + that.mass)
+        fx = J * nx
+        fy = J * ny
 
         self.moveByForce(that, fx, fy)
         that.moveByForce(self, -fx, -fy)
@@ -232,6 +308,16 @@ class Particle:
         self.collisionCnt = self.collisionCnt + 1
         self.last_collided_line = None
 
+    def bounceOffObstacle(self, obstacle):
+        """reflects velocity about the obstacle's surface normal at the contact point"""
+        nx, ny = self.obstacleNormal(obstacle)
+        dot = nx * self.vx + ny * self.vy
+        if dot < 0:  # only if moving into the obstacle
+            self.vx = self.vx - 2 * dot * nx
+            self.vy = self.vy - 2 * dot * ny
+        self.collisionCnt = self.collisionCnt + 1
+        self.last_collided_line = None
+
     def bounceOffLineSegment(self, line):
         if self.last_collided_line is not None and self.last_collided_line == line:
             return
@@ -253,37 +339,9 @@ class Particle:
         self.last_collided_line = line
 
 
-class Immovable(Particle):
-    def __init__(self, index, window, radius=None,
-                 x=None, y=None, color=None):
-
-        super().__init__(index, window, radius, x, y, 0.0, 0.0, 1.0, color)
-
-    def timeToHit(self, that):
-        return math.inf
-
-    def timeToHitVWall(self):
-        return math.inf
-
-    def timeToHitHWall(self):
-        return math.inf
-
-    def moveByForce(self, that, fx, fy):
-        """double force otherwise collisions with this particle lose energy"""
-        that.vx = that.vx - (fx / self.mass)
-        that.vy = that.vy - (fy / self.mass)
-
-    def bounceOff(self, that):
-        pass
-
-    def bounceOffVWall(self):
-        pass
-
-    def bounceOffHWall(self):
-        pass
-
-
 class RectParticle(Particle):
+    __slots__ = []
+
     def __init__(self, index, window, radius=None, x=None, y=None,
                  vx=None, vy=None, mass=None, color=None, shape="Rect",
                  width=None, height=None):
@@ -341,22 +399,61 @@ class RectParticle(Particle):
         return math_utils.pythag(edgePoint.x - (self.width/2.0),
                                  edgePoint.y - (self.height/2.0))
 
-    # def timeToHit(self, that):
-    # Need a new timeToHit algorithm for rectangles...
-    # timeToHit is not computing correctly for long rectangles
-    # because it is computing the angle from the center
-    # rather than the edge (ie particle traveling straight up
-    # won't hit left or right edges of long rectangle because
-    # the angle calc tells it to use the vertical distance)
+    def timeToHit(self, that):
+        """Calculates exact time until collision with another Particle
+        (rectangles are swept as axis aligned boxes, see toi.py)"""
+        if self == that:
+            return math.inf
+        dx = that.x - self.x
+        dy = that.y - self.y
+        dvx = that.vx - self.vx
+        dvy = that.vy - self.vy
+        if isinstance(that, RectParticle):
+            return toi.rect_rect(dx, dy, dvx, dvy, (self.width + that.width)/2.0,
+                                 (self.height + that.height)/2.0)
+        return toi.rect_circle(dx, dy, dvx, dvy, self.width/2.0, self.height/2.0, that.radius)
+
+    def timeToHitLineSegment(self, line):
+        """Calculates exact time until collision with a line segment (including its ends)"""
+        return toi.rect_segment(self.x, self.y, self.vx, self.vy,
+                                self.width/2.0, self.height/2.0, line)
 
-    # def timeToHitLineSegment(self, line):
-    # Need a new timeToHitLineSegment to account for corners
+    def contactNormal(self, that):
+        """unit vector pointing from self towards that at their point of contact"""
+        dx = that.x - self.x
+        dy = that.y - self.y
+        if isinstance(that, RectParticle):
+            return toi.rect_rect_normal(dx, dy, (self.width + that.width)/2.0,
+                                        (self.height + that.height)/2.0)
+        return toi.rect_circle_normal(dx, dy, self.width/2.0, self.height/2.0)
+
+    def timeToHitDisk(self, disk):
+        return toi.rect_circle(disk.x - self.x, disk.y - self.y, -self.vx, -self.vy,
+                               self.width/2.0, self.height/2.0, disk.radius)
+
+    def timeToHitBox(self, box):
+        return toi.rect_rect(box.x - self.x, box.y - self.y, -self.vx, -self.vy,
+                             (self.width + box.width)/2.0, (self.height + box.height)/2.0)
+
+    def obstacleNormal(self, obstacle):
+        dx = obstacle.x - self.x
+        dy = obstacle.y - self.y
+        if obstacle.wall_type == "Box":
+            nx, ny = toi.rect_rect_normal(dx, dy, (self.width + obstacle.width)/2.0,
+                                          (self.height + obstacle.height)/2.0)
+        else:
+            nx, ny = toi.rect_circle_normal(dx, dy, self.width/2.0, self.height/2.0)
+        return -nx, -ny
 
 
 class ParticleShape():
     """Defines a shape object to be used for drawing the corresponding
     Particle object with the same index"""
     def __init__(self, index, window, particle):
+        # imported here so headless users of this module (workers, sweeps)
+        # never pull in Tk
+        from graphics import Point, Circle, Rectangle
+
         self.index = index
         self.window = window
         self.x = particle.x
@@ -399,6 +496,28 @@ class ParticleFactory:
             self.particles.append(RectParticle(self.count, self.window, **kwargs))
         else:
             self.particles.append(Particle(self.count, self.window, **kwargs))
-        self.particle_shapes.append(ParticleShape(self.count, self.window,
-                                                  self.particles[self.count]))
+        if self.particle_shapes is not None:
+            self.particle_shapes.append(ParticleShape(self.count, self.window,
+                                                      self.particles[self.count]))
         self.count += 1
+
+    def createGroups(self, groups, walls=(), mode='auto'):
+        """Creates n particles for every (n, kwargs) pair in groups.
+        Unless mode is 'random' the particles are placed so that none of them
+        overlap each other or the walls (see placement.place). Raises
+        placement.PlacementError when that is impossible."""
+        if mode == 'random':
+            for n, kwargs in groups:
+                for i in range(0, n):
+                    self.create(**kwargs)
+            return
+
+        extents = []
+        for n, kwargs in groups:
+            extents.extend([placement.extent(**kwargs)] * n)
+        box = placement.box_from_walls(walls, self.window.width, self.window.height)
+        positions = iter(placement.place(extents, box, walls, mode))
+        for n, kwargs in groups:
+            for i in range(0, n):
+                x, y = next(positions)
+                self.create(x=x, y=y, **kwargs)
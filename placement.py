@@ -0,0 +1,282 @@
+'''
+Module: placement.py
+Picks starting positions so that particles overlap
+neither each other nor the walls.
+'''
+
+import math
+import random
+
+# densest possible packing of equal discs in the plane
+MAX_PACKING_FRACTION = math.pi / (2.0 * math.sqrt(3.0))
+
+
+class PlacementError(ValueError):
+    """Raised when the requested particles cannot be placed without overlapping"""
+
+
+def extent(shape=None, radius=None, width=None, height=None, **kwargs):
+    """Radius of the smallest circle that encloses a particle with the given
+    settings (falls back to the same defaults as Particle)"""
+    radius = 5.0 if radius is None else radius
+    width = 2.0 * radius if width is None else width
+    height = 2.0 * radius if height is None else height
+    if shape in ["Square", "square", "Rect", "rect"]:
+        return math.hypot(width/2.0, height/2.0)
+    return max(radius, width/2.0, height/2.0)
+
+
+def segment_distance(x, y, line):
+    """Distance from (x, y) to the closest point of a LineSegment"""
+    dx = x - line.p0.x
+    dy = y - line.p0.y
+    if line.length == 0:
+        return math.hypot(dx, dy)
+    t = (dx * line.dx + dy * line.dy) / (line.length * line.length)
+    t = min(max(t, 0.0), 1.0)
+    return math.hypot(dx - t * line.dx, dy - t * line.dy)
+
+
+class PlacementGrid:
+    """Uniform grid of placed discs, boxes and line segments. Each item is registered
+    in every cell its bounding box touches, so an overlap query only needs to
+    look at the cells under the bounding box of the candidate."""
+    def __init__(self, xmin, ymin, xmax, ymax, cell_size):
+        self.xmin = xmin
+        self.ymin = ymin
+        self.cell_size = cell_size
+        self.cols = max(int((xmax - xmin) / cell_size) + 1, 1)
+        self.rows = max(int((ymax - ymin) / cell_size) + 1, 1)
+        self.discs = {}
+        self.boxes = {}
+        self.segments = {}
+
+    def cellRange(self, x0, y0, x1, y1):
+        i0 = min(max(int((x0 - self.xmin) / self.cell_size), 0), self.cols - 1)
+        i1 = min(max(int((x1 - self.xmin) / self.cell_size), 0), self.cols - 1)
+        j0 = min(max(int((y0 - self.ymin) / self.cell_size), 0), self.rows - 1)
+        j1 = min(max(int((y1 - self.ymin) / self.cell_size), 0), self.rows - 1)
+        return [(i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]
+
+    def addDisc(self, x, y, r):
+        for cell in self.cellRange(x - r, y - r, x + r, y + r):
+            self.discs.setdefault(cell, []).append((x, y, r))
+
+    def addBox(self, x, y, hw, hh):
+        for cell in self.cellRange(x - hw, y - hh, x + hw, y + hh):
+            self.boxes.setdefault(cell, []).append((x, y, hw, hh))
+
+    def addObstacle(self, wall):
+        """Registers a static wall: LineSegment, DiskObstacle or BoxObstacle"""
+        if wall.wall_type == "LineSegment":
+            self.addSegment(wall)
+        elif wall.wall_type == "Disk":
+            self.addDisc(wall.x, wall.y, wall.radius)
+        elif wall.wall_type == "Box":
+            self.addBox(wall.x, wall.y, wall.width/2.0, wall.height/2.0)
+
+    def addSegment(self, line):
+        # walk the segment in half-cell steps and register the cells around each step
+        steps = int(line.length / (self.cell_size / 2.0)) + 1
+        cells = set()
+        for k in range(0, steps + 1):
+            x = line.p0.x + line.dx * k / steps
+            y = line.p0.y + line.dy * k / steps
+            cells.update(self.cellRange(x - self.cell_size, y - self.cell_size,
+                                        x + self.cell_size, y + self.cell_size))
+        for cell in cells:
+            self.segments.setdefault(cell, []).append(line)
+
+    def overlaps(self, x, y, r):
+        for cell in self.cellRange(x - r, y - r, x + r, y + r):
+            for (ox, oy, orad) in self.discs.get(cell, ()):
+                reach = r + orad
+                if (x - ox) * (x - ox) + (y - oy) * (y - oy) < reach * reach:
+                    return True
+            for (bx, by, hw, hh) in self.boxes.get(cell, ()):
+                ox = x - min(max(x, bx - hw), bx + hw)
+                oy = y - min(max(y, by - hh), by + hh)
+                if ox * ox + oy * oy < r * r:
+                    return True
+            for line in self.segments.get(cell, ()):
+                if segment_distance(x, y, line) < r:
+                    return True
+        return False
+
+
+def box_from_walls(walls, width, height):
+    """Returns the (xmin, ymin, xmax, ymax) enclosed by the VWalls and HWalls"""
+    xs = [wall.x for wall in walls if wall.wall_type == "VWall"]
+    ys = [wall.y for wall in walls if wall.wall_type == "HWall"]
+    xmin, xmax = (min(xs), max(xs)) if len(xs) >= 2 else (0.0, width)
+    ymin, ymax = (min(ys), max(ys)) if len(ys) >= 2 else (0.0, height)
+    return xmin, ymin, xmax, ymax
+
+
+def obstacle_area(walls):
+    area = 0.0
+    for wall in walls:
+        if wall.wall_type == "Disk":
+            area += math.pi * wall.radius * wall.radius
+        elif wall.wall_type == "Box":
+            area += wall.width * wall.height
+    return area
+
+
+def check_packing(extents, box, walls=()):
+    xmin, ymin, xmax, ymax = box
+    area = (xmax - xmin) * (ymax - ymin) - obstacle_area(walls)
+    filled = sum(math.pi * e * e for e in extents)
+    if area <= 0 or filled > MAX_PACKING_FRACTION * area:
+        raise PlacementError(
+            "cannot place {0} particles: they would cover {1:.0%} of the free space, "
+            "more than the {2:.1%} densest packing allows"
+            .format(len(extents), filled / area if area > 0 else math.inf, MAX_PACKING_FRACTION))
+    for e in extents:
+        if 2 * e > min(xmax - xmin, ymax - ymin):
+            raise PlacementError("a particle of size {0} does not fit in the box".format(2 * e))
+
+
+class LatticeClass:
+    """Particles of one size laid on a lattice with one particle per cell"""
+    def __init__(self, extent, box, spacing):
+        self.extent = extent
+        self.spacing = spacing
+        self.xmin, self.ymin, xmax, ymax = box
+        self.cols = int((xmax - self.xmin) / self.spacing)
+        self.rows = int((ymax - self.ymin) / self.spacing)
+        self.occupied = {}  # lattice site -> (x, y) of the particle in that cell
+
+    def overlaps(self, x, y, r):
+        """True if a disc of radius r at (x, y) overlaps a particle of this class"""
+        reach = r + self.extent
+        i0 = max(int((x - reach - self.xmin) / self.spacing), 0)
+        i1 = min(int((x + reach - self.xmin) / self.spacing), self.cols - 1)
+        j0 = max(int((y - reach - self.ymin) / self.spacing), 0)
+        j1 = min(int((y + reach - self.ymin) / self.spacing), self.rows - 1)
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                other = self.occupied.get(i * self.rows + j)
+                if other is not None and ((x - other[0]) * (x - other[0]) +
+                                          (y - other[1]) * (y - other[1]) < reach * reach):
+                    return True
+        return False
+
+
+def fill_lattice(lattice, indices, positions, blocked):
+    """Puts each particle in indices on a random free site of lattice.
+    Returns the number placed."""
+    xmin, ymin, spacing, rows, e = lattice.xmin, lattice.ymin, lattice.spacing, lattice.rows, lattice.extent
+    total = lattice.cols * rows
+    slack = spacing/2.0 - e  # room to jitter inside the cell
+    uniform = random.uniform
+
+    wanted = len(indices) if blocked is None else 2 * len(indices) + 16
+    batch = random.sample(range(0, total), min(total, wanted))
+    while True:
+        placed = 0
+        lattice.occupied.clear()
+        for site in batch:
+            x = xmin + (site // rows + 0.5) * spacing
+            y = ymin + (site % rows + 0.5) * spacing
+            if slack > 0:
+                x += uniform(-slack, slack)
+                y += uniform(-slack, slack)
+            if blocked is not None and blocked(x, y, e):
+                continue
+            lattice.occupied[site] = positions[indices[placed]] = (x, y)
+            placed += 1
+            if placed == len(indices):
+                return placed
+        if len(batch) == total:
+            return placed
+        batch = random.sample(range(0, total), total)  # retry with every site
+
+
+def place_lattice(extents, box, obstacles):
+    """Jittered lattice fill. Particles are handled in classes of equal size,
+    largest first. Each class is laid on its own lattice with one particle per
+    cell and jittered within its cell; lattice sites that would overlap a wall
+    or a particle of an earlier class are skipped."""
+    xmin, ymin, xmax, ymax = box
+    area = (xmax - xmin) * (ymax - ymin)
+    grid = None
+    if obstacles:
+        grid = PlacementGrid(xmin, ymin, xmax, ymax, 2.0 * min(extents))
+        for wall in obstacles:
+            grid.addObstacle(wall)
+
+    classes = {}
+    for k, e in enumerate(extents):
+        classes.setdefault(e, []).append(k)
+
+    positions = [None] * len(extents)
+    placed_classes = []
+    for e in sorted(classes, reverse=True):
+        indices = classes[e]
+
+        def blocked(x, y, r):
+            return ((grid is not None and grid.overlaps(x, y, r)) or
+                    any(c.overlaps(x, y, r) for c in placed_classes))
+
+        check = blocked if (grid is not None or placed_classes) else None
+
+        # sparse classes get cells up to twice their size (so they can jitter);
+        # if that leaves too few free sites fall back to the tightest lattice
+        loose = min(max(2.0 * e, math.sqrt(area / (2.0 * len(indices)))), 4.0 * e)
+        for spacing in sorted({loose, 2.0 * e}, reverse=True):
+            lattice = LatticeClass(e, box, spacing)
+            placed = fill_lattice(lattice, indices, positions, check)
+            if placed == len(indices):
+                break
+        else:
+            raise PlacementError(
+                "lattice placement found room for {0} of {1} particles of size {2}"
+                .format(placed, len(indices), 2.0 * e))
+        placed_classes.append(lattice)
+
+    return positions
+
+
+def place_poisson(extents, box, obstacles, attempts=30):
+    """Dart throwing (Poisson-disk sampling with variable radii), largest particles
+    first, with a grid so each candidate is only tested against its neighbors"""
+    xmin, ymin, xmax, ymax = box
+    grid = PlacementGrid(xmin, ymin, xmax, ymax, 2.0 * min(extents))
+    for wall in obstacles:
+        grid.addObstacle(wall)
+
+    positions = [None] * len(extents)
+    uniform = random.uniform
+    for k in sorted(range(0, len(extents)), key=lambda k: -extents[k]):
+        e = extents[k]
+        for attempt in range(0, attempts):
+            x = uniform(xmin + e, xmax - e)
+            y = uniform(ymin + e, ymax - e)
+            if not grid.overlaps(x, y, e):
+                break
+        else:
+            raise PlacementError(
+                "could not place particle {0} of {1} (size {2}) without overlap after {3} "
+                "attempts; the scenario is too densely packed for random placement, try "
+                "placement: lattice or fewer particles".format(k + 1, len(extents), 2 * e, attempts))
+        grid.addDisc(x, y, e)
+        positions[k] = (x, y)
+    return positions
+
+
+def place(extents, box, walls=(), mode='auto'):
+    """Returns one (x, y) position per entry of extents such that no two discs of
+    those radii overlap and none of them crosses the box, a line segment wall
+    or an obstacle.
+    mode is 'lattice', 'poisson' or 'auto' (same as lattice)."""
+    if not extents:
+        return []
+    check_packing(extents, box, walls)
+    obstacles = [wall for wall in walls if wall.wall_type in ("LineSegment", "Disk", "Box")]
+
+    if mode == 'lattice' or mode == 'auto':
+        return place_lattice(extents, box, obstacles)
+    elif mode == 'poisson':
+        return place_poisson(extents, box, obstacles)
+    raise ValueError("unknown placement mode '{0}'".format(mode))
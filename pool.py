@@ -0,0 +1,403 @@
+'''
+Module: pool.py
+Defines WorkerPool which starts the worker processes
+that compute collision predictions.
+
+By default the pool has a worker for every CPU the process may run on but
+one, left to the main process. autoscale(), called once per frame, adds a
+worker while requests queue up faster than the workers take them and
+retires one while they sit mostly idle.
+
+supervise(), called once per frame as well, restarts any worker that died
+or has been stuck on one request for HANG_TIMEOUT seconds. Its unfinished
+requests come back as WorkLost messages among the results, for the
+simulation to submit again. With transport='queue' the workers share two
+queues, which one killed while reading or writing them can leave locked
+or half written, so every worker is restarted on new queues instead.
+
+With transport='domains' each worker owns a slab of the box and keeps
+its particles between requests (see domains.py).
+'''
+
+import collections
+import multiprocessing as mp
+import os
+import queue
+import time
+
+import domains
+import ring
+from collision import CollisionSystem
+from worker import WorkDone, WorkLost, STATUS_SIZE, STATUS_BUSY, STATUS_BEAT
+
+# modules every worker needs. With forkserver they are imported once in the
+# server process and every worker is forked with them already loaded.
+# None of them import Tk or YAML.
+PRELOAD_MODULES = ['collision', 'particles', 'walls', 'worker', 'ring', 'domains', 'pool']
+TRANSPORTS = ['auto', 'ring', 'queue', 'domains']
+AUTOSCALE_INTERVAL = 0.5  # seconds between autoscaling decisions
+GROW_BACKLOG = 4  # queued requests per worker that add a worker
+SHRINK_UTILIZATION = 0.25  # busy share of the workers under which one is retired
+HANG_TIMEOUT = 10.0  # seconds on one request after which a worker is restarted
+
+
+def get_context():
+    """Returns a forkserver context where the platform supports it, spawn otherwise"""
+    if 'forkserver' in mp.get_all_start_methods():
+        ctx = mp.get_context('forkserver')
+        ctx.set_forkserver_preload(PRELOAD_MODULES)
+        return ctx
+    return mp.get_context('spawn')
+
+
+def available_cpus():
+    """The CPUs this process may run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(0, os.cpu_count() or 1))
+
+
+def serve(work_q, result_q, ready_q, status, cpu):
+    """Entry point of a worker process. cpu, if given, is the one it is pinned to"""
+    if cpu is not None and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {cpu})
+    CollisionSystem.processWorkRequests(work_q, result_q, ready_q, status)
+
+
+class QueueSender:
+    """Main process side of the request queue, used like work_requested_q.
+    Remembers the requests no worker has finished."""
+    def __init__(self, transport):
+        self.transport = transport
+        self.outstanding = {}  # particle index -> counts of its unfinished requests
+
+    def put_nowait(self, request):
+        """None asks whichever worker takes it to stop"""
+        if request is not None:
+            self.outstanding.setdefault(request.particle_index, collections.deque()).append(
+                request.count)
+        self.transport.requests.put_nowait(request)
+
+    def finished(self, index):
+        counts = self.outstanding.get(index)
+        if counts:  # unknown once cleared
+            counts.popleft()
+            if not counts:
+                del self.outstanding[index]
+
+    def forget(self):
+        """Returns the (particle index, count) of every unfinished request
+        and forgets them"""
+        lost = [(index, count) for index, counts in self.outstanding.items() for count in counts]
+        self.outstanding = {}
+        return lost
+
+
+class QueueReceiver:
+    """Main process side of the result queue, used like work_completed_q"""
+    def __init__(self, transport):
+        self.transport = transport
+        self.received = collections.deque()  # results computed in the main process
+
+    def put_nowait(self, msg):
+        """For results computed in the main process, kept here as the queue's
+        feeder thread could leave them out of sight of empty() for a while"""
+        self.received.append(msg)
+
+    def empty(self):
+        return not self.received and self.transport.results.empty()
+
+    def get(self, block=True, timeout=None):
+        if self.received:
+            return self.received.popleft()
+        msg = self.transport.results.get(block, timeout)
+        if isinstance(msg, WorkDone):
+            self.transport.work_requested_q.finished(msg.particle_index)
+        return msg
+
+    def get_nowait(self):
+        return self.get(False)
+
+
+class QueueTransport:
+    """The two multiprocessing queues all workers share. Workers are given
+    the queues themselves, the simulation the sender and receiver, which
+    stay the same when rebuild() replaces the queues."""
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.requests = ctx.Queue()
+        self.results = ctx.Queue()
+        self.work_requested_q = QueueSender(self)
+        self.work_completed_q = QueueReceiver(self)
+
+    def backlog(self):
+        try:
+            return self.requests.qsize()
+        except NotImplementedError:  # macOS
+            return 0
+
+    def rebuild(self):
+        """Called once every worker has stopped. Abandons the queues for new
+        ones and returns the (particle index, count) of every request left
+        unfinished, including any whose results were still in the old queue."""
+        self.close()
+        self.requests = self.ctx.Queue()
+        self.results = self.ctx.Queue()
+        return self.work_requested_q.forget()
+
+    def clear(self):
+        """Discards the queued requests and results. Requests for workers to
+        stop are queued again, as the pool counts those workers as retiring."""
+        stops = 0
+        while not self.requests.empty():
+            if self.requests.get_nowait() is None:
+                stops += 1
+        while not self.results.empty():
+            self.results.get_nowait()
+        self.work_completed_q.received.clear()
+        for i in range(0, stops):
+            self.requests.put_nowait(None)
+        self.work_requested_q.forget()
+
+    def close(self):
+        # requests no worker will read would keep the feeder threads,
+        # and so the interpreter, from exiting
+        for q in [self.requests, self.results]:
+            q.cancel_join_thread()
+            q.close()
+
+
+class WorkerPool:
+    def __init__(self, num_workers=None, ctx=None, transport='auto', pin=False,
+                 min_workers=1, max_workers=None):
+        """num_workers defaults to one per available CPU but one, and autoscale()
+        keeps it between min_workers and max_workers (the CPU count by default).
+        transport is 'ring' for the shared memory rings of ring.py, 'queue'
+        for multiprocessing queues, 'domains' for rings to workers that each
+        own a slab of the particles or 'auto' for rings where shared memory
+        is available. pin ties each worker to a CPU of its own where the
+        platform allows it (see cpu())."""
+        if transport not in TRANSPORTS:
+            raise ValueError("unknown transport '{0}', choose from {1}".format(
+                transport, ', '.join(TRANSPORTS)))
+        self.ctx = ctx if ctx is not None else get_context()
+        self.cpus = available_cpus()
+        if num_workers is None:
+            num_workers = max(len(self.cpus) - 1, 1)
+        self.num_workers = num_workers
+        self.min_workers = min(min_workers, num_workers)
+        self.max_workers = max(max_workers or len(self.cpus), num_workers)
+        self.pin = pin and hasattr(os, 'sched_setaffinity')
+        if transport == 'auto':
+            transport = 'ring' if ring.available() else 'queue'
+        self.transport = transport
+        self.rings = None
+        self.queues = None
+        if transport == 'domains':
+            self.rings = domains.DomainTransport(self.ctx)
+        elif transport == 'ring':
+            self.rings = ring.RingTransport(self.ctx)
+        else:
+            self.queues = QueueTransport(self.ctx)
+        transport_ends = self.rings if self.rings is not None else self.queues
+        self.work_requested_q = transport_ends.work_requested_q
+        self.work_completed_q = transport_ends.work_completed_q
+        self.ready_q = self.ctx.Queue()
+        self.workers = {}  # number -> Process
+        self.status = {}  # number -> STATUS_ array the worker keeps up to date
+        self.started = {}  # number -> time the worker was started
+        self.retiring = 0  # workers asked to stop through the shared queue
+        self.startup_time = None
+        self.scale_ups = 0
+        self.scale_downs = 0
+        self.crashes = 0  # workers restarted after dying or hanging
+        self.requests_lost = 0
+        self.last_scale = None
+        self.last_busy = {}  # number -> busy seconds at the last autoscaling decision
+
+    def start(self, timeout=30.0):
+        """Starts the workers and blocks until every one of them has reported
+        ready. Returns the start-to-ready latency in seconds."""
+        start = time.perf_counter()
+        for n in range(0, self.num_workers):
+            self.launch(n)
+
+        deadline = start + timeout
+        for n in range(0, self.num_workers):
+            try:
+                self.ready_q.get(timeout=max(deadline - time.perf_counter(), 0.0))
+            except queue.Empty:
+                raise RuntimeError("WorkerPool: only {0} of {1} workers became ready within {2}s"
+                                   .format(n, self.num_workers, timeout))
+
+        self.startup_time = time.perf_counter() - start
+        self.last_scale = time.perf_counter()
+        return self.startup_time
+
+    def launch(self, n):
+        """Starts worker number n"""
+        if self.rings is not None:
+            end = self.rings.add(n)
+            queues = (end, end)
+        else:
+            queues = (self.queues.requests, self.queues.results)
+        cpu = self.cpu(n)
+        self.status[n] = self.ctx.Array('d', STATUS_SIZE, lock=False)
+        self.last_busy[n] = 0.0
+        worker = self.ctx.Process(target=serve, args=queues + (self.ready_q, self.status[n], cpu))
+        worker.daemon = True
+        worker.start()
+        self.workers[n] = worker
+        self.started[n] = time.perf_counter()
+
+    def cpu(self, n):
+        """The CPU worker n is pinned to, None if it isn't. The main process
+        keeps the first CPU, so workers beyond the others are left unpinned
+        rather than doubling up on it."""
+        if self.pin and n + 1 < len(self.cpus):
+            return self.cpus[n + 1]
+        return None
+
+    def size(self):
+        """Workers running and not asked to stop"""
+        if self.rings is not None:
+            return len(self.rings.active)
+        return len(self.workers) - self.retiring
+
+    def backlog(self):
+        """Requests queued that no worker has started on"""
+        if self.rings is not None:
+            return self.rings.backlog()
+        return self.queues.backlog()
+
+    def grow(self):
+        n = 0
+        while n in self.workers:
+            n += 1
+        self.launch(n)  # its ready message is left in ready_q
+        self.scale_ups += 1
+
+    def shrink(self):
+        if self.rings is not None:
+            n = max(self.rings.active)
+            self.rings.remove(n)
+        else:
+            self.work_requested_q.put_nowait(None)  # whichever worker takes it stops
+            self.retiring += 1
+        self.scale_downs += 1
+
+    def supervise(self):
+        """Forgets workers that were asked to stop and have, and restarts
+        those that died or hung. Returns the number restarted."""
+        now = time.time()
+        restarted = 0
+        failed = 0
+        for n, worker in list(self.workers.items()):
+            beat = self.status[n][STATUS_BEAT]
+            hung = beat > 0 and now - beat > HANG_TIMEOUT
+            if worker.is_alive() and not hung:
+                continue
+            if self.queues is not None and (hung or worker.exitcode != 0):
+                failed += 1  # left in place for rebuild()
+                continue
+            if hung:
+                worker.terminate()
+            worker.join()
+            del self.workers[n]
+            if worker.exitcode == 0:  # stopped when asked to
+                if self.queues is not None:
+                    self.retiring = max(self.retiring - 1, 0)
+                continue
+            self.lose(self.rings.recover(n))
+            self.launch(n)
+            self.crashes += 1
+            restarted += 1
+        if failed:
+            restarted += self.rebuild()
+            self.crashes += failed
+        return restarted
+
+    def rebuild(self):
+        """With queues, a worker that died or hung may have held a queue's
+        lock or left a message in it half written, either of which would
+        stall the others. Stops every worker, moves to new queues, hands back
+        every unfinished request and starts as many workers as were serving.
+        Returns that number."""
+        num_workers = max(self.size(), 1)
+        for worker in self.workers.values():
+            worker.terminate()
+        for worker in self.workers.values():
+            worker.join()
+        self.workers = {}
+        self.retiring = 0  # the stop requests went with the old queue
+        self.lose(self.queues.rebuild())
+        for n in range(0, num_workers):
+            self.launch(n)  # their ready messages are left in ready_q
+        return num_workers
+
+    def lose(self, lost):
+        """Hands back a WorkLost for each (particle index, count) of a request
+        no worker will finish"""
+        for index, count in lost:
+            self.work_completed_q.put_nowait(WorkLost(index, count))
+        self.requests_lost += len(lost)
+
+    def autoscale(self):
+        """Called regularly, every AUTOSCALE_INTERVAL seconds adds a worker if
+        requests are queueing up or retires one if the workers are mostly idle"""
+        now = time.perf_counter()
+        if self.last_scale is None or now - self.last_scale < AUTOSCALE_INTERVAL:
+            return
+        self.supervise()
+        busy = {n: self.status[n][STATUS_BUSY] for n in self.workers}
+        utilization = sum([busy[n] - self.last_busy[n] for n in busy]) / \
+            ((now - self.last_scale) * max(self.size(), 1))
+        self.last_scale = now
+        self.last_busy = busy
+        backlog = self.backlog()
+        if backlog > GROW_BACKLOG * self.size() and self.size() < self.max_workers:
+            self.grow()
+        elif backlog == 0 and utilization < SHRINK_UTILIZATION and self.size() > self.min_workers:
+            self.shrink()
+
+    def utilization(self):
+        """Share of its lifetime each running worker spent computing"""
+        now = time.perf_counter()
+        return {n: self.status[n][STATUS_BUSY] / (now - self.started[n])
+                for n in sorted(self.workers)}
+
+    def summary(self):
+        metrics = {
+            'transport': self.transport,
+            'workers': self.size(),
+            'pinned': self.pin,
+            'scale_ups': self.scale_ups,
+            'scale_downs': self.scale_downs,
+            'worker_crashes': self.crashes,
+            'requests_lost': self.requests_lost,
+            'worker_utilization': self.utilization(),
+        }
+        if self.transport == 'domains':
+            metrics.update(self.rings.summary())
+        return metrics
+
+    def clear(self):
+        """Discards any queued work requests and results"""
+        if self.rings is not None:
+            self.rings.clear()
+        else:
+            self.queues.clear()
+
+    def stop(self):
+        """Terminates the workers. The pool cannot be started again."""
+        for worker in self.workers.values():
+            worker.terminate()
+        for worker in self.workers.values():
+            worker.join()
+        if self.rings is not None:
+            for n in list(self.rings.active):
+                self.rings.remove(n, stop=False)
+        else:
+            self.queues.close()
+        self.workers = {}
+        self.retiring = 0
@@ -0,0 +1,48 @@
+'''
+Module: recorder.py
+Defines TrajectoryRecorder which keeps the position of every particle at
+a fixed interval of simulated time, for offline analysis or comparing
+runs. Frames are stored as NumPy arrays in float64 or, to halve their
+size, float32. Requires NumPy.
+'''
+
+import numpy as np
+
+
+class TrajectoryRecorder:
+    def __init__(self, particles, interval, precision='float64'):
+        """interval is the simulated time between frames and precision
+        'float64' or 'float32'"""
+        self.particles = particles
+        self.interval = interval
+        self.dtype = np.dtype(precision)
+        self.times = []
+        self.frames = []  # one (2, n) array of x and y per frame
+        self.last_sample = None
+
+    def sample(self, now, positions=None):
+        """Called once per tick, records a frame every interval seconds.
+        positions may hand over (x, y) arrays the caller already has"""
+        if self.last_sample is not None and now - self.last_sample < self.interval - 1e-9:
+            return
+        self.last_sample = now
+        frame = np.empty((2, len(self.particles)), dtype=self.dtype)
+        if positions is None:
+            frame[0] = [p.x for p in self.particles]
+            frame[1] = [p.y for p in self.particles]
+        else:
+            frame[0], frame[1] = positions
+        self.times.append(now)
+        self.frames.append(frame)
+
+    def positions(self):
+        """Every frame as one (frames, 2, n) array"""
+        if not self.frames:
+            return np.zeros((0, 2, len(self.particles)), dtype=self.dtype)
+        return np.stack(self.frames)
+
+    def nbytes(self):
+        return sum([frame.nbytes for frame in self.frames])
+
+    def save(self, path):
+        np.savez_compressed(path, times=np.array(self.times), positions=self.positions())
@@ -0,0 +1,380 @@
+'''
+Module: ring.py
+Defines the shared memory ring buffers a WorkerPool can talk to its
+workers through instead of multiprocessing queues, which pickle every
+message from a feeder thread and push it through a pipe.
+
+Each worker gets a ring of requests and a ring of results. Each ring has
+a single writer, which only moves its head, and a single reader, which
+only moves its tail, so neither needs a lock. Results are fixed-size
+event records, and the main process reads every record waiting in a
+ring as one slice of the buffer. Requests are length-prefixed pickled
+frames. The snapshot of the particles goes once per dispatch in a world
+frame that the requests after it are computed against.
+'''
+
+import collections
+import pickle
+import queue
+import struct
+import time
+import weakref
+from multiprocessing import shared_memory
+
+from collision import Event
+from worker import WorkDone, WorkRequest
+
+HEADER = 128  # head and tail, each on its own cache line
+HEAD = 0  # index of the head in the header viewed as int64
+TAIL = 8
+REQUEST_RING_BYTES = 16 * 2**20  # per worker, frames larger than half of it are spilled
+RESULT_RING_RECORDS = 2**16  # per worker
+SPIN = 0.0002  # seconds between polls of a full or empty ring
+
+RECORD = struct.Struct('<dqqqqq')  # time, a, b, countA, countB, kind
+PAIR, WALL, REFRESH, DONE, DROPPED = range(0, 5)  # kinds of record, b of a WALL is its index
+FRAME = struct.Struct('<q')  # length of the frame's payload, WRAP to skip to the start
+WRAP = -1
+WORLD, REQUEST, SPILLED, STOP = range(0, 4)  # kinds of frame
+
+
+def available():
+    """True if shared memory can be created here"""
+    try:
+        shm = shared_memory.SharedMemory(create=True, size=HEADER)
+    except (OSError, ValueError):
+        return False
+    shm.close()
+    shm.unlink()
+    return True
+
+
+def release(shm, views, unlink):
+    for view in views:
+        view.release()
+    shm.close()
+    if unlink:
+        shm.unlink()
+
+
+class Ring:
+    """size bytes of shared memory behind a head and a tail. name attaches
+    to a ring made by another process."""
+    def __init__(self, size, name=None):
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=HEADER + size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.size = size
+        self.index = self.shm.buf[:HEADER].cast('q')
+        self.data = self.shm.buf[HEADER:HEADER + size]
+        weakref.finalize(self, release, self.shm, [self.data, self.index], name is None)
+
+    def __reduce__(self):
+        return (type(self), (self.size, self.name))
+
+    def used(self):
+        return self.index[HEAD] - self.index[TAIL]
+
+
+class RecordRing(Ring):
+    """Ring of fixed-size RECORDs"""
+    def __init__(self, capacity, name=None):
+        super().__init__(capacity * RECORD.size, name)
+        self.capacity = capacity
+
+    def __reduce__(self):
+        return (type(self), (self.capacity, self.name))
+
+    def write(self, *values):
+        """Adds one record, False if the ring is full"""
+        head = self.index[HEAD]
+        if head - self.index[TAIL] >= self.capacity:
+            return False
+        RECORD.pack_into(self.data, (head % self.capacity) * RECORD.size, *values)
+        self.index[HEAD] = head + 1  # published once the record is in place
+        return True
+
+    def read(self):
+        """Every record waiting, as tuples"""
+        head = self.index[HEAD]
+        tail = self.index[TAIL]
+        records = []
+        while tail < head:
+            start = tail % self.capacity
+            count = min(head - tail, self.capacity - start)
+            records.extend(RECORD.iter_unpack(
+                self.data[start * RECORD.size:(start + count) * RECORD.size]))
+            tail += count
+        self.index[TAIL] = tail
+        return records
+
+
+class FrameRing(Ring):
+    """Ring of variable length frames, each padded to a multiple of 8 bytes"""
+    def __init__(self, size, name=None):
+        super().__init__(size - size % 8, name)
+
+    def fits(self, n):
+        """True if a payload of n bytes can always be written eventually"""
+        return FRAME.size + n <= self.size // 2
+
+    def write(self, payload):
+        """Adds one frame, False if the ring has no room for it"""
+        n = len(payload)
+        frame = FRAME.size + (n + 7) // 8 * 8
+        head = self.index[HEAD]
+        start = head % self.size
+        skip = self.size - start if frame > self.size - start else 0
+        if self.used() + skip + frame > self.size:
+            return False
+        if skip:
+            FRAME.pack_into(self.data, start, WRAP)
+            head += skip
+            start = 0
+        FRAME.pack_into(self.data, start, n)
+        self.data[start + FRAME.size:start + FRAME.size + n] = payload
+        self.index[HEAD] = head + frame
+        return True
+
+    def take(self):
+        """Removes the oldest frame and returns it unpickled, None if there is none"""
+        tail = self.index[TAIL]
+        if tail == self.index[HEAD]:
+            return None
+        start = tail % self.size
+        n = FRAME.unpack_from(self.data, start)[0]
+        if n == WRAP:
+            tail += self.size - start
+            start = 0
+            n = FRAME.unpack_from(self.data, start)[0]
+        frame = pickle.loads(self.data[start + FRAME.size:start + FRAME.size + n])
+        self.index[TAIL] = tail + FRAME.size + (n + 7) // 8 * 8
+        return frame
+
+
+class WorkerEnd:
+    """A worker's side of its two rings. Stands in for both queues of
+    CollisionSystem.processWorkRequests."""
+    def __init__(self, requests, results, ready, spill):
+        self.requests = requests
+        self.results = results
+        self.ready = ready  # counts the frames waiting in requests
+        self.spill = spill  # frames too large for the ring
+        self.particles = None
+        self.walls = None
+        self.wall_index = {}
+
+    def get(self):
+        """The next request, None once the worker is asked to stop"""
+        while True:
+            self.ready.acquire()
+            kind, body = self.requests.take()
+            if kind == SPILLED:
+                kind, body = self.spill.get()
+            if kind == STOP:
+                return None
+            if kind == REQUEST:
+                body.particles = self.particles
+                body.walls = self.walls
+                return body
+            self.load(kind, body)
+
+    def load(self, kind, body):
+        """Takes in a frame that is not a request"""
+        snapshot, walls = body
+        self.particles = pickle.loads(snapshot)
+        self.setWalls(walls)
+
+    def setWalls(self, walls):
+        if walls is not None:
+            self.walls = walls
+            self.wall_index = {id(wall): i for i, wall in enumerate(walls)}
+
+    def put_nowait(self, msg):
+        if isinstance(msg, WorkDone):
+            record = (0.0, msg.particle_index, 0, 0, 0, DROPPED if msg.dropped else DONE)
+        elif msg.b is None:
+            record = (msg.time, msg.a, 0, msg.countA, 0, REFRESH)
+        elif isinstance(msg.b, int):
+            record = (msg.time, msg.a, msg.b, msg.countA, msg.countB, PAIR)
+        else:
+            record = (msg.time, msg.a, self.wall_index[id(msg.b)], msg.countA, 0, WALL)
+        while not self.results.write(*record):
+            time.sleep(SPIN)  # the main process drains the ring every tick
+
+
+class RequestSender:
+    """Main process side of the request rings, used like work_requested_q"""
+    def __init__(self, transport):
+        self.transport = transport
+        self.snapshots = {}  # worker -> last world sent to it
+        self.walls = {}
+        self.queued = {}  # worker -> ring positions its queued requests end at
+        self.outstanding = {}  # worker -> (particle index, count) of its unfinished requests
+
+    def put_nowait(self, request):
+        transport = self.transport
+        n = min(transport.active, key=lambda i: transport.requests[i].used())
+        snapshot = request.snapshot
+        if snapshot is None:
+            snapshot = pickle.dumps(request.particles, pickle.HIGHEST_PROTOCOL)
+        if snapshot is not self.snapshots.get(n):
+            walls = request.walls if request.walls is not self.walls.get(n) else None
+            self.write(n, (WORLD, (snapshot, walls)))
+            self.snapshots[n] = snapshot
+            self.walls[n] = request.walls
+        self.send(n, request)
+
+    def send(self, n, request, batch=None):
+        """Writes request, without its particles, to worker n's ring.
+        batch, if given, replaces the request's."""
+        transport = self.transport
+        transport.walls = request.walls
+        batch = request.batch if batch is None else batch
+        self.write(n, (REQUEST, WorkRequest(request.particle_index, request.time, request.limit,
+                                            None, None, request.candidates, batch,
+                                            request.count, request.counts_name)))
+        self.queued.setdefault(n, collections.deque()).append(transport.requests[n].index[HEAD])
+        self.outstanding.setdefault(n, collections.deque()).append(
+            (request.particle_index, request.count))
+
+    def stop(self, n):
+        """Asks worker n to stop once it has computed what is in its ring"""
+        self.write(n, (STOP, None))
+        self.forget(n)
+
+    def forget(self, n):
+        """A worker started in n's place has no world yet"""
+        self.snapshots.pop(n, None)
+        self.walls.pop(n, None)
+
+    def backlog(self, n):
+        """Requests in worker n's ring it has not started on"""
+        queued = self.queued.setdefault(n, collections.deque())
+        tail = self.transport.requests[n].index[TAIL]
+        while queued and queued[0] <= tail:
+            queued.popleft()
+        return len(queued)
+
+    def write(self, n, frame):
+        transport = self.transport
+        payload = pickle.dumps(frame, pickle.HIGHEST_PROTOCOL)
+        if not transport.requests[n].fits(len(payload)):
+            transport.spill[n].put(frame)
+            payload = pickle.dumps((SPILLED, None))
+        while not transport.requests[n].write(payload):
+            # the worker may be waiting for room in its result ring in turn
+            transport.work_completed_q.drain()
+            time.sleep(SPIN)
+        transport.ready[n].release()
+
+
+class ResultReceiver:
+    """Main process side of the result rings, used like work_completed_q"""
+    def __init__(self, transport):
+        self.transport = transport
+        self.received = collections.deque()
+
+    def drain(self):
+        walls = self.transport.walls
+        outstanding = self.transport.work_requested_q.outstanding
+        for n, ring in self.transport.results.items():
+            for t, a, b, count_a, count_b, kind in ring.read():
+                if kind == PAIR:
+                    self.received.append(Event(t, a, b, count_a, count_b))
+                elif kind == WALL:
+                    self.received.append(Event(t, a, walls[b], count_a, None))
+                elif kind == REFRESH:
+                    self.received.append(Event(t, a, None, count_a, None))
+                else:
+                    self.received.append(WorkDone(a, kind == DROPPED))
+                    outstanding[n].popleft()  # each worker finishes its requests in order
+
+    def put_nowait(self, msg):
+        """For results computed in the main process"""
+        self.received.append(msg)
+
+    def empty(self):
+        if not self.received:
+            self.drain()
+        return not self.received
+
+    def get(self, block=True, timeout=None):
+        end = None if timeout is None else time.perf_counter() + timeout
+        while self.empty():
+            if not block or (end is not None and time.perf_counter() >= end):
+                raise queue.Empty
+            time.sleep(SPIN)
+        return self.received.popleft()
+
+    def get_nowait(self):
+        return self.get(False)
+
+
+class RingTransport:
+    """The rings between the main process and its workers, numbered from 0.
+    Requests only go to the active workers."""
+    def __init__(self, ctx, request_bytes=REQUEST_RING_BYTES, result_records=RESULT_RING_RECORDS):
+        self.ctx = ctx
+        self.request_bytes = request_bytes
+        self.result_records = result_records
+        self.requests = {}
+        self.results = {}
+        self.ready = {}
+        self.spill = {}
+        self.active = []
+        self.walls = []  # of the simulation the requests came from
+        self.work_requested_q = RequestSender(self)
+        self.work_completed_q = ResultReceiver(self)
+
+    def add(self, n):
+        """Makes worker n active, with new rings the first time, and returns
+        the WorkerEnd for it"""
+        if n not in self.requests:
+            self.requests[n] = FrameRing(self.request_bytes)
+            self.results[n] = RecordRing(self.result_records)
+            self.ready[n] = self.ctx.Semaphore(0)
+            self.spill[n] = self.ctx.Queue()
+        self.active.append(n)
+        return WorkerEnd(self.requests[n], self.results[n], self.ready[n], self.spill[n])
+
+    def remove(self, n, stop=True):
+        """Sends worker n no more requests and, with stop, asks it to stop"""
+        self.active.remove(n)
+        if stop:
+            self.work_requested_q.stop(n)
+        else:
+            self.work_requested_q.forget(n)
+
+    def backlog(self):
+        return sum([self.work_requested_q.backlog(n) for n in self.requests])
+
+    def recover(self, n):
+        """Called once worker n has died. Keeps the results it finished,
+        empties its request ring for a worker started in its place and
+        returns the (particle index, count) of every request it left unfinished."""
+        self.work_completed_q.drain()
+        if n in self.active:
+            self.active.remove(n)
+        sender = self.work_requested_q
+        sender.forget(n)
+        sender.queued.pop(n, None)
+        lost = list(sender.outstanding.pop(n, []))
+        requests = self.requests[n]
+        requests.index[TAIL] = requests.index[HEAD]
+        while self.ready[n].acquire(False):
+            pass
+        while True:
+            try:
+                self.spill[n].get_nowait()
+            except queue.Empty:
+                break
+        return lost
+
+    def clear(self):
+        """Discards the results waiting. Requests already in the rings are
+        still computed, or dropped by the workers once stale."""
+        self.work_completed_q.drain()
+        self.work_completed_q.received.clear()
@@ -0,0 +1,194 @@
+'''
+Module: scenario_cache.py
+Compiles scenario files into a flat binary format and caches them
+by a hash of the source file, so loading a scenario skips YAML.
+
+A compiled scenario holds
+- a string table (group keys, colors, shapes, wall keys, placement)
+- one row of doubles per particle group, per wall, per obstacle and per
+  explicit particle state (see GROUP_FIELDS, WALL_FIELDS,
+  OBSTACLE_FIELDS and STATE_FIELDS)
+
+Explicit states describe every particle one by one (group, x, y, vx, vy)
+which suits large imported datasets. They can be written straight to a
+compiled file with write() and loaded like any other scenario.
+'''
+
+import hashlib
+import os
+import struct
+from array import array
+
+MAGIC = b'PSCN'
+VERSION = 3
+# magic, version, placement, groups, walls, obstacles, states, string bytes
+HEADER = struct.Struct('<4sHHIIIII')
+CACHE_DIR = '.scenario_cache'
+
+GROUP_FIELDS = ['key', 'n', 'color', 'radius', 'mass', 'shape', 'width', 'height',
+                'x', 'y', 'vx', 'vy']
+GROUP_STRINGS = {'key', 'color', 'shape'}
+WALL_FIELDS = ['key', 'p0x', 'p0y', 'p1x', 'p1y']
+WALL_STRINGS = {'key'}
+OBSTACLE_FIELDS = ['key', 'shape', 'color', 'x', 'y', 'radius', 'width', 'height']
+OBSTACLE_STRINGS = {'key', 'shape', 'color'}
+STATE_FIELDS = ['group', 'x', 'y', 'vx', 'vy']
+
+
+class ScenarioFormatError(ValueError):
+    """Raised when a compiled scenario is corrupt or from another format version,
+    or a scenario has a field the format does not hold"""
+
+
+def compile_config(config_data):
+    """Returns config_data (as loaded from a scenario file) in the compiled format"""
+    strings = ['']  # index 0 is the empty string, used for missing values
+    index = {'': 0}
+
+    def intern(value):
+        value = str(value)
+        if value not in index:
+            index[value] = len(strings)
+            strings.append(value)
+        return index[value]
+
+    def row(data, fields, string_fields, key):
+        unknown = sorted(set(data) - set(fields))
+        if unknown:
+            # dropping them would make a cached load differ from a YAML one
+            raise ScenarioFormatError("unknown field(s) {0} in '{1}'".format(
+                ', '.join(map(str, unknown)), key))
+        values = []
+        for field in fields:
+            value = key if field == 'key' else data.get(field)
+            if field in string_fields:
+                values.append(intern(value) if value is not None else 0)
+            else:
+                values.append(float(value) if value is not None else float('nan'))
+        return values
+
+    placement_index = intern(config_data.get('placement', ''))
+
+    groups = array('d')
+    group_keys = []
+    for key, group in config_data.get('particles', {}).items():
+        groups.extend(row(group, GROUP_FIELDS, GROUP_STRINGS, key))
+        group_keys.append(str(key))
+
+    walls = array('d')
+    for key, wall in config_data.get('walls', {}).items():
+        walls.extend(row(wall, WALL_FIELDS, WALL_STRINGS, key))
+
+    obstacles = array('d')
+    for key, obstacle in config_data.get('obstacles', {}).items():
+        obstacles.extend(row(obstacle, OBSTACLE_FIELDS, OBSTACLE_STRINGS, key))
+
+    states = config_data.get('states')
+    if states is None:
+        states = array('d')
+    elif not isinstance(states, array):
+        # rows of [group key, x, y, vx, vy] as written in a scenario file
+        flat = array('d')
+        for state in states:
+            flat.append(group_keys.index(str(state[0])))
+            flat.extend(float(v) for v in state[1:])
+        states = flat
+
+    string_bytes = '\0'.join(strings).encode('utf-8')
+    header = HEADER.pack(MAGIC, VERSION, placement_index,
+                         len(groups) // len(GROUP_FIELDS), len(walls) // len(WALL_FIELDS),
+                         len(obstacles) // len(OBSTACLE_FIELDS),
+                         len(states) // len(STATE_FIELDS), len(string_bytes))
+    return (header + string_bytes + groups.tobytes() + walls.tobytes() +
+            obstacles.tobytes() + states.tobytes())
+
+
+def decode(data):
+    """Returns the config data stored in a compiled scenario. Explicit states,
+    if any, are returned as a flat array('d') under 'states'."""
+    if len(data) < HEADER.size:
+        raise ScenarioFormatError("compiled scenario is truncated")
+    magic, version, placement_index, n_groups, n_walls, n_obstacles, n_states, n_strings = \
+        HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ScenarioFormatError("not a version {0} compiled scenario".format(VERSION))
+
+    view = memoryview(data)
+    offset = HEADER.size
+    strings = bytes(view[offset:offset + n_strings]).decode('utf-8').split('\0')
+    offset += n_strings
+
+    def rows(count, fields, string_fields):
+        nonlocal offset
+        values = array('d')
+        values.frombytes(view[offset:offset + count * len(fields) * values.itemsize])
+        offset += count * len(fields) * values.itemsize
+        if len(values) != count * len(fields):
+            raise ScenarioFormatError("compiled scenario is truncated")
+        result = {}
+        for r in range(0, count):
+            entry = {}
+            for f, field in enumerate(fields):
+                value = values[r * len(fields) + f]
+                if field in string_fields:
+                    if value or field == 'key':  # string 0 marks a missing value
+                        entry[field] = strings[int(value)]
+                elif value == value:  # skip NaN (missing value)
+                    entry[field] = int(value) if field == 'n' else value
+            result[entry.pop('key')] = entry
+        return result
+
+    config_data = {
+        'particles': rows(n_groups, GROUP_FIELDS, GROUP_STRINGS),
+        'walls': rows(n_walls, WALL_FIELDS, WALL_STRINGS),
+    }
+    if n_obstacles:
+        config_data['obstacles'] = rows(n_obstacles, OBSTACLE_FIELDS, OBSTACLE_STRINGS)
+    if placement_index:
+        config_data['placement'] = strings[placement_index]
+    if n_states:
+        states = array('d')
+        states.frombytes(view[offset:offset + n_states * len(STATE_FIELDS) * states.itemsize])
+        if len(states) != n_states * len(STATE_FIELDS):
+            raise ScenarioFormatError("compiled scenario is truncated")
+        config_data['states'] = states
+    return config_data
+
+
+def write(path, config_data):
+    """Writes config_data to path in the compiled format"""
+    with open(path, 'wb') as f:
+        f.write(compile_config(config_data))
+
+
+def cache_path(source, cache_dir=CACHE_DIR):
+    digest = hashlib.sha1(source).hexdigest()
+    return os.path.join(cache_dir, 'v{0}-{1}.pscn'.format(VERSION, digest))
+
+
+def load(path, cache_dir=CACHE_DIR):
+    """Loads a scenario file. Compiled files are decoded directly; YAML files are
+    compiled once and afterwards read from cache_dir, keyed by their contents."""
+    with open(path, 'rb') as f:
+        source = f.read()
+    if source[:len(MAGIC)] == MAGIC:
+        return decode(source)
+
+    cached = cache_path(source, cache_dir)
+    try:
+        with open(cached, 'rb') as f:
+            return decode(f.read())
+    except (OSError, ScenarioFormatError):
+        pass
+
+    import yaml  # only needed on a cache miss
+    compiled = compile_config(yaml.safe_load(source))
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = cached + '.{0}.tmp'.format(os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(compiled)
+        os.replace(tmp, cached)  # atomic, so parallel loaders never see half a file
+    except OSError:
+        pass  # read-only checkout: still works, just without the cache
+    return decode(compiled)
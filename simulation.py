@@ -0,0 +1,311 @@
+'''
+Module: simulation.py
+Defines Simulation which builds a scenario from config data
+and advances the event driven simulation one logic tick at a time.
+Used by main.py for the GUI and by sweep.py for headless runs.
+'''
+
+import copy
+import queue
+import time
+
+from collision import CollisionSystem
+from eventstore import EventStore
+from worker import WorkTracker
+from engine_select import Estimate, EngineSelector
+from neighbors import NeighborList
+from observables import Observables, MixingTracker
+from watchdog import Watchdog
+from particles import ParticleFactory
+from walls import VWall, HWall, LineSegment, DiskObstacle, BoxObstacle
+from math_utils import Point
+
+MENU_HEIGHT = 20.0  # space reserved at the bottom of the window for the menu bar
+PREDICTION_LIMIT = 10000  # how far ahead (in seconds) collisions are predicted
+NEIGHBOR_LIST_MIN = 500  # particle count from which neighbor lists pay off
+EVENT_BUDGET = 256 * 2**20  # default memory budget of the event store, in bytes
+WORK_DEPTH = 128  # prediction requests handed to the workers at once
+BLOCK_TIMEOUT = 1.0  # longest a tick waits for predictions under the 'block' policy
+ENGINES = ['event', 'stepped', 'auto']
+PRECISIONS = ['float64', 'float32']
+
+
+class Bounds:
+    """Stands in for a GraphWin when a simulation runs without a display"""
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+
+
+def check_run(engine, precision):
+    """Raises ValueError for an unknown engine or precision, or for float32
+    with the event engine, whose state lives in the particles as Python floats"""
+    if engine not in ENGINES:
+        raise ValueError("unknown engine '{0}', choose from {1}".format(
+            engine, ', '.join(ENGINES)))
+    if precision not in PRECISIONS:
+        raise ValueError("unknown precision '{0}', choose from {1}".format(
+            precision, ', '.join(PRECISIONS)))
+    if engine == 'event' and precision != 'float64':
+        raise ValueError("precision '{0}' needs the stepped or auto engine".format(precision))
+
+
+def load_scenario(config_data, window, particles, particle_shapes, walls):
+    """Creates the particles and walls described by config_data.
+    particle_shapes may be None when nothing will be drawn.
+    config_data['placement'] picks how particles are placed (default 'auto').
+    If config_data has 'states' (see scenario_cache) every particle is created
+    from its explicit state instead and the group sizes are ignored."""
+    pf = ParticleFactory(window, particles, particle_shapes)
+
+    walls.append(VWall(0.0))
+    walls.append(VWall(window.width - 1))
+    walls.append(HWall(0.0))
+    walls.append(HWall(window.height - MENU_HEIGHT - 1))
+
+    dataMap = copy.deepcopy(config_data)
+    for key in dataMap.get('walls', {}):
+        curr = dataMap['walls'][key]
+        line = LineSegment(Point(curr['p0x'], curr['p0y']), Point(curr['p1x'], curr['p1y']))
+        walls.append(line)
+
+    # obstacles are static so they are kept with the walls
+    for key in dataMap.get('obstacles', {}):
+        curr = dataMap['obstacles'][key]
+        if curr.get('shape') in ["Square", "square", "Rect", "rect"]:
+            walls.append(BoxObstacle(curr['x'], curr['y'], curr['width'], curr['height'],
+                                     curr.get('color')))
+        else:
+            walls.append(DiskObstacle(curr['x'], curr['y'], curr['radius'], curr.get('color')))
+
+    states = dataMap.get('states')
+    if states is not None:
+        # explicit initial state for every particle: rows of group, x, y, vx, vy
+        groups = []
+        for key in dataMap['particles']:
+            curr = dataMap['particles'][key]
+            curr.pop('n', None)
+            groups.append(curr)
+        for i in range(0, len(states), 5):
+            pf.create(x=states[i + 1], y=states[i + 2], vx=states[i + 3], vy=states[i + 4],
+                      **groups[int(states[i])])
+        return
+
+    groups = []
+    for key in dataMap['particles']:
+        curr = dataMap['particles'][key]
+        n = curr.pop('n')
+        groups.append((n, curr))
+    pf.createGroups(groups, walls, dataMap.get('placement', 'auto'))
+
+
+class Simulation:
+    def __init__(self, config_data, window, work_requested_q=None, work_completed_q=None,
+                 particle_shapes=None, ticks_per_second=60, neighbor_skin=None,
+                 engine='event', watchdog=True, precision='float64', record_interval=None,
+                 event_budget=EVENT_BUDGET, late_policy='backdate', pool=None):
+        """engine is 'event' for the event driven CollisionSystem, 'stepped' for
+        the time stepped SteppedEngine (see stepped.py, needs NumPy) or 'auto' to
+        let EngineSelector pick and switch between them (see engine_select.py).
+        neighbor_skin sets the skin distance of the neighbor lists (see neighbors.py).
+        None turns them on with an automatic skin for scenarios of at least
+        NEIGHBOR_LIST_MIN particles or with obstacles, whose grid only serves
+        predictions through the lists, and 0 turns them off.
+        watchdog turns on the sampled physics checks of watchdog.py.
+        precision is the float type the stepped engine keeps its state in and
+        recorded positions are stored in. float32 needs the stepped engine, or
+        'auto' where it applies while the stepped engine runs. record_interval, if given, records
+        every particle's position that often (see recorder.py, needs NumPy).
+        event_budget caps the memory of predicted events (see eventstore.py),
+        None lets it grow freely. late_policy is how worker results that
+        would arrive after they are due are dealt with, 'backdate', 'block'
+        or 'inline' (see WorkTracker in worker.py). pool, if given, is the
+        WorkerPool behind the queues, whose metrics summary() includes.
+        Workers that keep their own copy of the particles (a work_requested_q
+        from domains.py) need the neighbor lists, which are then always on."""
+        self.window = window
+        self.particles = []
+        self.particle_shapes = particle_shapes
+        self.walls = []
+        self.pq = EventStore(event_budget)
+
+        # without worker queues every prediction is computed inline
+        # at the end of the tick that requested it
+        self.inline = work_requested_q is None
+        self.work_requested_q = queue.SimpleQueue() if self.inline else work_requested_q
+        self.work_completed_q = queue.SimpleQueue() if self.inline else work_completed_q
+        self.pool = pool
+        self.resident = getattr(self.work_requested_q, 'resident', False)
+        if self.resident and neighbor_skin == 0:
+            raise ValueError("workers keeping the particles resident need neighbor lists")
+
+        self.time_per_tick = 1.0/ticks_per_second
+        self.next_logic_tick = self.time_per_tick
+        self.ticks = 0
+        self.events_processed = 0
+        self.wall_time = 0.0
+
+        load_scenario(config_data, window, self.particles, self.particle_shapes, self.walls)
+        # worker processes only see the live collision counts through shared memory
+        self.tracker = WorkTracker(self.particles, self.walls, shared=not self.inline,
+                                   time_per_tick=self.time_per_tick,
+                                   depth=None if self.inline else WORK_DEPTH,
+                                   policy=late_policy, resident=self.resident)
+
+        check_run(engine, precision)
+        self.precision = precision
+        self.recorder = None
+        if record_interval is not None:
+            from recorder import TrajectoryRecorder  # NumPy is only needed for recording
+            self.recorder = TrajectoryRecorder(self.particles, record_interval, precision)
+            self.recorder.sample(0.0)
+        self.neighbor_skin = neighbor_skin
+        self.engine = None
+        self.stepper = None
+        self.neighbors = None
+        self.observables = Observables(self.particles, self.walls, window.width, window.height)
+        self.mixing = MixingTracker(self.particles, self.walls, window.width, window.height)
+        self.mixing.sample(0.0)
+
+        # the selector picks the engine in auto mode and otherwise only
+        # recommends the other engine when it looks much faster
+        estimate = Estimate(self.particles, self.walls, window.width, window.height,
+                            self.time_per_tick, self.wantsNeighborLists())
+        self.selector = EngineSelector(estimate, switching=engine == 'auto')
+        if engine == 'auto':
+            engine = self.selector.initial()
+        else:
+            self.selector.recommended = engine
+        self.useEngine(engine)
+        self.watchdog = Watchdog(self) if watchdog else None
+
+    def wantsNeighborLists(self):
+        obstacles = any([w.wall_type in ["Disk", "Box"] for w in self.walls])
+        return self.neighbor_skin != 0 and (self.neighbor_skin is not None or self.resident or
+                                            len(self.particles) >= NEIGHBOR_LIST_MIN or obstacles)
+
+    def useEngine(self, engine):
+        """Starts engine from the particles' current state"""
+        switching = self.engine is not None
+        self.engine = engine
+        self.pq.clear()
+        if engine == 'stepped':
+            from stepped import SteppedEngine  # NumPy is only needed for this engine
+            self.stepper = SteppedEngine(self.particles, self.walls, self.observables,
+                                         self.precision)
+            self.neighbors = None
+            return
+
+        self.stepper = None
+        if switching:
+            for particle in self.particles:
+                particle.collisionCnt += 1  # invalidates predictions still in flight
+            self.tracker.sync()
+
+        now = self.next_logic_tick - self.time_per_tick  # time the positions are at
+        if self.wantsNeighborLists():
+            self.neighbors = NeighborList(self.particles, self.time_per_tick, self.neighbor_skin,
+                                          self.walls)
+            self.neighbors.refreshAll(now)
+
+        everyone = frozenset(range(0, len(self.particles)))
+        for particle in self.particles:
+            CollisionSystem.predict(particle, now, PREDICTION_LIMIT, self.particles,
+                                    self.walls, self.work_completed_q, batch=everyone)
+
+    @property
+    def sim_time(self):
+        return self.ticks * self.time_per_tick
+
+    def tick(self):
+        """Moves each particle forward to the next logic tick then processes
+        every event due before it, so predictions made while processing start
+        from positions that match the time they are stamped with"""
+        start = time.perf_counter()
+        if self.stepper is not None:
+            self.events_processed += self.stepper.step(self.time_per_tick)
+        else:
+            for particle in self.particles:
+                particle.move(self.time_per_tick)  # moves each particle in linear line
+
+            # particles whose far events were evicted predict them again
+            # before they come due
+            for index in self.pq.due(self.next_logic_tick, self.particles):
+                self.tracker.submit(index, self.next_logic_tick, PREDICTION_LIMIT, self.walls)
+
+            CollisionSystem.processCompletedWork(self.work_completed_q, self.pq,
+                                                 self.next_logic_tick, self.tracker)
+            if self.tracker.policy == 'block' and not self.inline:
+                CollisionSystem.awaitOutstandingWork(self.work_requested_q,
+                                                     self.work_completed_q, self.pq,
+                                                     self.next_logic_tick, self.tracker,
+                                                     BLOCK_TIMEOUT)
+            self.events_processed += CollisionSystem.processCollisionEvents(
+                self.particles, self.walls, self.pq, self.next_logic_tick,
+                self.work_requested_q, self.work_completed_q, self.neighbors,
+                self.observables, self.tracker)
+
+            if self.inline:
+                CollisionSystem.processPendingWork(self.work_requested_q, self.work_completed_q)
+
+        self.next_logic_tick += self.time_per_tick
+        self.ticks += 1
+        self.observables.sample(self.sim_time)
+        if self.watchdog is not None:
+            self.watchdog.tick()
+        # the stepped engine already holds the positions as arrays
+        positions = None if self.stepper is None else (self.stepper.x, self.stepper.y)
+        self.mixing.sample(self.sim_time, positions)
+        if self.recorder is not None:
+            self.recorder.sample(self.sim_time, positions)
+        self.wall_time += time.perf_counter() - start
+
+        engine = self.selector.observe(self)
+        if engine is not None:
+            start = time.perf_counter()
+            self.useEngine(engine)
+            self.wall_time += time.perf_counter() - start
+            self.selector.startWindow(self)  # measure the new engine without the switch
+
+    def run(self, duration):
+        """Runs ticks back to back, as fast as possible, until
+        duration seconds of simulated time have passed"""
+        end_tick = self.ticks + int(round(duration / self.time_per_tick))
+        while self.ticks < end_tick:
+            self.tick()
+
+    def kineticEnergy(self):
+        """Full scan of the particles, self.observables keeps the same total
+        without one"""
+        return sum(0.5 * p.mass * (p.vx*p.vx + p.vy*p.vy) for p in self.particles)
+
+    def summary(self):
+        """Returns summary metrics for the run so far"""
+        metrics = {
+            'particles': len(self.particles),
+            'engine': self.engine,
+            'ticks': self.ticks,
+            'sim_time': self.sim_time,
+            'wall_time': self.wall_time,
+            'events': self.events_processed,
+            'events_per_sim_second': self.events_processed / self.sim_time if self.ticks else 0.0,
+            'kinetic_energy': self.observables.energy,
+            'temperature': self.observables.temperature(),
+            'pressure': self.observables.pressure(),
+            'momentum_x': self.observables.px,
+            'momentum_y': self.observables.py,
+            'speed_bin_width': self.observables.speeds.bin_width,
+            'speed_counts': list(self.observables.speeds.counts),
+            'mixing_entropy': self.mixing.latest(),
+            'mixing_history': [list(sample) for sample in self.mixing.history],
+            'precision': self.precision,
+            'event_store_bytes': self.pq.nbytes(),
+            'event_store_peak_bytes': self.pq.peakBytes(),
+            'events_evicted': self.pq.events_evicted,
+            'state_bytes_per_particle': self.stepper.stateBytes() if self.stepper else 0.0,
+            'trajectory_bytes': self.recorder.nbytes() if self.recorder else 0,
+        }
+        if self.pool is not None:
+            metrics.update(self.pool.summary())  # requests_lost below is this run's
+        metrics.update(self.tracker.summary())
+        return metrics
@@ -0,0 +1,367 @@
+'''
+Module: stepped.py
+Defines SteppedEngine, a time stepped alternative to the event driven
+CollisionSystem for very dense scenarios where the event rate explodes.
+
+Every particle is advanced by a fixed substep, overlapping pairs are
+found with a cell list sweep and bounced in vectorized batches. Discs
+collide as discs. Rectangles are tested with the exact time of impact
+routines of toi_arrays.py, which tell an overlap that is still closing
+in, and bounce along the same contact normals as in the event engine.
+Requires NumPy.
+
+The state arrays can be kept in float32 to halve their memory. Contact
+tests and impulses are then still worked out in float64 from the float32
+state, so only the stored positions and velocities are rounded.
+'''
+
+import math
+import numpy as np
+import placement
+import toi_arrays
+
+MAX_TRAVEL = 0.5  # furthest a particle may move in one substep, in smallest radii
+MAX_ROUNDS = 8  # batches per substep before the remaining contacts wait for the next one
+BIG_RADIUS = 4.0  # particles this many median radii across are checked against everything
+NEIGHBOR_CELLS = [(0, 0), (1, -1), (1, 0), (1, 1), (0, 1)]  # each cell pair visited once
+
+
+def is_rect(p):
+    return p.shape_type in ["Square", "square", "Rect", "rect"]
+
+
+class SteppedEngine:
+    def __init__(self, particles, walls, observables=None, precision='float64'):
+        """precision is 'float64' or 'float32', the type the state is stored in"""
+        self.particles = particles
+        self.observables = observables
+        self.precision = precision
+        dtype = np.dtype(precision)
+        self.x = np.array([p.x for p in particles], dtype=dtype)
+        self.y = np.array([p.y for p in particles], dtype=dtype)
+        self.vx = np.array([p.vx for p in particles], dtype=dtype)
+        self.vy = np.array([p.vy for p in particles], dtype=dtype)
+        # enclosing circles, what the cell list and disc pairs go by
+        self.radius = np.array([placement.extent(p.shape_type, p.radius, p.width, p.height)
+                                for p in particles], dtype=dtype)
+        self.is_rect = np.array([is_rect(p) for p in particles], dtype=bool)
+        self.rects = np.nonzero(self.is_rect)[0]
+        if len(self.rects):
+            self.hw = np.where(self.is_rect, [p.width / 2.0 for p in particles],
+                               self.radius).astype(dtype)
+            self.hh = np.where(self.is_rect, [p.height / 2.0 for p in particles],
+                               self.radius).astype(dtype)
+        else:
+            self.hw = self.hh = self.radius  # half extents, a disc's are its radius
+        self.inner = np.minimum(self.hw, self.hh) if len(self.rects) else self.radius
+        self.inv_mass = 1.0 / np.array([p.mass for p in particles], dtype=dtype)
+
+        self.vwalls = [w.x for w in walls if w.wall_type == "VWall"]
+        self.hwalls = [w.y for w in walls if w.wall_type == "HWall"]
+        self.segments = [w for w in walls if w.wall_type == "LineSegment"]
+        self.disks = [w for w in walls if w.wall_type == "Disk"]
+        self.boxes = [w for w in walls if w.wall_type == "Box"]
+
+        # the cell list is sized for the ordinary particles, the few huge ones
+        # are paired with everything instead of blowing up the cell size
+        self.is_big = self.radius > BIG_RADIUS * np.median(self.radius) if len(particles) else \
+            np.zeros(0, dtype=bool)
+        self.big = np.nonzero(self.is_big)[0]
+        self.small = np.nonzero(np.logical_not(self.is_big))[0]
+        small_radius = self.radius[self.small].max() if len(self.small) else 1.0
+        self.cell_size = 2.0 * small_radius
+        self.min_radius = self.inner.min() if len(particles) else 1.0
+
+        self.collisions = 0
+
+    def stateBytes(self):
+        """Bytes of array state per particle"""
+        arrays = [self.x, self.y, self.vx, self.vy, self.radius, self.inv_mass, self.is_big,
+                  self.is_rect, self.hw, self.hh, self.inner]
+        arrays = {id(a): a for a in arrays}.values()  # without rectangles all radius
+        return sum([a.nbytes for a in arrays]) / max(len(self.particles), 1)
+
+    def substeps(self, dt):
+        """Substeps needed for no particle to move more than MAX_TRAVEL radii in one"""
+        if not len(self.particles):
+            return 1
+        top_speed = math.sqrt(float((self.vx*self.vx + self.vy*self.vy).max()))
+        return max(1, int(math.ceil(top_speed * dt / (MAX_TRAVEL * self.min_radius))))
+
+    def step(self, dt):
+        """Advances every particle by dt, copies the new state back onto the
+        particles and returns the number of collisions"""
+        n = self.substeps(dt)
+        h = dt / n
+        hit = np.zeros(len(self.particles), dtype=bool)
+        count = 0
+        for i in range(0, n):
+            self.x += self.vx * h
+            self.y += self.vy * h
+            count += self.collideWalls(hit)
+            count += self.collideParticles(hit)
+        self.writeBack(hit)
+        self.collisions += count
+        return count
+
+    def writeBack(self, hit):
+        """Particles that bounced get their collisionCnt bumped like in the
+        event engine so anything caching per velocity notices"""
+        for p, x, y, vx, vy, bounced in zip(self.particles, self.x.tolist(), self.y.tolist(),
+                                            self.vx.tolist(), self.vy.tolist(), hit.tolist()):
+            p.x = x
+            p.y = y
+            if bounced:
+                old_vx, old_vy = p.vx, p.vy
+                p.vx = vx
+                p.vy = vy
+                p.collisionCnt = p.collisionCnt + 1
+                p.last_collided_line = None
+                if self.observables is not None:
+                    self.observables.bounced(p, old_vx, old_vy)
+
+    def reflect(self, touching, nx, ny, hit, boundary=False):
+        """Reflects the velocity of every touching particle moving against
+        the normal (nx, ny) pointing from the surface towards it. The momentum
+        the surface takes goes to the observables, and to the pressure too
+        for boundary walls"""
+        dot = self.vx * nx + self.vy * ny
+        mask = touching & (dot < 0)
+        if not mask.any():
+            return 0
+        if self.observables is not None:
+            impulse = -2.0 * dot[mask] / self.inv_mass[mask]
+            self.observables.static_px -= float((impulse * nx[mask]).sum())
+            self.observables.static_py -= float((impulse * ny[mask]).sum())
+            if boundary:
+                self.observables.wall_impulse += float(impulse.sum())
+        self.vx[mask] -= 2.0 * dot[mask] * nx[mask]
+        self.vy[mask] -= 2.0 * dot[mask] * ny[mask]
+        hit |= mask
+        return int(mask.sum())
+
+    def reflectFromPoint(self, cx, cy, reach, hit):
+        """Bounces particles off the surface points (cx, cy) closest to them
+        when nearer than reach"""
+        dx = np.subtract(self.x, cx, dtype=np.float64)
+        dy = np.subtract(self.y, cy, dtype=np.float64)
+        dist = np.sqrt(dx*dx + dy*dy)
+        touching = (dist < reach) & (dist > 0)
+        dist[dist == 0] = 1.0
+        return self.reflect(touching, dx / dist, dy / dist, hit)
+
+    def rectState(self):
+        """Positions and velocities of the rectangles, in float64"""
+        return [a[self.rects].astype(np.float64) for a in [self.x, self.y, self.vx, self.vy]]
+
+    def reflectRects(self, touching, nx, ny, hit):
+        """reflect() for the rectangles, with touching and the normals given
+        for them alone"""
+        n = len(self.particles)
+        mask = np.zeros(n, dtype=bool)
+        mask[self.rects] = touching
+        full_nx = np.zeros(n)
+        full_ny = np.zeros(n)
+        full_nx[self.rects] = nx
+        full_ny[self.rects] = ny
+        return self.reflect(mask, full_nx, full_ny, hit)
+
+    def collideWalls(self, hit):
+        count = 0
+        zeros = np.zeros(len(self.particles))
+        for wx in self.vwalls:
+            d = self.x - wx
+            count += self.reflect(np.abs(d) < self.hw, np.sign(d), zeros, hit, True)
+        for wy in self.hwalls:
+            d = self.y - wy
+            count += self.reflect(np.abs(d) < self.hh, zeros, np.sign(d), hit, True)
+
+        rects = len(self.rects) > 0
+        reach = self.radius
+        if rects:
+            reach = np.where(self.is_rect, 0.0, self.radius)  # discs only
+            hw = self.hw[self.rects].astype(np.float64)
+            hh = self.hh[self.rects].astype(np.float64)
+
+        for line in self.segments:
+            ex = line.p1.x - line.p0.x
+            ey = line.p1.y - line.p0.y
+            t = ((self.x - line.p0.x) * ex + (self.y - line.p0.y) * ey) / (ex*ex + ey*ey)
+            t = np.clip(t, 0.0, 1.0)
+            count += self.reflectFromPoint(line.p0.x + t * ex, line.p0.y + t * ey, reach, hit)
+            if rects:
+                # off the segment's normal, as in the event engine
+                x, y, vx, vy = self.rectState()
+                touching = toi_arrays.rect_segment(x, y, vx, vy, hw, hh, line) == 0.0
+                side = np.where((x - line.p0.x) * -ey + (y - line.p0.y) * ex < 0, -1.0, 1.0)
+                count += self.reflectRects(touching, -ey / line.length * side,
+                                           ex / line.length * side, hit)
+        for disk in self.disks:
+            count += self.reflectFromPoint(disk.x, disk.y, reach + disk.radius, hit)
+            if rects:
+                x, y, vx, vy = self.rectState()
+                dx = disk.x - x
+                dy = disk.y - y
+                touching = toi_arrays.rect_circle(dx, dy, -vx, -vy, hw, hh, disk.radius) == 0.0
+                nx, ny = toi_arrays.rect_circle_normal(dx, dy, hw, hh)
+                count += self.reflectRects(touching, -nx, -ny, hit)
+        for box in self.boxes:
+            hw_box = box.width / 2.0
+            hh_box = box.height / 2.0
+            dx = self.x - box.x
+            dy = self.y - box.y
+            inside = (np.abs(dx) < hw_box) & (np.abs(dy) < hh_box) & (reach > 0)
+            count += self.reflectFromPoint(box.x + np.clip(dx, -hw_box, hw_box),
+                                           box.y + np.clip(dy, -hh_box, hh_box),
+                                           reach, hit)
+            if inside.any():
+                # centre inside the box: push out through the nearest side
+                sideways = hw_box - np.abs(dx) < hh_box - np.abs(dy)
+                nx = np.where(sideways, np.sign(dx), 0.0)
+                ny = np.where(sideways, 0.0, np.sign(dy))
+                count += self.reflect(inside, nx, ny, hit)
+            if rects:
+                x, y, vx, vy = self.rectState()
+                dx = box.x - x
+                dy = box.y - y
+                touching = toi_arrays.rect_rect(dx, dy, -vx, -vy, hw + hw_box, hh + hh_box) == 0.0
+                nx, ny = toi_arrays.rect_rect_normal(dx, dy, hw + hw_box, hh + hh_box)
+                count += self.reflectRects(touching, -nx, -ny, hit)
+        return count
+
+    def candidatePairs(self):
+        """Index arrays (i, j) of every pair close enough to possibly overlap:
+        ordinary particles in the same or adjacent cells, plus each big
+        particle with every other particle"""
+        first = []
+        second = []
+        small = self.small
+        if len(small) > 1:
+            size = self.cell_size
+            cx = np.floor(self.x[small] / size).astype(np.int64)
+            cy = np.floor(self.y[small] / size).astype(np.int64)
+            cx -= cx.min()
+            cy -= cy.min() - 1  # a spare row either side so (cx, cy +- 1) never wraps
+            rows = int(cy.max()) + 2
+            key = cx * rows + cy
+            order = np.argsort(key, kind='stable')
+            cells, start, count = np.unique(key[order], return_index=True, return_counts=True)
+
+            for ox, oy in NEIGHBOR_CELLS:
+                target = cells + ox * rows + oy
+                pos = np.minimum(np.searchsorted(cells, target), len(cells) - 1)
+                found = cells[pos] == target
+                a = np.nonzero(found)[0]
+                b = pos[found]
+                pairs = count[a] * count[b]
+                total = int(pairs.sum())
+                if total == 0:
+                    continue
+                # enumerate every (member of a, member of b) combination
+                owner = np.repeat(np.arange(len(a)), pairs)
+                k = np.arange(total) - np.repeat(np.cumsum(pairs) - pairs, pairs)
+                nb = count[b][owner]
+                ia = start[a][owner] + k // nb
+                jb = start[b][owner] + k % nb
+                if ox == 0 and oy == 0:
+                    keep = ia < jb
+                    ia = ia[keep]
+                    jb = jb[keep]
+                first.append(small[order[ia]])
+                second.append(small[order[jb]])
+
+        everyone = np.arange(len(self.particles))
+        for b in self.big:
+            others = everyone[np.logical_not(self.is_big) | (everyone > b)]
+            first.append(np.full(len(others), b))
+            second.append(others)
+
+        if not first:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(first), np.concatenate(second)
+
+    def rectContacts(self, i, j, dx, dy, dvx, dvy):
+        """Contact normals (from i towards j) of pairs where at least one
+        particle is a rectangle, and which of the pairs overlap while still
+        closing in: their time of impact is 0. A rectangle and a disc are
+        swept relative to the rectangle."""
+        both = self.is_rect[i] & self.is_rect[j]
+        flip = np.where(self.is_rect[i], 1.0, -1.0)
+        rect = np.where(self.is_rect[i], i, j)
+        other = np.where(self.is_rect[i], j, i)
+        dx = dx * flip
+        dy = dy * flip
+        dvx = dvx * flip
+        dvy = dvy * flip
+        hw = self.hw[rect].astype(np.float64)
+        hh = self.hh[rect].astype(np.float64)
+        hw_pair = np.where(both, hw + self.hw[other], hw)
+        hh_pair = np.where(both, hh + self.hh[other], hh)
+        t = np.where(both, toi_arrays.rect_rect(dx, dy, dvx, dvy, hw_pair, hh_pair),
+                     toi_arrays.rect_circle(dx, dy, dvx, dvy, hw, hh, self.radius[other]))
+        rect_nx, rect_ny = toi_arrays.rect_rect_normal(dx, dy, hw_pair, hh_pair)
+        disc_nx, disc_ny = toi_arrays.rect_circle_normal(dx, dy, hw, hh)
+        nx = np.where(both, rect_nx, disc_nx) * flip
+        ny = np.where(both, rect_ny, disc_ny) * flip
+        return nx, ny, t == 0.0
+
+    def collideParticles(self, hit):
+        """Bounces every overlapping pair that is still approaching. A particle
+        can touch several others at once so each batch only takes pairs whose
+        particles are in no earlier pair, and the rest are re-checked with
+        the updated velocities in the next batch."""
+        i, j = self.candidatePairs()
+        count = 0
+        for batch in range(0, MAX_ROUNDS):
+            # differences are taken in float64 whatever the state is stored in
+            dx = np.subtract(self.x[j], self.x[i], dtype=np.float64)
+            dy = np.subtract(self.y[j], self.y[i], dtype=np.float64)
+            dvx = np.subtract(self.vx[j], self.vx[i], dtype=np.float64)
+            dvy = np.subtract(self.vy[j], self.vy[i], dtype=np.float64)
+            dvdr = dx*dvx + dy*dvy
+            sigma = np.add(self.radius[i], self.radius[j], dtype=np.float64)
+            near = dx*dx + dy*dy < sigma*sigma  # the enclosing circles overlap
+            rects = near & (self.is_rect[i] | self.is_rect[j])
+            live = near & np.logical_not(rects) & (dvdr < 0)
+
+            nx = np.zeros(len(i))
+            ny = np.zeros(len(i))
+            dvdn = np.zeros(len(i))
+            dist = np.sqrt(dx[live]*dx[live] + dy[live]*dy[live])
+            nx[live] = dx[live] / dist
+            ny[live] = dy[live] / dist
+            dvdn[live] = dvdr[live] / dist
+            if rects.any():
+                k = np.nonzero(rects)[0]
+                nx[k], ny[k], touching = self.rectContacts(i[k], j[k], dx[k], dy[k],
+                                                           dvx[k], dvy[k])
+                dvdn[k] = nx[k]*dvx[k] + ny[k]*dvy[k]
+                live[k] = touching & (dvdn[k] < 0)
+            if not live.any():
+                break
+            i = i[live]
+            j = j[live]
+
+            order = np.arange(len(i))
+            first = np.full(len(self.particles), len(i))
+            np.minimum.at(first, i, order)
+            np.minimum.at(first, j, order)
+            now = (first[i] == order) & (first[j] == order)
+            a = i[now]
+            b = j[now]
+
+            nx = nx[live][now]
+            ny = ny[live][now]
+            dvdn = dvdn[live][now]
+            impulse = 2.0 * dvdn / np.add(self.inv_mass[a], self.inv_mass[b], dtype=np.float64)
+            self.vx[a] += impulse * self.inv_mass[a] * nx
+            self.vy[a] += impulse * self.inv_mass[a] * ny
+            self.vx[b] -= impulse * self.inv_mass[b] * nx
+            self.vy[b] -= impulse * self.inv_mass[b] * ny
+            hit[a] = True
+            hit[b] = True
+            count += len(a)
+
+            i = i[np.logical_not(now)]
+            j = j[np.logical_not(now)]
+        return count
@@ -0,0 +1,143 @@
+'''
+Program: sweep.py
+Runs a scenario headlessly over a grid of parameters, one simulation
+per core, and streams a line of summary metrics per run into a
+result file (JSON lines) as each run finishes.
+
+usage: python sweep.py <scenario file> <grid.yml> [-o results.jsonl]
+                       [-d seconds] [-j processes]
+
+The grid file maps parameter names to lists of values:
+    seed: [1, 2, 3]
+    engine: [event, auto]          # see simulation.ENGINES
+    precision: [float64, float32]  # see simulation.PRECISIONS, float32 needs engine stepped or auto
+    n: [50, 100]                   # every particle group
+    radius: [3.0, 5.0]             # every particle group (width/height follow)
+    mass: [1.0]                    # every particle group
+    particles.2.n: [1, 5]          # any other value by its path in the scenario
+
+Re-running with the same result file skips grid points already run for
+the same scenario and duration, so an interrupted sweep resumes where
+it stopped.
+'''
+import argparse
+import copy
+import itertools
+import json
+import os
+import random
+import time
+
+from simulation import Simulation, Bounds, check_run
+import file_utils
+import scenario_cache
+import pool
+
+WORLD_WIDTH = 1024
+WORLD_HEIGHT = 768
+GROUP_PARAMS = ['n', 'radius', 'mass']
+RUN_PARAMS = ['seed', 'engine', 'precision']  # pick how a run is made rather than change the scenario
+
+
+def grid_points(grid):
+    """Yields one dict of parameter values per point of the grid"""
+    names = sorted(grid)
+    for values in itertools.product(*(grid[name] for name in names)):
+        yield dict(zip(names, values))
+
+
+def point_key(scenario_file, duration, params):
+    """Identifies a run: a grid point of a scenario run for duration seconds"""
+    return json.dumps([scenario_file, duration, params], sort_keys=True)
+
+
+def apply_params(config_data, params):
+    """Returns a copy of config_data with every scenario parameter applied"""
+    config_data = copy.deepcopy(config_data)
+    for name, value in params.items():
+        if name in RUN_PARAMS:
+            continue
+        elif name in GROUP_PARAMS:
+            for group in config_data['particles'].values():
+                group[name] = value
+                if name == 'radius':
+                    group['width'] = value * 2
+                    group['height'] = value * 2
+        else:
+            *path, leaf = name.split('.')
+            node = config_data
+            for key in path:
+                node = node[key]
+            if leaf not in node:
+                raise KeyError("sweep: scenario has no value at '{0}'".format(name))
+            node[leaf] = value
+    return config_data
+
+
+def completed_points(result_file):
+    """Returns the keys of every run already recorded in result_file"""
+    done = set()
+    if not os.path.exists(result_file):
+        return done
+    with open(result_file) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                done.add(point_key(record['scenario'], record['duration'], record['params']))
+            except (ValueError, KeyError):
+                pass  # partial line left by an interrupted sweep
+    return done
+
+
+def run_point(args):
+    """Runs one simulation. Executed in a pool process."""
+    config_data, params, duration = args
+    random.seed(params.get('seed'))
+    sim = Simulation(apply_params(config_data, params), Bounds(WORLD_WIDTH, WORLD_HEIGHT),
+                     engine=params.get('engine', 'event'),
+                     precision=params.get('precision', 'float64'))
+    sim.run(duration)
+    return params, sim.summary()
+
+
+def sweep(scenario_file, grid, result_file, duration, processes=None):
+    """Runs every grid point not yet in result_file. Returns the number of runs made."""
+    config_data = scenario_cache.load(scenario_file)
+    for params in grid_points(grid):
+        apply_params(config_data, params)  # fail fast on bad parameter paths
+        check_run(params.get('engine', 'event'), params.get('precision', 'float64'))
+
+    done = completed_points(result_file)
+    todo = [(config_data, params, duration) for params in grid_points(grid)
+            if point_key(scenario_file, duration, params) not in done]
+    if not todo:
+        return 0
+
+    runs = 0
+    with pool.get_context().Pool(processes=processes or os.cpu_count()) as workers, \
+            open(result_file, 'a') as out:
+        for params, metrics in workers.imap_unordered(run_point, todo):
+            record = {'scenario': scenario_file, 'duration': duration, 'params': params,
+                      'metrics': metrics}
+            out.write(json.dumps(record, sort_keys=True) + '\n')
+            out.flush()
+            runs += 1
+            print("{0}/{1} {2}".format(runs, len(todo), json.dumps(params, sort_keys=True)))
+    return runs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a scenario over a grid of parameters.')
+    parser.add_argument('scenario', help='scenario yml file')
+    parser.add_argument('grid', help='yml file mapping parameter names to lists of values')
+    parser.add_argument('-o', '--output', default='sweep_results.jsonl', help='result file')
+    parser.add_argument('-d', '--duration', type=float, default=10.0,
+                        help='simulated seconds per run')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='parallel runs (defaults to one per core)')
+    args = parser.parse_args()
+
+    start = time.time()
+    runs = sweep(args.scenario, file_utils.load_config(args.grid), args.output,
+                 args.duration, args.processes)
+    print("{0} runs in {1:.1f}s -> {2}".format(runs, time.time() - start, args.output))
@@ -1,11 +1,42 @@
 import unittest
 import math
+import os
+import json
+import multiprocessing
+import pickle
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import types
 from queue import Queue
+from unittest import mock
+from multiprocessing import shared_memory
 from graphics import *
 from collision import *
 from particles import *
 from walls import *
+from simulation import Simulation, Bounds, MENU_HEIGHT
+from worker import WorkTracker, WorkDone, WorkLost, WorkRequest, MAX_REPLAYS
+from observables import Observables
+from pool import WorkerPool, AUTOSCALE_INTERVAL
+from neighbors import NeighborList
+import domains
+import eventstore
 import math_utils
+import menu
+import placement
+import ring
+import scenario_cache
+import sweep
+import toi
+import watchdog
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # the time stepped engine is optional
 
 
 class TestIntegration(unittest.TestCase):
@@ -129,6 +160,19 @@ class TestParticle(unittest.TestCase):
         self.assertTrue(self.a.timeToHit(self.d) == math.inf)
         self.assertTrue(self.a.timeToHit(self.e) == math.inf)
 
+    def test_directionCache(self):
+        self.assertTrue(self.h.direction() == math_utils.degrees_clockwise(20.0, 10.0))
+        self.assertTrue(self.h.extents() == (5.0, 5.0))
+        offsets = self.h.pathOffsets()
+        self.assertTrue(self.h.pathOffsets() is offsets)  # reused until the velocity changes
+
+        self.h.bounceOffHWall()
+        self.assertTrue(self.h.direction() == math_utils.degrees_clockwise(-20.0, 10.0))
+        self.assertTrue(self.h.pathOffsets() is not offsets)
+
+        self.h.moveByForce(self.i, -20.0, 0.0)
+        self.assertTrue(self.h.direction() == math_utils.degrees_clockwise(-20.0, -10.0))
+
     def test_timeToHitVWall(self):
         wall1 = VWall(0)
         wall2 = VWall(self.window.width)
@@ -259,6 +303,127 @@ class TestParticle(unittest.TestCase):
         self.assertTrue(round(m4.x, 10) == 3.2 and round(m4.y, 10) == 2.6)
 
 
+class TestRectParticle(unittest.TestCase):
+    def setUp(self):
+        self.window = GraphWin('Test', 400, 400)
+        # long rectangle: 100 wide, 10 high, centred on (200, 200)
+        self.long = RectParticle(0, self.window, width=100.0, height=10.0, x=200.0, y=200.0,
+                                 vx=0.0, vy=0.0)
+
+    def test_timeToHitRect(self):
+        # square below the right end of the long rectangle moving straight up
+        sq = RectParticle(1, self.window, width=10.0, height=10.0, x=240.0, y=250.0,
+                          vx=0.0, vy=-10.0)
+        self.assertTrue(self.long.timeToHit(sq) == (250.0 - 5.0 - 205.0) / 10.0)
+        self.assertTrue(sq.timeToHit(self.long) == self.long.timeToHit(sq))
+
+        # same square moving sideways into the end of the rectangle
+        side = RectParticle(2, self.window, width=10.0, height=10.0, x=300.0, y=203.0,
+                            vx=-20.0, vy=0.0)
+        self.assertTrue(side.timeToHit(self.long) == (300.0 - 5.0 - 250.0) / 20.0)
+
+        # passes beyond the end
+        miss = RectParticle(3, self.window, width=10.0, height=10.0, x=260.0, y=250.0,
+                            vx=0.0, vy=-10.0)
+        self.assertTrue(miss.timeToHit(self.long) == math.inf)
+
+    def test_timeToHitCircle(self):
+        # straight edge
+        c = Particle(1, self.window, x=230.0, y=250.0, vx=0.0, vy=-10.0, radius=5.0)
+        self.assertTrue(c.timeToHit(self.long) == (250.0 - 5.0 - 205.0) / 10.0)
+        self.assertTrue(self.long.timeToHit(c) == c.timeToHit(self.long))
+
+        # rounded corner: circle centre passes 3 units right of the corner
+        c = Particle(2, self.window, x=253.0, y=250.0, vx=0.0, vy=-10.0, radius=5.0)
+        t = (250.0 - (205.0 + 4.0)) / 10.0  # touches when 4 units below the corner
+        self.assertTrue(round(c.timeToHit(self.long), 10) == round(t, 10))
+
+        # misses the corner
+        c = Particle(3, self.window, x=256.0, y=250.0, vx=0.0, vy=-10.0, radius=5.0)
+        self.assertTrue(c.timeToHit(self.long) == math.inf)
+
+    def test_timeToHitLineSegment(self):
+        line = LineSegment(Point(260.0, 100.0), Point(260.0, 300.0))
+        self.long.vx = 10.0
+        self.assertTrue(self.long.timeToHitLineSegment(line) == (260.0 - 250.0) / 10.0)
+
+        # diagonal segment: first touched by the bottom right corner
+        line = LineSegment(Point(250.0, 225.0), Point(275.0, 200.0))
+        self.assertTrue(round(self.long.timeToHitLineSegment(line), 10) == 2.0)
+
+        self.long.vx = -10.0
+        self.assertTrue(self.long.timeToHitLineSegment(line) == math.inf)
+
+    def test_bounceOffRect(self):
+        sq = RectParticle(1, self.window, width=10.0, height=10.0, x=240.0, y=210.0,
+                          vx=3.0, vy=-10.0, mass=2.0)
+        energy = 0.5 * sq.mass * (sq.vx**2 + sq.vy**2)
+        self.long.bounceOff(sq)
+        # contact along the y axis: only vertical velocities change
+        self.assertTrue(sq.vx == 3.0 and self.long.vx == 0.0)
+        self.assertTrue(self.long.mass * self.long.vy + sq.mass * sq.vy == -20.0)
+        newEnergy = (0.5 * self.long.mass * (self.long.vx**2 + self.long.vy**2) +
+                     0.5 * sq.mass * (sq.vx**2 + sq.vy**2))
+        self.assertTrue(abs(newEnergy - energy) < 1e-9)
+
+    def test_slab(self):
+        self.assertTrue(toi.slab(0.0, 2.0, 4.0, 6.0) == (2.0, 3.0))
+        self.assertTrue(toi.slab(0.0, -2.0, 4.0, 6.0) == (-3.0, -2.0))
+        self.assertTrue(toi.slab(5.0, 0.0, 4.0, 6.0) == (-math.inf, math.inf))
+        self.assertTrue(toi.slab(0.0, 0.0, 4.0, 6.0) == (math.inf, -math.inf))
+
+
+class TestObstacles(unittest.TestCase):
+    def setUp(self):
+        self.window = GraphWin('Test', 400, 400)
+        self.disk = DiskObstacle(200.0, 200.0, 20.0)
+        self.box = BoxObstacle(200.0, 200.0, 40.0, 20.0)
+
+    def test_timeToHitDisk(self):
+        p = Particle(0, self.window, radius=5.0, x=100.0, y=200.0, vx=10.0, vy=0.0)
+        self.assertTrue(p.timeToHitWall(self.disk) == (200.0 - 25.0 - 100.0) / 10.0)
+        p.vx = -10.0
+        self.assertTrue(p.timeToHitWall(self.disk) == float('inf'))
+
+        sq = RectParticle(1, self.window, width=10.0, height=10.0, x=200.0, y=100.0,
+                          vx=0.0, vy=5.0)
+        self.assertTrue(sq.timeToHitWall(self.disk) == (200.0 - 20.0 - 5.0 - 100.0) / 5.0)
+
+    def test_timeToHitBox(self):
+        p = Particle(0, self.window, radius=5.0, x=200.0, y=300.0, vx=0.0, vy=-10.0)
+        self.assertTrue(p.timeToHitWall(self.box) == (300.0 - 5.0 - 210.0) / 10.0)
+
+        sq = RectParticle(1, self.window, width=10.0, height=10.0, x=300.0, y=200.0,
+                          vx=-20.0, vy=0.0)
+        self.assertTrue(sq.timeToHitWall(self.box) == (300.0 - 5.0 - 220.0) / 20.0)
+
+    def test_bounceOffObstacle(self):
+        # glancing blow off the top of the disk reflects about the contact normal
+        p = Particle(0, self.window, radius=5.0, x=200.0, y=175.0, vx=3.0, vy=4.0)
+        p.bounceOffObstacle(self.disk)
+        self.assertTrue((p.vx, p.vy) == (3.0, -4.0))
+        self.assertTrue(p.collisionCnt == 1)
+
+        # moving away already: velocity left alone
+        p.bounceOffObstacle(self.disk)
+        self.assertTrue((p.vx, p.vy) == (3.0, -4.0))
+
+        sq = RectParticle(1, self.window, width=10.0, height=10.0, x=225.0, y=200.0,
+                          vx=-2.0, vy=1.0)
+        sq.bounceOffObstacle(self.box)
+        self.assertTrue((sq.vx, sq.vy) == (2.0, 1.0))
+
+    def test_placementAvoidsObstacles(self):
+        random.seed(3)
+        walls = [VWall(0.0), VWall(400.0), HWall(0.0), HWall(400.0), self.disk, self.box]
+        particles = []
+        pf = ParticleFactory(self.window, particles, None)
+        pf.createGroups([(60, {'radius': 4.0, 'color': 'red', 'shape': 'Circle'})], walls)
+        for p in particles:
+            self.assertTrue(math_utils.pythag(p.x - 200.0, p.y - 200.0) >= 24.0)
+            self.assertTrue(abs(p.x - 200.0) >= 24.0 or abs(p.y - 200.0) >= 14.0)
+
+
 class TestLineSegment(unittest.TestCase):
     def test_line_intersection(self):
         p0 = Point(0.0, 0.0)
@@ -330,6 +495,186 @@ class TestCollisionSys(unittest.TestCase):
         CollisionSystem.predict(self.a, 0, 10000, self.particles, self.walls, self.result_q)
         self.assertTrue(self.result_q.qsize() == (sz + 2))  # 2 collisions (1 wall, 1 particle)
 
+    def test_pairOrder(self):
+        # the same collision predicted from either particle is the same event
+        pair = self.particles[:2]
+        CollisionSystem.predict(self.a, 0, 10000, pair, [], self.result_q)
+        CollisionSystem.predict(self.b, 0, 10000, pair, [], self.result_q)
+        first = self.result_q.get()
+        second = self.result_q.get()
+        self.assertTrue((first.a, first.b) == (0, 1) and first == second)
+
+        # re-predicted together the pair is only checked once
+        batch = frozenset([0, 1])
+        CollisionSystem.predict(self.a, 0, 10000, pair, [], self.result_q, batch=batch)
+        CollisionSystem.predict(self.b, 0, 10000, pair, [], self.result_q, batch=batch)
+        self.assertTrue(self.result_q.qsize() == 1)
+
+    def test_staleWork(self):
+        for shared in [False, True]:
+            tracker = WorkTracker(self.particles, shared=shared)
+            work = tracker.request(0, 0, 10000, self.walls)
+            self.a.collisionCnt += 1  # bounced again before the request was computed
+            tracker.request(0, 0, 10000, self.walls)
+            self.assertTrue(work.isStale())
+            CollisionSystem.processWorkRequest(work, self.result_q)
+            self.assertTrue(self.result_q.get().dropped)
+            self.assertTrue(self.result_q.empty())
+
+    def test_deadlineOrder(self):
+        tracker = WorkTracker(self.particles, self.walls, depth=1)
+        for particle in [self.c, self.a, self.d]:  # still, 17s and 10s from a wall
+            tracker.submit(particle.index, 0, 10000, self.walls)
+        order = []
+        for i in range(0, 3):
+            tracker.dispatch(self.result_q)
+            tracker.dispatch(self.result_q)  # no more than depth in flight
+            self.assertTrue(self.result_q.qsize() == 1)
+            work = self.result_q.get()
+            order.append(work.particle_index)
+            CollisionSystem.processWorkRequest(work, Queue())
+            tracker.done(WorkDone(work.particle_index))
+        self.assertTrue(order == [3, 0, 2])
+
+        # only a bounce starts a new interval, refreshes and replays leave it alone
+        tracker.submit(2, 1.0, 10000, self.walls, bounced=True)
+        tracker.submit(2, 1.5, 10000, self.walls)
+        self.assertTrue(tracker.deadline(2, 2.0) == 3.0 and tracker.deadline(2, 2.0) == 3.0)
+
+        # collisions handled a tick after they were due are counted as late
+        tracker.handled(Event(0.5, 0, 1, 0, 0), 0.5 + tracker.time_per_tick)
+        tracker.handled(Event(0.5, 0, 1, 0, 0), 0.6 + tracker.time_per_tick)
+        self.assertTrue(tracker.late_events == 1 and abs(tracker.max_lateness - 0.1) < 1e-9)
+
+    def test_latePolicy(self):
+        with self.assertRaises(ValueError):
+            WorkTracker(self.particles, self.walls, policy='never')
+
+        # 'inline' keeps back requests due within a tick, the rest carry a snapshot
+        tracker = WorkTracker(self.particles, self.walls, shared=True, policy='inline')
+        tracker.submit(0, 0.0, 10000, self.walls, bounced=True)
+        tracker.submit(0, 0.01, 10000, self.walls)  # due again 0.01s after the bounce
+        urgent = tracker.dispatch(self.result_q, 0.01)
+        self.assertTrue(len(urgent) == 1 and tracker.fallbacks == 1)
+        work = self.result_q.get()
+        self.assertTrue(work.particles is None and work.time == 0.01)
+        expected = Queue()
+        CollisionSystem.predict(self.a, 0.01, 10000, self.particles, self.walls, expected)
+        self.a.x += 5.0  # moves on after the dispatch
+        CollisionSystem.processWorkRequest(work, self.result_q)
+        while not expected.empty():
+            self.assertTrue(self.result_q.get().time == expected.get().time)
+        self.assertTrue(isinstance(self.result_q.get(), WorkDone))
+
+        # 'block' waits for every outstanding request
+        pq = eventstore.EventStore()
+        result_q = Queue()
+        tracker = WorkTracker(self.particles, self.walls, policy='block')
+        tracker.submit(1, 0.0, 10000, self.walls)
+        tracker.dispatch(self.result_q)
+        self.assertTrue(not CollisionSystem.awaitOutstandingWork(self.result_q, result_q, pq,
+                                                                 0.0, tracker, 0.01))
+        CollisionSystem.processWorkRequest(self.result_q.get(), result_q)
+        self.assertTrue(CollisionSystem.awaitOutstandingWork(self.result_q, result_q, pq,
+                                                             0.0, tracker, 0.01))
+        self.assertTrue(tracker.in_flight == 0 and len(pq) > 0 and tracker.block_timeouts == 1)
+
+        # results for times before the previous tick arrived late
+        tracker.arrived(Event(0.5, 0, 1, 0, 0), 0.5 + tracker.time_per_tick)
+        tracker.arrived(Event(0.5, 0, 1, 0, 0), 0.7 + tracker.time_per_tick)
+        self.assertTrue(tracker.late_results == 1 and abs(tracker.max_result_lateness - 0.2) < 1e-9)
+
+    def test_lostWork(self):
+        tracker = WorkTracker(self.particles, self.walls)
+        tracker.submit(0, 0.0, 10000, self.walls)
+        while tracker.pending:  # its worker dies every time
+            tracker.dispatch(self.result_q)
+            work = self.result_q.get()
+            tracker.lostWork(WorkLost(work.particle_index, work.count), 0.0)
+        self.assertTrue(tracker.lost == MAX_REPLAYS + 1 and tracker.replayed == MAX_REPLAYS)
+        self.assertTrue(tracker.in_flight == 0)
+
+        # not submitted again once the particle has bounced since
+        tracker = WorkTracker(self.particles, self.walls)
+        tracker.lostWork(WorkLost(1, self.b.collisionCnt - 1), 0.0)
+        self.assertTrue(tracker.replayed == 0 and not tracker.pending)
+
+    def test_rings(self):
+        frames = ring.FrameRing(72)
+        for i in range(0, 5):  # wraps around the end
+            self.assertTrue(frames.write(pickle.dumps(list(range(i, i + 5)))))
+            self.assertTrue(not frames.write(bytes(48)))  # no room until it is read
+            self.assertTrue(frames.take() == list(range(i, i + 5)) and frames.take() is None)
+        records = ring.RecordRing(2)
+        self.assertTrue(records.write(1.0, 0, 1, 0, 0, ring.PAIR))
+        self.assertTrue(records.write(2.0, 0, 1, 0, 0, ring.PAIR))
+        self.assertTrue(not records.write(3.0, 0, 1, 0, 0, ring.PAIR))
+        self.assertTrue([r[0] for r in records.read()] == [1.0, 2.0] and records.used() == 0)
+
+        # a request and its results through the rings, with the world frame
+        # too large for the small request ring and spilled
+        transport = ring.RingTransport(multiprocessing.get_context(), request_bytes=1024)
+        end = transport.add(0)
+        tracker = WorkTracker(self.particles, self.walls, shared=True)
+        tracker.submit(0, 0.0, 10000, self.walls)
+        tracker.dispatch(transport.work_requested_q, 0.0)
+        CollisionSystem.processWorkRequest(end.get(), end)
+        expected = Queue()
+        CollisionSystem.predict(self.a, 0.0, 10000, self.particles, self.walls, expected)
+        received = transport.work_completed_q
+        while not expected.empty():
+            evt = expected.get()
+            self.assertTrue(received.get(timeout=1.0) == evt)  # walls are the same objects
+        self.assertTrue(isinstance(received.get_nowait(), WorkDone) and received.empty())
+
+    def test_domains(self):
+        def computed(ends, sender, received):
+            for n, end in enumerate(ends):
+                for i in range(0, len(sender.outstanding.get(n, []))):
+                    CollisionSystem.processWorkRequest(end.get(), end)
+            events = []
+            while not received.empty():
+                evt = received.get_nowait()
+                if not isinstance(evt, WorkDone):
+                    events.append((evt.time, evt.a, evt.b if isinstance(evt.b, int) else id(evt.b)))
+            return sorted(events)
+
+        def expected(t, batch):
+            result_q = Queue()
+            for a in batch:
+                CollisionSystem.predict(self.particles[a], t, 10000, self.particles, self.walls,
+                                        result_q, batch=batch)
+            return computed([], None, result_q)
+
+        # two workers own the left and right of the particles and
+        # hold the neighbors of their own besides
+        transport = domains.DomainTransport(multiprocessing.get_context(), request_bytes=2**16)
+        ends = [transport.add(0), transport.add(1)]
+        sender = transport.work_requested_q
+        NeighborList(self.particles, 1.0/60, 50.0).refreshAll(0.0)
+        tracker = WorkTracker(self.particles, self.walls, shared=True, resident=True)
+        everyone = frozenset(range(0, len(self.particles)))
+        for a in everyone:
+            tracker.submit(a, 0.0, 10000, self.walls, batch=everyone)
+        tracker.dispatch(sender, 0.0)
+        self.assertTrue(sender.owner == [0, 0, 0, 1, 1] and sender.held[1] == {3, 4})
+        self.assertTrue(all([set(p.neighbors) <= sender.held[sender.owner[p.index]]
+                             for p in self.particles]))
+        self.assertTrue(computed(ends, sender, transport.work_completed_q) ==
+                        expected(0.0, everyone))
+
+        # later only the particle that bounced is sent, the workers move the rest
+        for p in self.particles:
+            p.move(0.1)
+        self.a.vx = -self.a.vx
+        self.a.collisionCnt += 1
+        sent = sender.particles_sent
+        tracker.submit(0, 0.1, 10000, self.walls, batch=frozenset([0]))
+        tracker.dispatch(sender, 0.1)
+        self.assertTrue(sender.particles_sent == sent + 1)
+        self.assertTrue(computed(ends, sender, transport.work_completed_q) ==
+                        expected(0.1, frozenset([0])))
+
 
 class TestMathUtils(unittest.TestCase):
     def test_degrees_clockwise(self):
@@ -348,5 +693,600 @@ class TestMathUtils(unittest.TestCase):
                         math_utils.degrees_clockwise(-10, -10))
 
 
+class TestPlacement(unittest.TestCase):
+    def setUp(self):
+        self.walls = [VWall(0.0), VWall(400.0), HWall(0.0), HWall(300.0),
+                      LineSegment(Point(0.0, 0.0), Point(400.0, 300.0))]
+        self.box = placement.box_from_walls(self.walls, 400, 300)
+
+    def assertNoOverlaps(self, extents, positions):
+        for i in range(len(extents)):
+            xi, yi = positions[i]
+            self.assertTrue(self.box[0] + extents[i] <= xi <= self.box[2] - extents[i])
+            self.assertTrue(self.box[1] + extents[i] <= yi <= self.box[3] - extents[i])
+            self.assertTrue(placement.segment_distance(xi, yi, self.walls[4]) >= extents[i])
+            for j in range(i + 1, len(extents)):
+                xj, yj = positions[j]
+                self.assertTrue(math.hypot(xi - xj, yi - yj) >= extents[i] + extents[j])
+
+    def test_lattice(self):
+        extents = [3.0] * 100 + [10.0] * 20 + [5.0] * 50
+        self.assertNoOverlaps(extents, placement.place(extents, self.box, self.walls, 'lattice'))
+
+    def test_poisson(self):
+        extents = [3.0] * 100 + [10.0] * 20 + [5.0] * 50
+        self.assertNoOverlaps(extents, placement.place(extents, self.box, self.walls, 'poisson'))
+
+    def test_impossible(self):
+        with self.assertRaises(placement.PlacementError):
+            placement.place([10.0] * 400, self.box, self.walls)  # more area than the box
+        with self.assertRaises(placement.PlacementError):
+            placement.place([200.0], self.box, self.walls)  # wider than the box
+
+    def test_factory(self):
+        particles = []
+        pf = ParticleFactory(Bounds(400, 300), particles, None)
+        pf.createGroups([(30, {'radius': 5.0}), (5, {'shape': 'Square', 'width': 20.0,
+                                                      'height': 10.0})], self.walls)
+        self.assertTrue(len(particles) == 35)
+        extents = [placement.extent(p.shape_type, p.radius, p.width, p.height) for p in particles]
+        self.assertNoOverlaps(extents, [(p.x, p.y) for p in particles])
+
+
+@unittest.skipIf(numpy is None, "the stepped engine needs NumPy")
+class TestSteppedEngine(unittest.TestCase):
+    def setUp(self):
+        random.seed(4)
+        self.config_data = {
+            'particles': {
+                '1': {'n': 300, 'color': 'red', 'radius': 5.0, 'mass': 1.0, 'shape': 'Circle'},
+                '2': {'n': 1, 'color': 'black', 'radius': 60.0, 'mass': 20.0, 'shape': 'Circle'},
+            },
+            'walls': {'1': {'p0x': 100.0, 'p0y': 100.0, 'p1x': 300.0, 'p1y': 250.0}},
+            'obstacles': {'1': {'x': 300.0, 'y': 150.0, 'radius': 20.0, 'shape': 'Circle'}},
+        }
+
+    def test_headOn(self):
+        config_data = {
+            'particles': {'1': {'radius': 5.0, 'mass': 1.0, 'color': 'red', 'shape': 'Circle'}},
+            'states': [0, 100.0, 100.0, 50.0, 0.0, 0, 200.0, 100.0, -50.0, 0.0],
+        }
+        sim = Simulation(config_data, Bounds(400, 300), engine='stepped')
+        a, b = sim.particles
+        sim.run(3.0)
+        self.assertTrue((a.vx, b.vx) == (-50.0, 50.0))  # equal masses swap velocities
+        self.assertTrue(a.collisionCnt == 1 and b.collisionCnt == 1)
+        self.assertTrue(a.x < 100.0 and b.x > 200.0)
+
+    def test_rects(self):
+        # squares 10 across passing 11 apart miss, their enclosing circles
+        # would not; 9.5 apart they meet flat and swap velocities
+        for gap, swapped in [(11.0, False), (9.5, True)]:
+            config_data = {
+                'particles': {'1': {'width': 10.0, 'height': 10.0, 'mass': 1.0, 'color': 'red',
+                                    'shape': 'Square'}},
+                'states': [0, 100.0, 100.0, 50.0, 0.0, 0, 200.0, 100.0 + gap, -50.0, 0.0],
+            }
+            sim = Simulation(config_data, Bounds(400, 300), engine='stepped')
+            a, b = sim.particles
+            sim.run(1.5)
+            self.assertTrue(((a.vx, b.vx) == (-50.0, 50.0)) == swapped)
+            self.assertTrue(a.vy == 0.0 and b.vy == 0.0)
+
+        # squares among discs, against the segment and the obstacle
+        config_data = dict(self.config_data, particles=dict(self.config_data['particles']))
+        config_data['particles']['3'] = {'n': 60, 'color': 'blue', 'width': 12.0, 'height': 6.0,
+                                         'mass': 2.0, 'shape': 'Rect'}
+        sim = Simulation(config_data, Bounds(400, 300), engine='stepped')
+        self.assertTrue(len(sim.stepper.rects) == 60)
+        energy = sim.kineticEnergy()
+        sim.run(2.0)
+        self.assertTrue(abs(sim.kineticEnergy() - energy) < energy * 1e-9)
+        for p in sim.particles:
+            self.assertTrue(0.0 < p.x < 399.0 and 0.0 < p.y < 299.0 - MENU_HEIGHT)
+
+    def test_toiArrays(self):
+        import toi_arrays
+        random.seed(5)
+        rows = [[random.choice([0.0, random.uniform(-50.0, 50.0)]) for k in range(0, 4)] +
+                [random.uniform(1.0, 10.0) for k in range(0, 3)] for i in range(0, 2000)]
+        dx, dy, dvx, dvy, hw, hh, r = [numpy.array(column) for column in zip(*rows)]
+        line = LineSegment(Point(-10.0, 3.0), Point(20.0, -7.0))
+        times = [(toi.rect_rect, toi_arrays.rect_rect(dx, dy, dvx, dvy, hw, hh), 6),
+                 (toi.rect_circle, toi_arrays.rect_circle(dx, dy, dvx, dvy, hw, hh, r), 7)]
+        for scalar, array, args in times:
+            self.assertTrue([scalar(*row[:args]) for row in rows] == array.tolist())
+        array = toi_arrays.rect_segment(dx, dy, dvx, dvy, hw, hh, line)
+        self.assertTrue([toi.rect_segment(*row[:6], line) for row in rows] == array.tolist())
+        nx, ny = toi_arrays.rect_circle_normal(dx, dy, hw, hh)
+        for row, n in zip(rows, zip(nx.tolist(), ny.tolist())):
+            expected = toi.rect_circle_normal(row[0], row[1], row[4], row[5])
+            self.assertTrue(max([abs(u - v) for u, v in zip(expected, n)]) < 1e-12)
+
+    def test_denseRun(self):
+        sim = Simulation(self.config_data, Bounds(400, 300), engine='stepped')
+        self.assertTrue(sim.stepper is not None and len(sim.stepper.big) == 1)
+        energy = sim.kineticEnergy()
+        sim.run(3.0)
+        self.assertTrue(sim.events_processed > 0)
+        self.assertTrue(abs(sim.kineticEnergy() - energy) < energy * 1e-9)
+        self.assertTrue(abs(sim.observables.energy - energy) < energy * 1e-9)
+        self.assertTrue(sim.observables.pressure() > 0.0)
+        for p in sim.particles:
+            self.assertTrue(0.0 < p.x < 399.0 and 0.0 < p.y < 299.0 - MENU_HEIGHT)
+            self.assertTrue(math.hypot(p.x - 300.0, p.y - 150.0) > 20.0)
+
+    def test_autoEngine(self):
+        sparse = {'particles': {'1': {'n': 10, 'radius': 5.0, 'mass': 1.0, 'color': 'red',
+                                      'shape': 'Circle'}}}
+        sim = Simulation(sparse, Bounds(400, 300), engine='auto')
+        self.assertTrue(sim.engine == 'event' and 'event engine' in sim.selector.reason)
+        sim = Simulation(self.config_data, Bounds(400, 300), engine='auto')
+        self.assertTrue(sim.engine == 'stepped')
+        self.assertTrue(0.2 < sim.selector.estimate.fraction < 0.4)
+
+        # switching mid run carries the state over
+        energy = sim.kineticEnergy()
+        sim.run(0.5)
+        sim.useEngine('event')
+        sim.run(0.5)
+        sim.useEngine('stepped')
+        sim.run(0.5)
+        self.assertTrue(abs(sim.kineticEnergy() - energy) < energy * 1e-9)
+        self.assertTrue(sim.summary()['engine'] == 'stepped')
+        # the event engine takes over the stepped engine's overlaps without
+        # deepening them, and hits right after a bounce are not left for a tick
+        self.assertTrue(sim.watchdog.checks > 0 and sim.watchdog.violations == [])
+
+    def test_unknownEngine(self):
+        with self.assertRaises(ValueError):
+            Simulation(self.config_data, Bounds(400, 300), engine='warp')
+
+    def test_float32(self):
+        runs = []
+        for precision in ['float64', 'float32']:
+            random.seed(4)
+            sim = Simulation(self.config_data, Bounds(400, 300), engine='stepped',
+                             precision=precision, record_interval=0.05)
+            sim.run(2.0)
+            runs.append(sim)
+        wide, narrow = runs
+        self.assertTrue(narrow.recorder.positions().dtype == numpy.float32)
+        self.assertTrue(len(narrow.recorder.times) == 41)
+        self.assertTrue(narrow.summary()['trajectory_bytes'] * 2 == wide.summary()['trajectory_bytes'])
+        self.assertTrue(narrow.stepper.stateBytes() < 0.6 * wide.stepper.stateBytes())
+        # the rounding stays invisible over the first collisions, then chaos
+        # amplifies it until the trajectories are unrelated
+        divergence = numpy.abs(wide.recorder.positions() - narrow.recorder.positions())
+        self.assertTrue(divergence[:4].max() < 0.01)
+        # what is measured still agrees over the whole run
+        energy = wide.summary()['kinetic_energy']
+        self.assertTrue(abs(narrow.summary()['kinetic_energy'] - energy) < energy * 1e-6)
+        for key in ['events', 'pressure']:
+            self.assertTrue(abs(narrow.summary()[key] - wide.summary()[key]) <
+                            0.05 * wide.summary()[key])
+
+        with self.assertRaises(ValueError):
+            Simulation(self.config_data, Bounds(400, 300), precision='float16')
+        with self.assertRaises(ValueError):
+            Simulation(self.config_data, Bounds(400, 300), engine='event', precision='float32')
+        sim = Simulation(self.config_data, Bounds(400, 300), engine='auto', precision='float32')
+        self.assertTrue(sim.stepper.precision == 'float32')
+
+
+class TestScenarioCache(unittest.TestCase):
+    def test_roundTrip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            config_data = scenario_cache.load('scenarios/wallsaplenty.yml', tmp)
+        data = scenario_cache.decode(scenario_cache.compile_config(config_data))
+        self.assertTrue(data == config_data)
+        self.assertTrue(data['particles']['3']['n'] == 3)
+        self.assertTrue(data['walls']['11']['p1y'] == 1000.0)
+
+    def test_groupFields(self):
+        # every field a group can give its particles survives compilation
+        config_data = {'particles': {'1': {'n': 1, 'radius': 2.0, 'color': 'red',
+                                           'shape': 'Circle', 'vx': 10.0, 'vy': -5.0}},
+                       'walls': {}}
+        data = scenario_cache.decode(scenario_cache.compile_config(config_data))
+        self.assertTrue(data == config_data)
+        config_data['particles']['1']['speed'] = 3.0
+        with self.assertRaises(scenario_cache.ScenarioFormatError):
+            scenario_cache.compile_config(config_data)
+
+    def test_cacheKeyedByContents(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'scenario.yml')
+            cache_dir = os.path.join(tmp, 'cache')
+            with open(source, 'w') as f:
+                f.write("particles:\n  '1': {n: 5, radius: 2.0, color: red, shape: Circle}\n")
+            self.assertTrue(scenario_cache.load(source, cache_dir)['particles']['1']['n'] == 5)
+            self.assertTrue(len(os.listdir(cache_dir)) == 1)
+            self.assertTrue(scenario_cache.load(source, cache_dir)['particles']['1']['n'] == 5)
+            self.assertTrue(len(os.listdir(cache_dir)) == 1)  # hit, nothing new written
+
+            with open(source, 'w') as f:
+                f.write("particles:\n  '1': {n: 7, radius: 2.0, color: red, shape: Circle}\n")
+            self.assertTrue(scenario_cache.load(source, cache_dir)['particles']['1']['n'] == 7)
+            self.assertTrue(len(os.listdir(cache_dir)) == 2)
+
+    def test_obstacles(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            config_data = scenario_cache.load('scenarios/pinball.yml', tmp)
+        data = scenario_cache.decode(scenario_cache.compile_config(config_data))
+        self.assertTrue(data == config_data)
+        self.assertTrue(data['obstacles']['1']['radius'] == 25.0)
+
+        sim = Simulation(data, Bounds(1200, 800))
+        obstacles = [w for w in sim.walls if w.wall_type in ("Disk", "Box")]
+        self.assertTrue(len(obstacles) == len(data['obstacles']))
+
+        # starting a run from the menu keeps what its tables do not show
+        stub = types.SimpleNamespace(config_data=config_data,
+                                     particle_table=types.SimpleNamespace(data_dict=config_data['particles']),
+                                     wall_table=types.SimpleNamespace(data_dict=config_data['walls']))
+        menu.MainMenu.setConfigData(stub)
+        self.assertTrue(stub.config_data['obstacles'] == data['obstacles'])
+
+    def test_obstacleNeighbors(self):
+        config_data = scenario_cache.load('scenarios/pinball.yml')
+        positions = []
+        for skin in [0, 60.0]:
+            random.seed(2)
+            sim = Simulation(config_data, Bounds(1200, 800), neighbor_skin=skin)
+            sim.run(1.0)
+            positions.append([(p.x, p.y, p.vx, p.vy) for p in sim.particles])
+        for a, b in zip(positions[0], positions[1]):
+            self.assertTrue(max([abs(u - v) for u, v in zip(a, b)]) < 1e-6)
+
+        # each particle only checks the obstacles within its reach
+        obstacles = [i for i, w in enumerate(sim.walls) if w.wall_type == "Disk"]
+        for p in sim.particles:
+            near = [i for i in p.near_walls if i in obstacles]
+            self.assertTrue(len(near) < len(obstacles))
+            for i in obstacles:
+                w = sim.walls[i]
+                if math.hypot(p.x - w.x, p.y - w.y) < p.radius + w.radius:
+                    self.assertTrue(i in near)
+
+        # obstacles turn the lists on, so a prediction in Porous checks about
+        # as many walls as in a scenario without obstacles
+        config_data = scenario_cache.load('scenarios/porous.yml')
+        random.seed(1)
+        sim = Simulation(config_data, Bounds(1024, 768))
+        obstacles = [w for w in sim.walls if w.wall_type == "Disk"]
+        self.assertTrue(sim.neighbors is not None and len(obstacles) > 100)
+        checked = [len(p.near_walls) for p in sim.particles]
+        self.assertTrue(max(checked) < len(sim.walls) - len(obstacles) + 20)
+
+    def test_explicitStates(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'imported.pscn')
+            scenario_cache.write(path, {
+                'particles': {'a': {'radius': 2.0, 'mass': 1.0, 'color': 'red', 'shape': 'Circle'},
+                              'b': {'radius': 4.0, 'mass': 3.0, 'color': 'blue', 'shape': 'Circle'}},
+                'states': [['a', 10.0, 20.0, 1.0, -1.0], ['b', 50.0, 60.0, 0.0, 5.0]],
+            })
+            sim = Simulation(scenario_cache.load(path), Bounds(200, 200))
+            self.assertTrue(len(sim.particles) == 2)
+            b = sim.particles[1]
+            self.assertTrue((b.x, b.y, b.vx, b.vy, b.radius, b.mass) == (50.0, 60.0, 0.0, 5.0, 4.0, 3.0))
+
+
+class TestSimulation(unittest.TestCase):
+    def setUp(self):
+        random.seed(1)
+        self.config_data = {
+            'particles': {
+                '1': {'n': 20, 'color': 'random', 'radius': 5.0, 'mass': 1.0,
+                      'shape': 'Circle', 'width': 10.0, 'height': 10.0},
+                '2': {'n': 2, 'color': 'black', 'radius': 20.0, 'mass': 4.0,
+                      'shape': 'Circle', 'width': 40.0, 'height': 40.0},
+            },
+            'walls': {
+                '1': {'p0x': 100.0, 'p0y': 100.0, 'p1x': 200.0, 'p1y': 100.0},
+            },
+        }
+
+    def test_headlessRun(self):
+        sim = Simulation(self.config_data, Bounds(400, 300))
+        self.assertTrue(len(sim.particles) == 22)
+        self.assertTrue(len(sim.walls) == 5)  # 4 boundary walls + 1 line segment
+        energy = sim.kineticEnergy()
+        sim.run(2.0)
+        self.assertTrue(sim.ticks == 120)
+        self.assertTrue(sim.events_processed > 0)
+        self.assertTrue(abs(sim.kineticEnergy() - energy) < energy * 1e-9)
+
+    def test_noSharedMemory(self):
+        # where shared memory can't be created the requests carry a snapshot
+        # and the workers compute them without checking for staleness
+        with mock.patch.object(shared_memory, 'SharedMemory', side_effect=OSError):
+            self.assertTrue(not ring.available())
+            work_q, result_q = Queue(), Queue()
+            sim = Simulation(self.config_data, Bounds(400, 300), work_q, result_q)
+            self.assertTrue(sim.tracker.shared is None)
+            energy = sim.kineticEnergy()
+            for i in range(0, 60):
+                sim.tick()
+                while not work_q.empty():
+                    work = work_q.get()
+                    self.assertTrue(work.snapshot is not None and work.counts_name is None)
+                    CollisionSystem.processWorkRequest(work, result_q)
+        self.assertTrue(sim.events_processed > 0)
+        self.assertTrue(abs(sim.kineticEnergy() - energy) < energy * 1e-9)
+
+    def test_neighborLists(self):
+        positions = []
+        for skin in [0, 60.0]:
+            random.seed(2)
+            sim = Simulation(self.config_data, Bounds(400, 300), neighbor_skin=skin)
+            sim.run(2.0)
+            positions.append([(p.x, p.y, p.vx, p.vy, p.collisionCnt) for p in sim.particles])
+        # same collisions, far fewer checks. A pair that enters a list is predicted
+        # when the list is refreshed rather than at the last bounce, so the times
+        # can differ in the last bit and the positions only agree up to rounding
+        for a, b in zip(positions[0], positions[1]):
+            self.assertTrue(a[4] == b[4])
+            self.assertTrue(max([abs(u - v) for u, v in zip(a[:4], b[:4])]) < 1e-3)
+
+        sim = Simulation(self.config_data, Bounds(400, 300), neighbor_skin=60.0)
+        for p in sim.particles:
+            for q in sim.particles:
+                close = math.hypot(p.x - q.x, p.y - q.y) < p.radius + q.radius + sim.neighbors.skin
+                self.assertTrue((p != q and close) == (q.index in p.neighbors))
+            self.assertTrue(p.neighbors_expiry > 0.0)
+
+    def test_eventBudget(self):
+        runs = []
+        for budget in [None, 40 * eventstore.EVENT_BYTES]:
+            random.seed(2)
+            sim = Simulation(self.config_data, Bounds(400, 300), event_budget=budget)
+            sim.run(2.0)
+            runs.append(sim)
+        free, capped = runs
+        self.assertTrue(free.pq.events_evicted == 0 and capped.pq.evictions > 0)
+        self.assertTrue(capped.summary()['event_store_peak_bytes'] <
+                        free.summary()['event_store_peak_bytes'])
+        # evicted events are predicted again in time, so nothing is missed
+        self.assertTrue(capped.events_processed == free.events_processed)
+        for p, q in zip(free.particles, capped.particles):
+            self.assertTrue(abs(p.x - q.x) < 1e-6 and abs(p.y - q.y) < 1e-6)
+
+        # a stale event evicted after a valid one of the same particle
+        store = eventstore.EventStore(3 * eventstore.EVENT_BYTES)
+        for t, count in [(0.5, 1), (0.6, 1), (5.0, 1), (6.0, 0)]:
+            store.push(Event(t, 0, None, count, None))
+        self.assertTrue(store.evictions == 1 and store.events_evicted == 2)
+        self.assertTrue(store.due(store.horizon, [types.SimpleNamespace(collisionCnt=1)]) == [0])
+
+    def test_observables(self):
+        sim = Simulation(self.config_data, Bounds(400, 300))
+        sim.run(2.0)
+        obs = sim.observables
+        px = sum([p.mass * p.vx for p in sim.particles])
+        py = sum([p.mass * p.vy for p in sim.particles])
+        self.assertTrue(abs(obs.energy - sim.kineticEnergy()) < obs.energy * 1e-9)
+        self.assertTrue(abs(obs.px - px) < 1e-6 and abs(obs.py - py) < 1e-6)
+        self.assertTrue(obs.pressure() > 0.0)
+        self.assertTrue(sim.summary()['temperature'] == obs.energy / 22)
+
+        # a head-on bounce off a vertical wall gives the wall twice the momentum
+        p = Particle(0, Bounds(100, 100), x=5.0, y=50.0, vx=-10.0, vy=0.0, mass=2.0)
+        obs = Observables([p], [VWall(0.0)], 100, 100)
+        p.vx = 10.0
+        obs.bounced(p, -10.0, 0.0, VWall(0.0))
+        self.assertTrue(obs.wall_impulse == 40.0 and obs.px == 20.0)
+        self.assertTrue(obs.energy == 100.0)
+
+    def test_speedHistogram(self):
+        sim = Simulation(self.config_data, Bounds(400, 300))
+        speeds = sim.observables.speeds
+        sim.run(2.0)
+        scan = [0] * len(speeds.counts)
+        for p in sim.particles:
+            scan[speeds.bin(math.hypot(p.vx, p.vy))] += 1
+        self.assertTrue(speeds.counts == scan)
+        expected = speeds.expected(sim.observables.temperature())
+        self.assertTrue(abs(sum(expected) - 22) < 1e-9)
+
+    def test_mixing(self):
+        sim = Simulation(self.config_data, Bounds(400, 300))
+        self.assertTrue(sim.mixing.latest() == 0.0)  # every cell holds one side only
+        sim.run(4.0)
+        times = [t for t, s in sim.mixing.history]
+        self.assertTrue(len(times) == 17 and times[-1] == sim.sim_time)
+        self.assertTrue(0.0 < sim.mixing.latest() <= sim.mixing.limit)
+        if numpy is not None:
+            counts = sim.mixing.counts((numpy.array([p.x for p in sim.particles]),
+                                        numpy.array([p.y for p in sim.particles])))
+            scan = [[0, 0] for i in range(0, len(counts))]
+            for p, s in zip(sim.particles, sim.mixing.species):
+                scan[sim.mixing.cell(p.x, p.y)][s] += 1
+            self.assertTrue(counts == scan)
+
+    def test_bounceIntoWall(self):
+        # b hits a two thirds into a tick, which sends a into the wall before the
+        # tick ends and the new predictions are made
+        config_data = {
+            'particles': {'1': {'radius': 5.0, 'mass': 1.0, 'color': 'red', 'shape': 'Circle'}},
+            'states': [0, 7.0, 100.0, 0.0, 0.0, 0, 40.0, 100.0, -600.0, 0.0],
+        }
+        sim = Simulation(config_data, Bounds(400, 300))
+        a, b = sim.particles
+        sim.run(0.1)
+        self.assertTrue(a.collisionCnt == 3 and abs(a.x - 7.0) < 1e-9 and a.vx == 0.0)
+        self.assertTrue(b.vx == 600.0)
+
+    def test_bounceIntoParticle(self):
+        # b hits a halfway into the first tick, which sends a into c before the
+        # tick ends: handled within it, rather than found overlapping after it
+        config_data = {
+            'particles': {'1': {'radius': 5.0, 'mass': 1.0, 'color': 'red', 'shape': 'Circle'}},
+            'states': [0, 100.0, 100.0, 0.0, 0.0, 0, 85.0, 100.0, 600.0, 0.0,
+                       0, 111.0, 100.0, 0.0, 0.0],
+        }
+        sim = Simulation(config_data, Bounds(400, 300))
+        a, b, c = sim.particles
+        sim.tick()
+        self.assertTrue(c.collisionCnt == 1 and a.vx == 0.0 and c.vx == 600.0)
+        self.assertTrue(abs(a.x - 101.0) < 1e-9 and c.x - a.x > 10.0)
+
+    def test_watchdog(self):
+        sim = Simulation(self.config_data, Bounds(400, 300))
+        sim.run(2.0)
+        self.assertTrue(sim.watchdog.checks > 0 and sim.watchdog.violations == [])
+
+        sim.particles[3].x = -10.0  # escaped through the left wall
+        sim.observables.energy *= 1.01
+        sim.watchdog.sample = 22  # every particle
+        with self.assertWarns(watchdog.PhysicsWarning):
+            found = sim.watchdog.check()
+        checks = sorted([w.check for w in found])
+        self.assertTrue(checks == ['containment', 'energy'])
+        self.assertTrue(found[1].particles == (3,) and found[1].value == 10.0)
+
+    def test_sweepParams(self):
+        points = list(sweep.grid_points({'seed': [1, 2], 'radius': [3.0, 4.0]}))
+        self.assertTrue(len(points) == 4)
+
+        config_data = sweep.apply_params(self.config_data, {'radius': 3.0, 'particles.2.n': 5})
+        self.assertTrue(config_data['particles']['1']['width'] == 6.0)
+        self.assertTrue(config_data['particles']['2']['n'] == 5)
+        self.assertTrue(self.config_data['particles']['2']['n'] == 2)  # original untouched
+        with self.assertRaises(KeyError):
+            sweep.apply_params(self.config_data, {'particles.2.speed': 1.0})
+        with self.assertRaises(ValueError):  # before any run is started
+            sweep.sweep('scenarios/standard.yml', {'precision': ['float32']}, 'unused.jsonl', 1.0)
+
+    def test_sweepResume(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            result_file = os.path.join(tmp, 'results.jsonl')
+            with open(result_file, 'w') as f:
+                for scenario, duration in [('a.yml', 1.0), ('b.yml', 1.0), ('a.yml', 2.0)]:
+                    f.write(json.dumps({'scenario': scenario, 'duration': duration,
+                                        'params': {'seed': 1, 'n': 5}, 'metrics': {}}) + '\n')
+                f.write('{"scenario": "a.yml", "params": {"seed": 2')  # interrupted write
+            done = sweep.completed_points(result_file)
+            # the same point of another scenario or duration is another run
+            point = {'n': 5, 'seed': 1}
+            self.assertTrue(len(done) == 3 and sweep.point_key('a.yml', 1.0, point) in done)
+            self.assertTrue(sweep.point_key('a.yml', 3.0, point) not in done)
+
+
+class TestWorkerPool(unittest.TestCase):
+    def test_autoscale(self):
+        for transport in ['queue'] + (['ring'] if ring.available() else []):
+            pool = WorkerPool(num_workers=1, max_workers=2, transport=transport)
+            pool.start()
+            pool.backlog = lambda: 100  # requests queueing up
+            pool.last_scale -= AUTOSCALE_INTERVAL
+            pool.autoscale()
+            self.assertTrue(pool.size() == 2 and pool.scale_ups == 1)
+            pool.last_scale -= AUTOSCALE_INTERVAL
+            pool.autoscale()
+            self.assertTrue(pool.size() == 2)  # at max_workers
+
+            pool.backlog = lambda: 0  # and idle
+            pool.last_scale -= AUTOSCALE_INTERVAL
+            pool.autoscale()
+            self.assertTrue(pool.size() == 1 and pool.scale_downs == 1)
+            deadline = time.perf_counter() + 10.0
+            while len(pool.workers) > 1 and time.perf_counter() < deadline:
+                time.sleep(0.01)
+                pool.supervise()
+            self.assertTrue(len(pool.workers) == 1)
+            self.assertTrue(all([0.0 <= u <= 1.0 for u in pool.utilization().values()]))
+            pool.stop()
+
+    def test_pinning(self):
+        pool = WorkerPool(num_workers=1, transport='queue', pin=True, max_workers=4)
+        pool.pin = True  # whether or not the platform allows it
+        pool.cpus = [0, 2, 4, 6]
+        # the main process keeps the first CPU, the worker beyond the others shares
+        self.assertTrue([pool.cpu(n) for n in range(0, 4)] == [2, 4, 6, None])
+        pool.pin = False
+        self.assertTrue(pool.cpu(0) is None)
+
+    def test_stopExits(self):
+        # requests left unread must not keep the interpreter from exiting
+        code = ("from pool import WorkerPool; from worker import WorkRequest\n"
+                "if __name__ == '__main__':\n"
+                "    pool = WorkerPool(num_workers=1, transport='queue'); pool.start()\n"
+                "    for i in range(0, 200):\n"
+                "        pool.work_requested_q.put_nowait(WorkRequest(0, 0.0, 1, [None] * 1000, []))\n"
+                "    pool.stop()\n")
+        result = subprocess.run([sys.executable, '-c', code], timeout=60,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertTrue(result.returncode == 0)
+
+    def test_crashRecovery(self):
+        for transport in ['queue'] + (['ring'] if ring.available() else []):
+            pool = WorkerPool(num_workers=1, transport=transport)
+            pool.start()
+            pool.work_requested_q.put_nowait(WorkRequest(0, 0.0, 10000, [], [], count=5))  # no particle 0
+            deadline = time.perf_counter() + 10.0
+            while pool.supervise() == 0 and time.perf_counter() < deadline:
+                time.sleep(0.01)
+            self.assertTrue(pool.crashes == 1 and pool.requests_lost == 1)
+            lost = pool.work_completed_q.get(timeout=1.0)
+            self.assertTrue(isinstance(lost, WorkLost) and (lost.particle_index, lost.count) == (0, 5))
+            self.assertTrue(pool.size() == 1 and pool.workers[0].is_alive())
+            pool.stop()
+
+    def test_clearKeepsStops(self):
+        pool = WorkerPool(num_workers=2, transport='queue')
+        pool.shrink()  # before any worker could take it
+        pool.work_requested_q.put_nowait(WorkRequest(0, 0.0, 1, [None], []))
+        time.sleep(0.1)  # for the feeder thread
+        pool.clear()
+        self.assertTrue(pool.retiring == 1 and pool.queues.requests.get(timeout=1.0) is None)
+        self.assertTrue(pool.queues.requests.empty() and pool.work_requested_q.outstanding == {})
+        pool.stop()
+
+    def test_poolSummary(self):
+        pool = WorkerPool(num_workers=1, transport='queue')
+        pool.start()
+        random.seed(1)
+        sim = Simulation({'particles': {'1': {'n': 10, 'radius': 5.0, 'mass': 1.0,
+                                              'color': 'red', 'shape': 'Circle'}}},
+                         Bounds(400, 300), pool.work_requested_q, pool.work_completed_q,
+                         late_policy='block', pool=pool)
+        sim.run(0.5)
+        summary = sim.summary()
+        pool.stop()
+        self.assertTrue(summary['transport'] == 'queue' and summary['workers'] == 1)
+        self.assertTrue(0.0 < summary['worker_utilization'][0] <= 1.0)
+        self.assertTrue(summary['requests_lost'] == sim.tracker.lost)
+
+    def test_queueFirstTick(self):
+        # the predictions made in the main process are in on the first tick
+        pool = WorkerPool(num_workers=1, transport='queue')
+        pool.start()
+        sim = Simulation({'particles': {'1': {'n': 10, 'radius': 5.0, 'mass': 1.0,
+                                              'color': 'red', 'shape': 'Circle'}}},
+                         Bounds(400, 300), pool.work_requested_q, pool.work_completed_q)
+        sim.tick()
+        pool.stop()
+        self.assertTrue(len(sim.pq) >= 10)  # a wall at least for each particle
+
+    def test_queueKill(self):
+        # an idle worker is killed holding the shared queue's lock
+        pool = WorkerPool(num_workers=2, transport='queue')
+        pool.start()
+        time.sleep(0.2)
+        pool.workers[0].kill()
+        deadline = time.perf_counter() + 10.0
+        while pool.supervise() == 0 and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(pool.crashes == 1 and pool.size() == 2)
+        for i in range(0, 20):
+            pool.work_requested_q.put_nowait(WorkRequest(i, 0.0, 1, [None] * 20, []))
+        done = [pool.work_completed_q.get(timeout=10.0) for i in range(0, 20)]
+        self.assertTrue(sorted([msg.particle_index for msg in done]) == list(range(0, 20)))
+        self.assertTrue(pool.work_requested_q.outstanding == {})
+        pool.stop()
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,129 @@
+'''
+Module: toi.py
+Exact time of impact for axis aligned rectangles (against rectangles,
+circles and line segments) using swept separating axis tests, plus the
+circle vs circle case and contact normals.
+
+Every routine works on plain numbers (one pair of shapes at a time)
+relative to the first shape. They return math.inf when the shapes never
+touch and 0.0 when they already overlap and are still closing in (where
+Particle.timeToHit gives the past time they started to overlap).
+'''
+
+import math
+
+
+def slab(p, v, lo, hi):
+    """Times (enter, exit) during which p + v*t lies within [lo, hi]"""
+    if v == 0.0:
+        if lo <= p <= hi:
+            return -math.inf, math.inf
+        return math.inf, -math.inf
+    t0 = (lo - p) / v
+    t1 = (hi - p) / v
+    return (t0, t1) if t0 <= t1 else (t1, t0)
+
+
+def first_contact(t_enter, t_exit, closing):
+    """Turns the overlap interval of a swept test into a time of impact"""
+    if t_enter > t_exit or t_exit <= 0.0:
+        return math.inf
+    if t_enter >= 0.0:
+        return t_enter
+    return 0.0 if closing else math.inf  # already overlapping
+
+
+def circle_circle(dx, dy, dvx, dvy, sigma):
+    """Time until two circles whose radii add up to sigma touch. (dx, dy) and
+    (dvx, dvy) are the position and velocity of the second relative to the first."""
+    dvdr = dx*dvx + dy*dvy
+    if dvdr >= 0:
+        return math.inf
+    dvdv = dvx*dvx + dvy*dvy
+    d = (dvdr*dvdr) - (dvdv * (dx*dx + dy*dy - sigma*sigma))
+    if d <= 0:
+        return math.inf
+    return max(-(dvdr + math.sqrt(d)) / dvdv, 0.0)
+
+
+def rect_rect(dx, dy, dvx, dvy, hw, hh):
+    """Time until two axis aligned rectangles touch. (dx, dy) and (dvx, dvy) are the
+    position and velocity of the second centre relative to the first; hw and hh
+    are the sums of their half widths and half heights."""
+    tx0, tx1 = slab(dx, dvx, -hw, hw)
+    ty0, ty1 = slab(dy, dvy, -hh, hh)
+    return first_contact(max(tx0, ty0), min(tx1, ty1), dx*dvx + dy*dvy < 0)
+
+
+def rect_circle(dx, dy, dvx, dvy, hw, hh, r):
+    """Time until a circle of radius r touches an axis aligned rectangle with half
+    extents hw, hh. (dx, dy) and (dvx, dvy) are the circle centre's position and
+    velocity relative to the rectangle centre. The circle's centre is swept against
+    the rectangle grown by r (straight edges) and then, if it enters through a
+    corner square, against the rounded corner itself."""
+    tx0, tx1 = slab(dx, dvx, -hw - r, hw + r)
+    ty0, ty1 = slab(dy, dvy, -hh - r, hh + r)
+    t_enter = max(tx0, ty0)
+    t_exit = min(tx1, ty1)
+    if t_enter > t_exit or t_exit <= 0.0:
+        return math.inf
+
+    if t_enter < 0.0:
+        # inside the grown rectangle now: check the real (rounded) shape
+        cx = min(max(dx, -hw), hw)
+        cy = min(max(dy, -hh), hh)
+        if (dx - cx)**2 + (dy - cy)**2 <= r*r:
+            return 0.0 if (dx - cx)*dvx + (dy - cy)*dvy < 0 or (cx == dx and cy == dy) else math.inf
+        t_enter = 0.0
+
+    x = dx + dvx * t_enter
+    y = dy + dvy * t_enter
+    if abs(x) <= hw or abs(y) <= hh:
+        return t_enter  # hit a straight edge
+
+    # corner region: sweep the centre against the corner's circle
+    ox = dx - math.copysign(hw, x)
+    oy = dy - math.copysign(hh, y)
+    a = dvx*dvx + dvy*dvy
+    b = ox*dvx + oy*dvy
+    c = ox*ox + oy*oy - r*r
+    d = b*b - a*c
+    if b >= 0 or d < 0 or a == 0:
+        return math.inf
+    return max((-b - math.sqrt(d)) / a, 0.0)
+
+
+def rect_segment(x, y, vx, vy, hw, hh, line):
+    """Time until a moving axis aligned rectangle (centre x, y, velocity vx, vy,
+    half extents hw, hh) touches a static LineSegment. Separating axes are x, y
+    and the segment normal."""
+    tx0, tx1 = slab(x, vx, min(line.p0.x, line.p1.x) - hw, max(line.p0.x, line.p1.x) + hw)
+    ty0, ty1 = slab(y, vy, min(line.p0.y, line.p1.y) - hh, max(line.p0.y, line.p1.y) + hh)
+
+    nx = -line.dy / line.length
+    ny = line.dx / line.length
+    reach = hw * abs(nx) + hh * abs(ny)
+    offset = (x - line.p0.x) * nx + (y - line.p0.y) * ny
+    speed = vx * nx + vy * ny
+    tn0, tn1 = slab(offset, speed, -reach, reach)
+
+    return first_contact(max(tx0, ty0, tn0), min(tx1, ty1, tn1), offset * speed < 0)
+
+
+def rect_rect_normal(dx, dy, hw, hh):
+    """Contact normal (unit vector from the first rectangle towards the second) for
+    two touching axis aligned rectangles: the axis where they overlap the least"""
+    if hw - abs(dx) < hh - abs(dy):
+        return math.copysign(1.0, dx), 0.0
+    return 0.0, math.copysign(1.0, dy)
+
+
+def rect_circle_normal(dx, dy, hw, hh):
+    """Contact normal (unit vector from the rectangle towards the circle) pointing
+    from the closest point of the rectangle to the circle's centre"""
+    ox = dx - min(max(dx, -hw), hw)
+    oy = dy - min(max(dy, -hh), hh)
+    dist = math.hypot(ox, oy)
+    if dist == 0:
+        return rect_rect_normal(dx, dy, hw, hh)  # centre inside: nearest side
+    return ox / dist, oy / dist
@@ -0,0 +1,106 @@
+'''
+Module: toi_arrays.py
+The routines of toi.py over NumPy arrays, for the stepped engine. Each
+element is one pair of shapes and scalars broadcast against the arrays,
+so a whole batch of candidate pairs is swept in one call. Times match
+toi.py element for element, normals up to the rounding of a distance.
+Requires NumPy.
+'''
+
+import numpy as np
+
+
+def slab(p, v, lo, hi):
+    """Times (enter, exit) during which p + v*t lies within [lo, hi]"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t0 = (lo - p) / v
+        t1 = (hi - p) / v
+    still = v == 0.0
+    inside = (lo <= p) & (p <= hi)
+    enter = np.where(still, np.where(inside, -np.inf, np.inf), np.minimum(t0, t1))
+    leave = np.where(still, np.where(inside, np.inf, -np.inf), np.maximum(t0, t1))
+    return enter, leave
+
+
+def first_contact(t_enter, t_exit, closing):
+    """Turns the overlap intervals of swept tests into times of impact"""
+    missed = (t_enter > t_exit) | (t_exit <= 0.0)
+    t = np.where(t_enter >= 0.0, t_enter, np.where(closing, 0.0, np.inf))
+    return np.where(missed, np.inf, t)
+
+
+def rect_rect(dx, dy, dvx, dvy, hw, hh):
+    """See toi.rect_rect"""
+    tx0, tx1 = slab(dx, dvx, -hw, hw)
+    ty0, ty1 = slab(dy, dvy, -hh, hh)
+    return first_contact(np.maximum(tx0, ty0), np.minimum(tx1, ty1), dx*dvx + dy*dvy < 0)
+
+
+def rect_circle(dx, dy, dvx, dvy, hw, hh, r):
+    """See toi.rect_circle"""
+    tx0, tx1 = slab(dx, dvx, -hw - r, hw + r)
+    ty0, ty1 = slab(dy, dvy, -hh - r, hh + r)
+    t_enter = np.maximum(tx0, ty0)
+    t_exit = np.minimum(tx1, ty1)
+    missed = (t_enter > t_exit) | (t_exit <= 0.0)
+
+    # inside the grown rectangle now: the real (rounded) shape decides
+    ox = dx - np.clip(dx, -hw, hw)
+    oy = dy - np.clip(dy, -hh, hh)
+    inside = (t_enter < 0.0) & (ox*ox + oy*oy <= r*r)
+    closing = (ox*dvx + oy*dvy < 0) | ((ox == 0.0) & (oy == 0.0))
+    t_enter = np.maximum(t_enter, 0.0)
+
+    with np.errstate(invalid='ignore'):  # 0 * inf where missed anyway
+        x = dx + dvx * t_enter
+        y = dy + dvy * t_enter
+    edge = (np.abs(x) <= hw) | (np.abs(y) <= hh)
+
+    # corner region: sweep the centre against the corner's circle
+    ox = dx - np.copysign(hw, x)
+    oy = dy - np.copysign(hh, y)
+    a = dvx*dvx + dvy*dvy
+    b = ox*dvx + oy*dvy
+    c = ox*ox + oy*oy - r*r
+    d = b*b - a*c
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corner = np.maximum((-b - np.sqrt(np.maximum(d, 0.0))) / a, 0.0)
+    corner = np.where((b >= 0) | (d < 0) | (a == 0), np.inf, corner)
+
+    t = np.where(edge, t_enter, corner)
+    t = np.where(inside, np.where(closing, 0.0, np.inf), t)
+    return np.where(missed, np.inf, t)
+
+
+def rect_segment(x, y, vx, vy, hw, hh, line):
+    """See toi.rect_segment"""
+    tx0, tx1 = slab(x, vx, min(line.p0.x, line.p1.x) - hw, max(line.p0.x, line.p1.x) + hw)
+    ty0, ty1 = slab(y, vy, min(line.p0.y, line.p1.y) - hh, max(line.p0.y, line.p1.y) + hh)
+
+    nx = -line.dy / line.length
+    ny = line.dx / line.length
+    reach = hw * abs(nx) + hh * abs(ny)
+    offset = (x - line.p0.x) * nx + (y - line.p0.y) * ny
+    speed = vx * nx + vy * ny
+    tn0, tn1 = slab(offset, speed, -reach, reach)
+
+    return first_contact(np.maximum(np.maximum(tx0, ty0), tn0),
+                         np.minimum(np.minimum(tx1, ty1), tn1), offset * speed < 0)
+
+
+def rect_rect_normal(dx, dy, hw, hh):
+    """See toi.rect_rect_normal"""
+    sideways = hw - np.abs(dx) < hh - np.abs(dy)
+    return (np.where(sideways, np.copysign(1.0, dx), 0.0),
+            np.where(sideways, 0.0, np.copysign(1.0, dy)))
+
+
+def rect_circle_normal(dx, dy, hw, hh):
+    """See toi.rect_circle_normal"""
+    ox = dx - np.clip(dx, -hw, hw)
+    oy = dy - np.clip(dy, -hh, hh)
+    dist = np.hypot(ox, oy)
+    centre = dist == 0
+    dist = np.where(centre, 1.0, dist)
+    nx, ny = rect_rect_normal(dx, dy, hw, hh)  # centre inside: nearest side
+    return np.where(centre, nx, ox / dist), np.where(centre, ny, oy / dist)
@@ -195,3 +195,100 @@ class HeaderText(UIBase):
 
     def undraw(self):
         self.text.undraw()
+
+
+class HUD(UIBase):
+    def __init__(self, canvas, point, interval=0.25):
+        """Text overlay of a simulation's observables, refreshed at most once
+        every interval seconds of simulated time"""
+        self.canvas = canvas
+        self.label = Text(point, '')
+        self.label.setSize(10)
+        self.interval = interval
+        self.last_update = None
+
+    def update(self, sim):
+        now = sim.sim_time
+        if self.last_update is not None and now - self.last_update < self.interval:
+            return
+        self.last_update = now
+        obs = sim.observables
+        px, py = obs.momentum()
+        self.label.setText("E {0:.4g}  T {1:.4g}  P {2:.4g}  p ({3:.3g}, {4:.3g})  "
+                           "mixing {5:.3f}/{6:.3f}".format(
+                               obs.energy, obs.temperature(), obs.pressure(), px, py,
+                               sim.mixing.latest(), sim.mixing.limit) + self.workers(sim))
+
+    def workers(self, sim):
+        """The pool's size and its workers' mean utilization, if it has one"""
+        if sim.pool is None:
+            return ''
+        utilization = sim.pool.utilization()
+        busy = sum(utilization.values()) / len(utilization) if utilization else 0.0
+        return "  workers {0} at {1:.0%}".format(sim.pool.size(), busy)
+
+    def draw(self):
+        self.label.draw(self.canvas)
+
+    def undraw(self):
+        self.label.undraw()
+
+
+class SpeedChart(UIBase):
+    def __init__(self, canvas, corner, width=160, height=80, interval=1.0):
+        """Bar chart of a simulation's speed histogram with its top left at
+        corner, with the Maxwell-Boltzmann counts at the current temperature
+        drawn over it. Refreshed at most once every interval seconds of
+        simulated time."""
+        self.canvas = canvas
+        self.corner = corner
+        self.width = width
+        self.height = height
+        self.interval = interval
+        self.last_update = None
+        self.frame = Rectangle(corner, Point(corner.x + width, corner.y + height))
+        self.frame.setFill('white')
+        self.shapes = []
+
+    def update(self, sim):
+        now = sim.sim_time
+        if self.last_update is not None and now - self.last_update < self.interval:
+            return
+        self.last_update = now
+        speeds = sim.observables.speeds
+        expected = speeds.expected(sim.observables.temperature())
+
+        self.undrawShapes()
+        self.shapes = []
+        bar_width = self.width / len(speeds.counts)
+        scale = self.height / max(max(speeds.counts), max(expected), 1)
+        bottom = self.corner.y + self.height
+        for i, count in enumerate(speeds.counts):
+            if count:
+                left = self.corner.x + i * bar_width
+                bar = Rectangle(Point(left, bottom - count * scale),
+                                Point(left + bar_width, bottom))
+                bar.setFill('lightblue')
+                bar.setOutline('lightblue')
+                self.shapes.append(bar)
+        for i in range(0, len(expected) - 1):
+            x = self.corner.x + (i + 0.5) * bar_width
+            ln = Line(Point(x, bottom - expected[i] * scale),
+                      Point(x + bar_width, bottom - expected[i + 1] * scale))
+            ln.setOutline('red')
+            self.shapes.append(ln)
+        for shape in self.shapes:
+            shape.draw(self.canvas)
+
+    def undrawShapes(self):
+        for shape in self.shapes:
+            shape.undraw()
+
+    def draw(self):
+        self.frame.draw(self.canvas)
+        for shape in self.shapes:
+            shape.draw(self.canvas)
+
+    def undraw(self):
+        self.frame.undraw()
+        self.undrawShapes()
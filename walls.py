@@ -1,5 +1,5 @@
-from graphics import Point
 import math_utils
+from math_utils import Point
 
 class WallBase:
     pass
@@ -53,4 +53,34 @@ class LineSegment(WallBase):
         return None
     
     def __eq__(self, other):
-        return self.id == other.id
+        return isinstance(other, WallBase) and self.id == other.id
+
+
+class DiskObstacle(WallBase):
+    """Immovable disc. Lives with the walls so it is never re-predicted
+    and never collides with other obstacles."""
+    def __init__(self, x, y, radius, color=None):
+        self.id = id(self)
+        self.wall_type = "Disk"
+        self.x = x
+        self.y = y
+        self.radius = radius
+        self.color = color
+
+    def __eq__(self, other):
+        return isinstance(other, WallBase) and self.id == other.id
+
+
+class BoxObstacle(WallBase):
+    """Immovable axis aligned rectangle centered on (x, y)"""
+    def __init__(self, x, y, width, height, color=None):
+        self.id = id(self)
+        self.wall_type = "Box"
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.color = color
+
+    def __eq__(self, other):
+        return isinstance(other, WallBase) and self.id == other.id
@@ -0,0 +1,167 @@
+'''
+Module: watchdog.py
+Defines Watchdog, a cheap guard against physics regressions in long runs,
+and PhysicsWarning, the warning it raises.
+
+At most every WATCHDOG_TICKS ticks it checks that the total energy and momentum
+kept by the observables have not drifted (walls take momentum, so it is
+the total with theirs that must hold) and, for a random sample of
+particles, that none has left the box, entered an obstacle or sunk into
+another particle. Each problem is reported through the warnings module
+as a PhysicsWarning carrying what was checked, where and by how much.
+Checks are spaced out further whenever they would otherwise take more
+than OVERHEAD_BUDGET of the simulation's wall time.
+'''
+
+import math
+import random
+import time
+import warnings
+import placement
+
+WATCHDOG_TICKS = 30  # ticks between checks
+WATCHDOG_SAMPLE = 16  # particles checked for containment and overlaps per check
+ENERGY_TOLERANCE = 1e-6  # relative drift of the total energy
+MOMENTUM_TOLERANCE = 1e-6  # drift of the total momentum relative to sum(m |v|)
+OVERLAP_TOLERANCE = 0.05  # overlap depth as a fraction of the two radii
+STEPPED_OVERLAP_TOLERANCE = 0.5  # the stepped engine resolves contacts after they happen
+OVERHEAD_BUDGET = 0.01  # largest share of the wall time spent checking
+
+
+class PhysicsWarning(UserWarning):
+    """check is one of 'energy', 'momentum', 'containment', 'obstacle' or
+    'overlap'. particles holds the indices involved (empty for totals), value
+    is what was measured and limit what it was allowed to be."""
+    def __init__(self, check, time, value, limit, particles=()):
+        self.check = check
+        self.time = time
+        self.value = value
+        self.limit = limit
+        self.particles = tuple(particles)
+        super().__init__("{0} check failed at t={1:.3f}s: {2:.6g} exceeds {3:.6g}{4}".format(
+            check, time, value, limit,
+            " (particles {0})".format(', '.join(map(str, self.particles)))
+            if self.particles else ''))
+
+
+def inner_radius(p):
+    """Radius of the largest disc inside the particle, so overlaps found
+    with it are certain for rectangles too"""
+    if p.shape_type in ["Square", "square", "Rect", "rect"]:
+        return min(p.width, p.height) / 2.0
+    return p.radius
+
+
+class Watchdog:
+    def __init__(self, sim, interval=WATCHDOG_TICKS, sample=WATCHDOG_SAMPLE, seed=0):
+        self.sim = sim
+        self.interval = interval
+        self.sample = sample
+        self.random = random.Random(seed)  # leaves the global generator alone
+        obs = sim.observables
+        self.energy = obs.energy
+        self.px = obs.px + obs.static_px
+        self.py = obs.py + obs.static_py
+        self.momentum_scale = sum([p.mass * math.hypot(p.vx, p.vy) for p in sim.particles])
+        self.box = placement.box_from_walls(sim.walls, sim.window.width, sim.window.height)
+        self.obstacles = [w for w in sim.walls if w.wall_type in ["Disk", "Box"]]
+        self.inner = [inner_radius(p) for p in sim.particles]
+        self.next_check = 0.0  # simulation wall time the next check may run at
+        self.overlap_tolerance = OVERLAP_TOLERANCE
+        self.checks = 0
+        self.violations = []
+        self.time = 0.0  # wall time spent checking
+
+    def tick(self):
+        """Called after every tick, checks every interval ticks"""
+        if self.sim.stepper is not None:
+            # the event engine carries on from the overlaps the stepped engine
+            # leaves behind, so they are allowed for the rest of the run
+            self.overlap_tolerance = STEPPED_OVERLAP_TOLERANCE
+        if self.sim.ticks % self.interval == 0 and self.sim.wall_time >= self.next_check:
+            start = time.perf_counter()
+            self.check()
+            elapsed = time.perf_counter() - start
+            self.time += elapsed
+            self.next_check = self.sim.wall_time + elapsed / OVERHEAD_BUDGET
+
+    def overhead(self):
+        """Share of the simulation's wall time spent in the watchdog"""
+        return self.time / self.sim.wall_time if self.sim.wall_time > 0 else 0.0
+
+    def check(self):
+        """Runs every check once and returns the PhysicsWarnings raised"""
+        self.checks += 1
+        found = []
+        found.extend(self.checkTotals())
+        particles = self.sim.particles
+        for i in self.random.sample(range(0, len(particles)), min(self.sample, len(particles))):
+            found.extend(self.checkParticle(particles[i]))
+        for warning in found:
+            warnings.warn(warning, stacklevel=4)  # points at Simulation.tick's caller
+        self.violations.extend(found)
+        return found
+
+    def checkTotals(self):
+        obs = self.sim.observables
+        now = self.sim.sim_time
+        found = []
+        if self.energy > 0:
+            drift = abs(obs.energy - self.energy) / self.energy
+            if drift > ENERGY_TOLERANCE:
+                found.append(PhysicsWarning('energy', now, drift, ENERGY_TOLERANCE))
+        if self.momentum_scale > 0:
+            drift = math.hypot(obs.px + obs.static_px - self.px,
+                               obs.py + obs.static_py - self.py) / self.momentum_scale
+            if drift > MOMENTUM_TOLERANCE:
+                found.append(PhysicsWarning('momentum', now, drift, MOMENTUM_TOLERANCE))
+        return found
+
+    def checkParticle(self, p):
+        now = self.sim.sim_time
+        xmin, ymin, xmax, ymax = self.box
+        if not (xmin < p.x < xmax and ymin < p.y < ymax):  # also catches NaN
+            outside = max(xmin - p.x, p.x - xmax, ymin - p.y, p.y - ymax, 0.0)
+            return [PhysicsWarning('containment', now, outside, 0.0, [p.index])]
+
+        found = []
+        for obstacle in self.obstacles:
+            if obstacle.wall_type == "Disk":
+                depth = obstacle.radius - math.hypot(p.x - obstacle.x, p.y - obstacle.y)
+            else:
+                depth = min(obstacle.width / 2.0 - abs(p.x - obstacle.x),
+                            obstacle.height / 2.0 - abs(p.y - obstacle.y))
+            if depth > 0:
+                found.append(PhysicsWarning('obstacle', now, depth, 0.0, [p.index]))
+
+        stepper = self.sim.stepper
+        if stepper is not None:
+            # the stepped engine's arrays make checking against all of them
+            # cheap, rectangles go by their inscribed circles here too
+            dx = stepper.x - p.x
+            dy = stepper.y - p.y
+            reach = stepper.inner + stepper.inner[p.index]
+            depth = (reach - (dx*dx + dy*dy) ** 0.5) / reach
+            depth[p.index] = 0.0
+            for i in (depth > self.overlap_tolerance).nonzero()[0].tolist():
+                found.append(PhysicsWarning('overlap', now, float(depth[i]),
+                                            self.overlap_tolerance, [p.index, i]))
+            return found
+
+        particles = self.sim.particles
+        inner = self.inner
+        r = inner[p.index]
+        x = p.x
+        y = p.y
+        neighbors = self.sim.neighbors is not None and p.neighbors is not None
+        for i in p.neighbors if neighbors else range(0, len(particles)):
+            q = particles[i]
+            reach = r + inner[i]
+            dx = q.x - x
+            dy = q.y - y
+            if dx*dx + dy*dy < reach*reach and q is not p:
+                depth = (reach - math.hypot(dx, dy)) / reach
+                if depth > self.overlap_tolerance:
+                    found.append(PhysicsWarning('overlap', now, depth, self.overlap_tolerance,
+                                                [p.index, i]))
+        return found
@@ -1,7 +1,299 @@
+import heapq
+import math
+import pickle
+import weakref
+from multiprocessing import shared_memory
+
+LATE_POLICIES = ['backdate', 'block', 'inline']
+MAX_REPLAYS = 3  # times a particle's lost request is submitted again before giving up
+
+# what a worker process publishes about itself in a shared array of doubles
+STATUS_BUSY = 0  # seconds spent computing
+STATUS_BEAT = 1  # time.time() the current request was started at, 0 while idle
+STATUS_INDEX = 2  # particle index of the current request
+STATUS_COUNT = 3  # and its collisionCnt, -1 for none
+STATUS_SIZE = 4
+
+
 class WorkRequest():
-    def __init__(self, particle_index, time, limit, particles, walls):
+    def __init__(self, particle_index, time, limit, particles, walls, candidates=None,
+                 batch=None, count=None, counts_name=None):
         self.particle_index = particle_index
-        self.time = time 
+        self.time = time
         self.limit = limit
         self.particles = particles
-        self.walls = walls
\ No newline at end of file
+        self.walls = walls
+        self.candidates = candidates  # indices to re-check after a neighbor list refresh
+        self.batch = batch  # indices re-predicted alongside (see CollisionSystem.predict)
+        self.count = count  # the particle's collisionCnt when requested
+        self.counts_name = counts_name  # SharedCounts holding the live collisionCnts
+        self.snapshot = None  # the particles pickled when dispatched, replacing particles
+
+    def world(self):
+        """The particles as they were when the request was dispatched"""
+        if self.snapshot is not None:
+            self.particles = pickle.loads(self.snapshot)
+            self.snapshot = None
+        return self.particles
+
+    def isStale(self):
+        """True if the particle has bounced since the request was made, so
+        its prediction would be thrown away on arrival"""
+        if self.count is None:
+            return False
+        if self.counts_name is not None:
+            return SharedCounts.attach(self.counts_name)[self.particle_index] != self.count
+        if self.snapshot is not None:
+            return False  # no shared memory to check, the snapshot was current when sent
+        # computed in the requesting process: the particles are the live ones
+        return self.particles[self.particle_index].collisionCnt != self.count
+
+
+class WorkDone():
+    """Sent back after the events of every request, or instead of them if the
+    request went stale before it was computed (dropped)"""
+    def __init__(self, particle_index, dropped=False):
+        self.particle_index = particle_index
+        self.dropped = dropped
+
+
+class WorkLost():
+    """Stands in for the WorkDone of a request whose worker died before
+    finishing it. count is the particle's collisionCnt when requested."""
+    def __init__(self, particle_index, count=None):
+        self.particle_index = particle_index
+        self.count = count
+
+
+def release(shm, counts, unlink):
+    counts.release()
+    shm.close()
+    if unlink:
+        shm.unlink()
+
+
+class SharedCounts():
+    """collisionCnt of every particle in shared memory, so worker processes can
+    tell a request has gone stale while it waited in the queue"""
+    attached = {}  # name -> SharedCounts, in worker processes
+
+    def __init__(self, n, name=None):
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=8 * max(n, 1))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.counts = self.shm.buf.cast('q')
+        weakref.finalize(self, release, self.shm, self.counts, name is None)
+
+    def attach(name):
+        if name not in SharedCounts.attached:
+            SharedCounts.attached.clear()  # a worker serves one simulation at a time
+            SharedCounts.attached[name] = SharedCounts(0, name)
+        return SharedCounts.attached[name]
+
+    def __getitem__(self, i):
+        return self.counts[i]
+
+    def __setitem__(self, i, count):
+        self.counts[i] = count
+
+    def create(n):
+        """SharedCounts for n particles, or None where shared memory can't
+        be created (see ring.available)"""
+        try:
+            return SharedCounts(n)
+        except (OSError, ValueError):
+            return None
+
+
+class WorkTracker():
+    """Makes the WorkRequests of a simulation, hands them to the work queue
+    most urgent first and counts the prediction work that went to waste.
+
+    Submitted requests wait in a heap ordered by a deadline, an estimate of
+    how soon the particle could next collide: the time since its previous
+    bounce or, if sooner, until it reaches a boundary wall. At most depth
+    requests are in the work queue at once (None for no limit), so an urgent
+    request never waits behind a long FIFO backlog. shared says the requests
+    are computed by worker processes. Where shared memory is available the
+    live collisionCnts are then published through SharedCounts for the
+    workers to check, otherwise they compute stale requests too and the
+    results are thrown away on arrival.
+
+    policy says what to do about results that could arrive after they are
+    due: 'backdate' handles them late, stepping the particles back to the
+    moment of impact, 'block' makes every tick wait for the requests still
+    outstanding, as any of them could hold an event due within it (see
+    CollisionSystem.awaitOutstandingWork), and 'inline' computes requests
+    due before the end of the next tick in this process.
+
+    resident says the workers keep their own copy of the particles (see
+    domains.py): instead of a snapshot the work queue is then published
+    the particles submitted since the previous dispatch."""
+    def __init__(self, particles, walls=(), shared=False, time_per_tick=1.0/60, depth=None,
+                 policy='backdate', resident=False):
+        if policy not in LATE_POLICIES:
+            raise ValueError("unknown late policy '{0}', choose from {1}".format(
+                policy, ', '.join(LATE_POLICIES)))
+        self.particles = particles
+        self.workers = shared
+        self.shared = SharedCounts.create(len(particles)) if shared and particles else None
+        self.time_per_tick = time_per_tick
+        self.depth = depth
+        self.policy = policy
+        self.walls = walls
+        self.resident = resident
+        self.changed = set()  # indices submitted since the previous dispatch
+        self.limit = math.inf  # of the latest request, lost ones are submitted again with it
+        self.vwalls = [w.x for w in walls if w.wall_type == "VWall"]
+        self.hwalls = [w.y for w in walls if w.wall_type == "HWall"]
+        self.last_bounce = [None] * len(particles)  # time of the latest bounce request
+        self.pending = []  # (deadline, sequence, request)
+        self.sequence = 0
+        self.in_flight = 0
+        self.requested = 0
+        self.coalesced = 0  # bounces that shared a re-prediction with an earlier one
+        self.dropped = 0  # requests skipped because they went stale while queued
+        self.stale_results = 0  # events that were stale when they arrived
+        self.late_events = 0  # collisions handled after the tick they were due in
+        self.max_lateness = 0.0
+        self.lost = 0  # requests whose worker died before finishing them
+        self.replayed = 0  # lost requests submitted again
+        self.replays = {}  # particle index -> times its lost requests were submitted again
+        self.late_results = 0  # events that arrived after the tick they were due in
+        self.max_result_lateness = 0.0
+        self.fallbacks = 0  # ticks blocked or requests computed inline by the policy
+        self.block_timeouts = 0
+        self.sync()
+
+    def sync(self):
+        """Publishes every particle's collisionCnt"""
+        if self.shared is not None:
+            for p in self.particles:
+                self.shared[p.index] = p.collisionCnt
+        if self.resident:
+            self.changed.update(range(0, len(self.particles)))
+
+    def request(self, a, time, limit, walls, candidates=None, batch=None):
+        count = self.particles[a].collisionCnt
+        self.limit = limit
+        if self.shared is not None:
+            self.shared[a] = count
+        self.requested += 1
+        return WorkRequest(a, time, limit, self.particles, walls, candidates, batch, count,
+                           None if self.shared is None else self.shared.name)
+
+    def deadline(self, a, now):
+        """Earliest time particle a is expected to need its prediction by"""
+        p = self.particles[a]
+        soon = math.inf
+        if self.last_bounce[a] is not None and now > self.last_bounce[a]:
+            soon = now - self.last_bounce[a]
+        for x in self.vwalls:
+            if (x - p.x) * p.vx > 0:
+                soon = min(soon, (abs(x - p.x) - p.radius) / abs(p.vx))
+        for y in self.hwalls:
+            if (y - p.y) * p.vy > 0:
+                soon = min(soon, (abs(y - p.y) - p.radius) / abs(p.vy))
+        return now + max(soon, 0.0)
+
+    def submit(self, a, time, limit, walls, candidates=None, batch=None, bounced=False):
+        """Queues a request for particle a to be dispatched by urgency. bounced
+        says a bounced, only then does the request start a new interval for
+        deadline() (a refresh or a replay says nothing about collision rates)"""
+        request = self.request(a, time, limit, walls, candidates, batch)
+        heapq.heappush(self.pending, (self.deadline(a, time), self.sequence, request))
+        if bounced:
+            self.last_bounce[a] = time
+        self.sequence += 1
+        if self.resident:
+            self.changed.add(a)
+
+    def dispatch(self, work_q, now=None):
+        """Moves the most urgent pending requests into work_q, up to depth in
+        flight. Under the 'inline' policy requests due before the end of the
+        next tick are returned instead, for the caller to compute.
+
+        now is the time the particles are at. Requests for worker processes
+        are then restamped with it and carry one snapshot of the particles
+        pickled here, as a multiprocessing queue would only pickle them later
+        from its feeder thread while the particles keep moving. Resident
+        workers are sent the particles that changed instead. Requests gone
+        stale while pending are dropped without being sent."""
+        urgent = []
+        snapshot = None
+        if self.resident and now is not None:
+            work_q.publish(self.particles, self.walls, self.changed, now)
+            self.changed = set()
+        while self.pending and (self.depth is None or self.in_flight < self.depth):
+            deadline, sequence, request = heapq.heappop(self.pending)
+            if self.particles[request.particle_index].collisionCnt != request.count:
+                self.dropped += 1
+                continue
+            self.in_flight += 1
+            if self.policy == 'inline' and deadline < request.time + self.time_per_tick:
+                self.fallbacks += 1
+                urgent.append(request)
+                continue
+            if self.workers and now is not None:
+                request.time = now
+                if not self.resident:
+                    if snapshot is None:
+                        snapshot = pickle.dumps(self.particles, pickle.HIGHEST_PROTOCOL)
+                    request.particles = None
+                    request.snapshot = snapshot
+            work_q.put_nowait(request)
+        return urgent
+
+    def done(self, message):
+        """Called with the WorkDone that ends every request"""
+        self.in_flight -= 1
+        if message.dropped:
+            self.dropped += 1
+
+    def lostWork(self, message, now):
+        """Called with the WorkLost of a request that will never finish.
+        Submits it again unless the particle bounced since or its requests
+        were lost MAX_REPLAYS times already."""
+        self.in_flight -= 1
+        self.lost += 1
+        a = message.particle_index
+        if not 0 <= a < len(self.particles) or self.particles[a].collisionCnt != message.count:
+            return
+        if self.replays.get(a, 0) >= MAX_REPLAYS:
+            return
+        self.replays[a] = self.replays.get(a, 0) + 1
+        self.replayed += 1
+        self.submit(a, now, self.limit, self.walls)
+
+    def arrived(self, evt, now):
+        """Called for every valid event received at the tick ending at now"""
+        lateness = now - self.time_per_tick - evt.time
+        if lateness > 0:
+            self.late_results += 1
+            self.max_result_lateness = max(self.max_result_lateness, lateness)
+
+    def handled(self, evt, now):
+        """Called for every collision handled in the tick ending at now"""
+        lateness = now - self.time_per_tick - evt.time
+        if lateness > 0:
+            self.late_events += 1
+            self.max_lateness = max(self.max_lateness, lateness)
+
+    def summary(self):
+        return {
+            'predictions_requested': self.requested,
+            'predictions_coalesced': self.coalesced,
+            'predictions_dropped': self.dropped,
+            'stale_results': self.stale_results,
+            'late_events': self.late_events,
+            'max_lateness': self.max_lateness,
+            'requests_lost': self.lost,
+            'requests_replayed': self.replayed,
+            'late_policy': self.policy,
+            'late_results': self.late_results,
+            'max_result_lateness': self.max_result_lateness,
+            'late_fallbacks': self.fallbacks,
+            'block_timeouts': self.block_timeouts,
+        }